@@ -0,0 +1,444 @@
+import argparse
+import hashlib
+import json
+import statistics
+from pathlib import Path
+from timeit import default_timer as timer
+
+import datasets
+import numpy as np
+from datasets import Dataset
+
+from question_answering.benchmarks import synthetic_data
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import (
+    core_preprocessing,
+    core_qa_utils,
+    predictions,
+    squad2_metrics,
+    squad2_preprocessing,
+    squad_metrics,
+    squad_preprocessing,
+)
+
+default_sizes = [1000, 10000]
+default_max_length = 384
+default_stride = 128
+default_baseline_path = extractive_qa_paths.benchmarks_dir / "hot_paths_baseline.json"
+default_reference_hashes_path = (
+    extractive_qa_paths.benchmarks_dir / "hot_paths_reference_hashes.json"
+)
+reference_config_keys = ["max_length", "stride", "seed"]
+# Metric cases finish in microseconds, too fast for a stable throughput gate
+throughput_gated_case_prefixes = ("preprocess_", "get_predicted_texts")
+
+
+def get_context_word_range(max_length: int):
+    # Leaves room for the question, sentence ends and special tokens
+    max_context_words = max_length * 3 // 4
+    return max_context_words // 6, max_context_words
+
+
+def create_fixtures(
+    num_examples: int,
+    tokenizer,
+    max_length: int = default_max_length,
+    stride: int = default_stride,
+    seed: int = 42,
+):
+    squad_examples = synthetic_data.generate_squad_examples(
+        num_examples, squad2=False, seed=seed
+    )
+    # Without a stride, samples over max_length are dropped as in the notebooks
+    squad_no_stride_examples = core_preprocessing.filter_samples_below_number_of_tokens(
+        tokenizer=tokenizer,
+        dataset=synthetic_data.generate_squad_examples(
+            num_examples,
+            squad2=False,
+            seed=seed,
+            context_word_range=get_context_word_range(max_length),
+        ),
+        max_tokens=max_length,
+    )
+    squad2_examples = core_preprocessing.filter_samples_below_number_of_tokens(
+        tokenizer=tokenizer,
+        dataset=synthetic_data.generate_squad_examples(
+            num_examples,
+            squad2=True,
+            seed=seed,
+            context_word_range=get_context_word_range(max_length),
+        ),
+        max_tokens=max_length,
+    )
+    # Test features are the inputs of decoding and of the position metrics
+    squad_features = squad_preprocessing.preprocess_squad_test_dataset(
+        dataset=squad_examples,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        stride=stride,
+        remove_columns=squad_examples.column_names,
+    )
+    squad2_features = squad2_preprocessing.preprocess_squad2_test_dataset_no_stride(
+        dataset=squad2_examples,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        remove_columns=squad2_examples.column_names,
+    )
+
+    return {
+        "squad_examples": squad_examples,
+        "squad_no_stride_examples": squad_no_stride_examples,
+        "squad2_examples": squad2_examples,
+        "squad_features": squad_features,
+        "squad2_features": squad2_features,
+        "squad_logits": synthetic_data.generate_logits(squad_features, seed=seed),
+        "squad2_logits": synthetic_data.generate_logits(squad2_features, seed=seed),
+        "squad_positions": synthetic_data.generate_positions(squad_features, seed),
+        "squad2_positions": synthetic_data.generate_positions(squad2_features, seed),
+        "squad_predicted_texts": synthetic_data.generate_predicted_texts(
+            squad_examples, seed=seed
+        ),
+        "squad2_predicted_texts": synthetic_data.generate_predicted_texts(
+            squad2_examples, seed=seed
+        ),
+    }
+
+
+def get_benchmark_cases(
+    tokenizer, max_length: int = default_max_length, stride: int = default_stride
+):
+    # Each case builds fresh arguments per run, so runs cannot share state
+    def preprocessing_case(function, examples_key: str, **kwargs):
+        return lambda fixtures: (
+            function,
+            dict(
+                dataset=fixtures[examples_key],
+                tokenizer=tokenizer,
+                max_length=max_length,
+                remove_columns=fixtures[examples_key].column_names,
+                **kwargs,
+            ),
+        )
+
+    def decoding_case(function, squad2: bool):
+        prefix = "squad2" if squad2 else "squad"
+        return lambda fixtures: (
+            function,
+            dict(
+                start_logits=fixtures[f"{prefix}_logits"][0],
+                end_logits=fixtures[f"{prefix}_logits"][1],
+                features=fixtures[f"{prefix}_features"],
+                examples=fixtures[f"{prefix}_examples"],
+            ),
+        )
+
+    def positions_case(function, squad2: bool):
+        prefix = "squad2" if squad2 else "squad"
+        return lambda fixtures: (
+            function,
+            dict(
+                start_actual=fixtures[f"{prefix}_features"]["start_positions"],
+                end_actual=fixtures[f"{prefix}_features"]["end_positions"],
+                start_preds=fixtures[f"{prefix}_positions"][0],
+                end_preds=fixtures[f"{prefix}_positions"][1],
+            ),
+        )
+
+    def texts_case(function, squad2: bool):
+        prefix = "squad2" if squad2 else "squad"
+        return lambda fixtures: (
+            function,
+            dict(
+                answers=fixtures[f"{prefix}_examples"]["answer_text"],
+                predicted_texts=fixtures[f"{prefix}_predicted_texts"],
+                normalize=True,
+            ),
+        )
+
+    return {
+        "preprocess_squad_training_dataset": preprocessing_case(
+            squad_preprocessing.preprocess_squad_training_dataset,
+            examples_key="squad_examples",
+            stride=stride,
+        ),
+        "preprocess_squad_test_dataset": preprocessing_case(
+            squad_preprocessing.preprocess_squad_test_dataset,
+            examples_key="squad_examples",
+            stride=stride,
+        ),
+        "preprocess_squad_training_dataset_no_stride": preprocessing_case(
+            squad_preprocessing.preprocess_squad_training_dataset_no_stride,
+            examples_key="squad_no_stride_examples",
+        ),
+        "preprocess_squad_test_dataset_no_stride": preprocessing_case(
+            squad_preprocessing.preprocess_squad_test_dataset_no_stride,
+            examples_key="squad_no_stride_examples",
+        ),
+        "preprocess_squad2_training_dataset_no_stride": preprocessing_case(
+            squad2_preprocessing.preprocess_squad2_training_dataset_no_stride,
+            examples_key="squad2_examples",
+        ),
+        "preprocess_squad2_test_dataset_no_stride": preprocessing_case(
+            squad2_preprocessing.preprocess_squad2_test_dataset_no_stride,
+            examples_key="squad2_examples",
+        ),
+        "get_predicted_texts": decoding_case(
+            predictions.get_predicted_texts, squad2=False
+        ),
+        "get_predicted_texts_squad2": decoding_case(
+            predictions.get_predicted_texts_squad2, squad2=True
+        ),
+        "squad_metrics.calculate_squad_metrics_stats": positions_case(
+            squad_metrics.calculate_squad_metrics_stats, squad2=False
+        ),
+        "squad_metrics.calculate_squad_accuracies": positions_case(
+            squad_metrics.calculate_squad_accuracies, squad2=False
+        ),
+        "squad_metrics.calculate_squad_qa_metrics": texts_case(
+            squad_metrics.calculate_squad_qa_metrics, squad2=False
+        ),
+        "squad_metrics.get_is_correctly_predicted": texts_case(
+            squad_metrics.get_is_correctly_predicted, squad2=False
+        ),
+        "squad2_metrics.calculate_squad_metrics_stats": positions_case(
+            squad2_metrics.calculate_squad_metrics_stats, squad2=True
+        ),
+        "squad2_metrics.calculate_squad_accuracies": positions_case(
+            squad2_metrics.calculate_squad_accuracies, squad2=True
+        ),
+        "squad2_metrics.calculate_squad_qa_metrics": texts_case(
+            squad2_metrics.calculate_squad_qa_metrics, squad2=True
+        ),
+        "squad2_metrics.get_is_correctly_predicted": texts_case(
+            squad2_metrics.get_is_correctly_predicted, squad2=True
+        ),
+    }
+
+
+def get_output_hash(output):
+    return hashlib.sha256(
+        json.dumps(__to_hashable(output), sort_keys=True).encode()
+    ).hexdigest()
+
+
+def time_case(
+    case,
+    fixtures: dict,
+    num_examples: int,
+    repeats: int = 3,
+    min_total_time: float = 1.0,
+):
+    times = []
+    output_hash = None
+    # Fast cases keep repeating until the time budget is used up
+    while len(times) < repeats or sum(times) < min_total_time:
+        function, kwargs = case(fixtures)
+        start_time = timer()
+        output = function(**kwargs)
+        times.append(timer() - start_time)
+        if output_hash is None:
+            output_hash = get_output_hash(output)
+
+    # The fastest run is the least disturbed by the rest of the machine
+    best_time = min(times)
+    return {
+        "best_time": best_time,
+        "median_time": statistics.median(times),
+        "repeats": len(times),
+        "examples_per_second": num_examples / best_time,
+        "output_hash": output_hash,
+    }
+
+
+def run_benchmarks(
+    sizes: list[int] = default_sizes,
+    cases: list[str] | None = None,
+    repeats: int = 3,
+    min_total_time: float = 1.0,
+    max_length: int = default_max_length,
+    stride: int = default_stride,
+    seed: int = 42,
+):
+    datasets.disable_progress_bar()
+    tokenizer = synthetic_data.create_tiny_tokenizer()
+    benchmark_cases = get_benchmark_cases(tokenizer, max_length, stride)
+    case_names = cases or list(benchmark_cases)
+
+    results = {case_name: {} for case_name in case_names}
+    for num_examples in sizes:
+        fixtures = create_fixtures(num_examples, tokenizer, max_length, stride, seed)
+        for case_name in case_names:
+            results[case_name][str(num_examples)] = time_case(
+                benchmark_cases[case_name],
+                fixtures,
+                num_examples,
+                repeats,
+                min_total_time,
+            )
+            print(
+                f"{case_name} [{num_examples}]: "
+                f"{results[case_name][str(num_examples)]['examples_per_second']:.1f}"
+                " examples/s"
+            )
+
+    return {
+        "config": {
+            "sizes": sizes,
+            "repeats": repeats,
+            "min_total_time": min_total_time,
+            "max_length": max_length,
+            "stride": stride,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def get_reference_hashes(benchmark_data: dict):
+    return {
+        "config": {key: benchmark_data["config"][key] for key in reference_config_keys},
+        "output_hashes": {
+            case_name: {
+                size: result["output_hash"] for size, result in size_results.items()
+            }
+            for case_name, size_results in benchmark_data["results"].items()
+        },
+    }
+
+
+def compare_with_reference_hashes(benchmark_data: dict, reference_data: dict):
+    # Reference hashes come from the original implementations, not from an
+    # earlier run, so an optimization cannot change outputs unnoticed
+    if any(
+        benchmark_data["config"][key] != reference_data["config"][key]
+        for key in reference_config_keys
+    ):
+        print("Output hashes not checked, the reference uses another config")
+        return []
+    failures = []
+    for case_name, size_results in benchmark_data["results"].items():
+        for size, result in size_results.items():
+            reference_hash = (
+                reference_data["output_hashes"].get(case_name, {}).get(size)
+            )
+            if reference_hash is not None and result["output_hash"] != reference_hash:
+                failures.append(f"{case_name} [{size}]: output differs from reference")
+    return failures
+
+
+def compare_with_baseline(
+    benchmark_data: dict, baseline_data: dict, max_slowdown: float = 0.25
+):
+    failures = []
+    for case_name, size_results in benchmark_data["results"].items():
+        if not case_name.startswith(throughput_gated_case_prefixes):
+            continue
+        for size, result in size_results.items():
+            baseline_result = baseline_data["results"].get(case_name, {}).get(size)
+            if baseline_result is None:
+                continue
+            min_throughput = baseline_result["examples_per_second"] * (1 - max_slowdown)
+            if result["examples_per_second"] < min_throughput:
+                failures.append(
+                    f"{case_name} [{size}]: {result['examples_per_second']:.1f} "
+                    f"examples/s, baseline "
+                    f"{baseline_result['examples_per_second']:.1f} examples/s"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark preprocessing, decoding and metric hot paths."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--cases", nargs="+", default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-total-time", type=float, default=1.0)
+    parser.add_argument("--max-length", type=int, default=default_max_length)
+    parser.add_argument("--stride", type=int, default=default_stride)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-slowdown", type=float, default=0.25)
+    parser.add_argument("--baseline-path", type=Path, default=default_baseline_path)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--reference-hashes-path", type=Path, default=default_reference_hashes_path
+    )
+    parser.add_argument("--update-reference-hashes", action="store_true")
+    parser.add_argument("--output-name", default="hot_paths_latest.json")
+    args = parser.parse_args()
+
+    benchmark_data = run_benchmarks(
+        sizes=args.sizes,
+        cases=args.cases,
+        repeats=args.repeats,
+        min_total_time=args.min_total_time,
+        max_length=args.max_length,
+        stride=args.stride,
+        seed=args.seed,
+    )
+    core_qa_utils.save_dict_as_json(
+        benchmark_data,
+        dir_path=extractive_qa_paths.benchmarks_dir,
+        filename=args.output_name,
+    )
+
+    if args.update_reference_hashes:
+        reference_data = get_reference_hashes(benchmark_data)
+        core_qa_utils.save_dict_as_json(
+            reference_data,
+            dir_path=args.reference_hashes_path.parent,
+            filename=args.reference_hashes_path.name,
+        )
+        print(f"Reference hashes saved to {args.reference_hashes_path}")
+    failures = compare_with_reference_hashes(
+        benchmark_data, core_qa_utils.read_json_as_dict(args.reference_hashes_path)
+    )
+
+    # Throughput depends on the machine, so the baseline is recorded explicitly
+    # on it rather than taken from whichever run happens to come first
+    if args.update_baseline:
+        core_qa_utils.save_dict_as_json(
+            benchmark_data,
+            dir_path=args.baseline_path.parent,
+            filename=args.baseline_path.name,
+        )
+        print(f"Baseline saved to {args.baseline_path}")
+    elif not args.baseline_path.is_file():
+        failures.append(
+            f"No throughput baseline at {args.baseline_path}, "
+            "record one on this machine with --update-baseline"
+        )
+    else:
+        failures += compare_with_baseline(
+            benchmark_data,
+            core_qa_utils.read_json_as_dict(args.baseline_path),
+            max_slowdown=args.max_slowdown,
+        )
+    for failure in failures:
+        print(failure)
+    if len(failures) > 0:
+        raise Exception(
+            "Hot path benchmarks regressed against the reference or baseline!"
+        )
+
+
+def __to_hashable(output):
+    if isinstance(output, Dataset):
+        return __to_hashable(output.to_dict())
+    if isinstance(output, dict):
+        return {str(key): __to_hashable(value) for key, value in output.items()}
+    if isinstance(output, (list, tuple)):
+        return [__to_hashable(value) for value in output]
+    if isinstance(output, np.ndarray):
+        return __to_hashable(output.tolist())
+    if isinstance(output, (float, np.floating)):
+        # Rounded, so summation order noise does not count as a changed output
+        return round(float(output), 10)
+    if isinstance(output, np.integer):
+        return int(output)
+    return output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+from transformers import AutoTokenizer, TFAutoModelForQuestionAnswering
+
+from question_answering.benchmarks import synthetic_data
+from question_answering.inference import qa_inference
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import core_qa_utils, model_registry, runtime_config
+
+default_batch_sizes = [1, 8, 32]
+default_sequence_lengths = [384, 256, 128]
+default_thread_configs = ["0:0", "auto", "1:1"]
+stages = ["tokenize", "model", "decode"]
+
+
+def parse_thread_config(thread_config: str):
+    # "intra:inter", "0:0" keeps TensorFlow's defaults, "auto" uses runtime_config
+    if thread_config == "auto":
+        config = runtime_config.get_runtime_config()
+        return config["intra_op_threads"], config["inter_op_threads"]
+    intra_op_threads, inter_op_threads = thread_config.split(":")
+    return int(intra_op_threads), int(inter_op_threads)
+
+
+def load_reader(
+    model_checkpoint: str | None = None,
+    model_name: str | None = None,
+    sequence_length: int = 512,
+):
+    if model_checkpoint is None:
+        tokenizer = synthetic_data.create_tiny_tokenizer()
+        return tokenizer, synthetic_data.create_tiny_qa_model(
+            tokenizer, max_position_embeddings=max(sequence_length, 512)
+        )
+    tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+    # Without a saved model name the checkpoint itself is measured
+    if model_name is None:
+        return tokenizer, TFAutoModelForQuestionAnswering.from_pretrained(
+            model_checkpoint
+        )
+    return tokenizer, model_registry.get_model(
+        model_checkpoint=model_checkpoint, model_name=model_name
+    )
+
+
+def load_requests(
+    dataset_dir: Path | None = None,
+    filename: str = "original_test.json",
+    num_examples: int = 512,
+    seed: int = 42,
+):
+    if dataset_dir is None:
+        examples = synthetic_data.generate_squad_examples(num_examples, seed=seed)
+    else:
+        examples = core_qa_utils.load_datasets_from_json(
+            dataset_path=dataset_dir, filenames=[filename]
+        )[0]
+        examples = examples.shuffle(seed=seed).select(
+            range(min(num_examples, len(examples)))
+        )
+    return examples["id"], examples["question"], examples["context"]
+
+
+def measure_latency(
+    model,
+    tokenizer,
+    requests: tuple[list[str], list[str], list[str]],
+    batch_size: int,
+    sequence_length: int,
+    num_requests: int = 50,
+    num_warmup_requests: int = 3,
+    squad2: bool = False,
+):
+    example_ids, questions, contexts = requests
+    # Shorter sequences split long contexts into more windows, which is part of the cost
+    stride = sequence_length // 4
+    latencies = []
+    stage_times = {stage: [] for stage in stages}
+    num_features = []
+
+    for request_index in range(num_warmup_requests + num_requests):
+        first = (request_index * batch_size) % max(len(questions) - batch_size, 1)
+        batch = slice(first, first + batch_size)
+
+        start_time = timer()
+        features = qa_inference.tokenize_qa_pairs(
+            tokenizer=tokenizer,
+            questions=questions[batch],
+            contexts=contexts[batch],
+            example_ids=example_ids[batch],
+            max_length=sequence_length,
+            stride=stride,
+        )
+        tokenize_time = timer()
+        start_logits, end_logits = qa_inference.predict_feature_logits(
+            model=model, features=features, batch_size=len(features["input_ids"])
+        )
+        model_time = timer()
+        qa_inference.decode_predicted_texts(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=features,
+            example_ids=example_ids[batch],
+            contexts=contexts[batch],
+            squad2=squad2,
+        )
+        decode_time = timer()
+
+        if request_index < num_warmup_requests:
+            continue
+        latencies.append(decode_time - start_time)
+        stage_times["tokenize"].append(tokenize_time - start_time)
+        stage_times["model"].append(model_time - tokenize_time)
+        stage_times["decode"].append(decode_time - model_time)
+        num_features.append(len(features["input_ids"]))
+
+    latencies = np.array(latencies)
+    result = {
+        "batch_size": batch_size,
+        "sequence_length": sequence_length,
+        "num_requests": num_requests,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "mean_ms": float(latencies.mean() * 1000),
+        "examples_per_second": batch_size * num_requests / float(latencies.sum()),
+        "features_per_request": float(np.mean(num_features)),
+    }
+    for stage in stages:
+        result[f"{stage}_ms"] = float(np.mean(stage_times[stage]) * 1000)
+        result[f"{stage}_share"] = float(np.sum(stage_times[stage]) / latencies.sum())
+    return result
+
+
+def run_worker(args):
+    # Thread pools are fixed once TensorFlow runs its first op, hence a fresh process
+    if args.intra_op_threads > 0 or args.inter_op_threads > 0:
+        runtime_config.apply_runtime_config(
+            runtime_config.get_runtime_config(
+                intra_op_threads=args.intra_op_threads or None,
+                inter_op_threads=args.inter_op_threads or None,
+            )
+        )
+
+    tokenizer, model = load_reader(
+        model_checkpoint=args.model_checkpoint,
+        model_name=args.model_name,
+        sequence_length=max(args.sequence_lengths),
+    )
+    requests = load_requests(
+        dataset_dir=args.dataset_dir,
+        filename=args.filename,
+        num_examples=args.num_examples,
+        seed=args.seed,
+    )
+
+    results = []
+    for sequence_length in args.sequence_lengths:
+        for batch_size in args.batch_sizes:
+            result = measure_latency(
+                model=model,
+                tokenizer=tokenizer,
+                requests=requests,
+                batch_size=batch_size,
+                sequence_length=sequence_length,
+                num_requests=args.num_requests,
+                num_warmup_requests=args.num_warmup_requests,
+                squad2=args.squad2,
+            )
+            result["intra_op_threads"] = args.intra_op_threads
+            result["inter_op_threads"] = args.inter_op_threads
+            results.append(result)
+
+    with open(args.worker_output, "w") as fp:
+        json.dump(results, fp)
+
+
+def run_thread_config(args, thread_config: str):
+    intra_op_threads, inter_op_threads = parse_thread_config(thread_config)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        worker_output = Path(temporary_dir) / "results.json"
+        env = dict(os.environ)
+        if intra_op_threads > 0 or inter_op_threads > 0:
+            env.update(
+                runtime_config.get_runtime_environ(
+                    runtime_config.get_runtime_config(
+                        intra_op_threads=intra_op_threads or None,
+                        inter_op_threads=inter_op_threads or None,
+                    )
+                )
+            )
+        command = [
+            sys.executable,
+            "-m",
+            "question_answering.benchmarks.inference_latency_benchmark",
+            "--worker-output",
+            str(worker_output),
+            "--intra-op-threads",
+            str(intra_op_threads),
+            "--inter-op-threads",
+            str(inter_op_threads),
+        ] + __get_forwarded_args(args)
+        subprocess.run(command, env=env, cwd=extractive_qa_paths.root, check=True)
+        with open(worker_output, "r") as fp:
+            return json.load(fp)
+
+
+def get_results_table(results: list[dict]):
+    columns = (
+        ["intra_op_threads", "inter_op_threads", "batch_size", "sequence_length"]
+        + ["p50_ms", "p95_ms", "p99_ms", "examples_per_second"]
+        + [f"{stage}_share" for stage in stages]
+    )
+    return pd.DataFrame(results)[columns].round(3)
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure CPU reader latency over batch sizes, sequence lengths "
+        "and thread configurations."
+    )
+    parser.add_argument("--model-checkpoint", default=None)
+    parser.add_argument("--model-name", default=None)
+    parser.add_argument("--dataset-dir", type=Path, default=None)
+    parser.add_argument("--filename", default="original_test.json")
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--num-examples", type=int, default=512)
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=default_batch_sizes
+    )
+    parser.add_argument(
+        "--sequence-lengths", type=int, nargs="+", default=default_sequence_lengths
+    )
+    parser.add_argument("--thread-configs", nargs="+", default=default_thread_configs)
+    parser.add_argument("--num-requests", type=int, default=50)
+    parser.add_argument("--num-warmup-requests", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-name", default="inference_latency.json")
+    parser.add_argument("--worker-output", type=Path, default=None)
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+
+    if args.worker_output is not None:
+        run_worker(args)
+        return
+
+    results = []
+    for thread_config in args.thread_configs:
+        print(f"Thread config {thread_config}")
+        results.extend(run_thread_config(args, thread_config))
+
+    print(get_results_table(results).to_string(index=False))
+    core_qa_utils.save_dict_as_json(
+        {
+            "model": args.model_name or "tiny-synthetic",
+            "dataset": str(args.dataset_dir) if args.dataset_dir else "synthetic",
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "results": results,
+        },
+        dir_path=extractive_qa_paths.benchmarks_dir,
+        filename=args.output_name,
+    )
+
+
+def __get_forwarded_args(args):
+    forwarded_args = [
+        "--filename",
+        args.filename,
+        "--num-examples",
+        str(args.num_examples),
+        "--num-requests",
+        str(args.num_requests),
+        "--num-warmup-requests",
+        str(args.num_warmup_requests),
+        "--seed",
+        str(args.seed),
+        "--batch-sizes",
+        *[str(batch_size) for batch_size in args.batch_sizes],
+        "--sequence-lengths",
+        *[str(sequence_length) for sequence_length in args.sequence_lengths],
+    ]
+    if args.model_checkpoint is not None:
+        forwarded_args += ["--model-checkpoint", args.model_checkpoint]
+    if args.model_name is not None:
+        forwarded_args += ["--model-name", args.model_name]
+    if args.dataset_dir is not None:
+        forwarded_args += ["--dataset-dir", str(args.dataset_dir)]
+    if args.squad2:
+        forwarded_args.append("--squad2")
+    return forwarded_args
+
+
+if __name__ == "__main__":
+    main()
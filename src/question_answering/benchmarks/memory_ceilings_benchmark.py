@@ -0,0 +1,228 @@
+import argparse
+from pathlib import Path
+
+import datasets
+from transformers import AutoTokenizer
+
+from question_answering.benchmarks import synthetic_data
+from question_answering.constants import constants
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import (
+    core_qa_utils,
+    memory_profiling,
+    model_registry,
+)
+
+default_num_examples = 2000
+default_max_length = 384
+default_stride = 128
+default_ceilings_path = extractive_qa_paths.benchmarks_dir / "memory_ceilings.json"
+checked_metrics = ["peak_traced_bytes", "peak_rss_growth_bytes"]
+# Absolute slack on top of the headroom, so near-zero stages do not fail on a page
+default_slack_bytes = 8 * 2**20
+
+
+def warm_up_model(model, tokenizer, max_length: int):
+    # One prediction up front keeps graph building out of the predict stage
+    examples = synthetic_data.generate_squad_examples(2)
+    tf_dataset = core_qa_utils.build_tf_dataset(
+        hf_dataset=examples.map(
+            lambda samples: tokenizer(
+                samples["question"],
+                samples["context"],
+                max_length=max_length,
+                padding="max_length",
+                truncation="only_second",
+            ),
+            batched=True,
+        ),
+        columns=constants.model_input_names,
+        label_cols=None,
+        batch_size=2,
+    )
+    model.predict(tf_dataset, verbose=0)
+
+
+def profile_synthetic_evaluation(
+    num_examples: int = default_num_examples,
+    squad2: bool = False,
+    max_length: int = default_max_length,
+    stride: int | None = default_stride,
+    batch_size: int = 32,
+    seed: int = 42,
+):
+    tokenizer = synthetic_data.create_tiny_tokenizer()
+    model = synthetic_data.create_tiny_qa_model(tokenizer)
+    warm_up_model(model, tokenizer, max_length)
+    examples = synthetic_data.generate_squad_examples(
+        num_examples, squad2=squad2, seed=seed
+    )
+    return memory_profiling.profile_evaluation(
+        model=model,
+        tokenizer=tokenizer,
+        squad2=squad2,
+        examples=examples,
+        max_length=max_length,
+        stride=None if squad2 else stride,
+        batch_size=batch_size,
+    )
+
+
+def get_ceilings(
+    memory_profile: dict,
+    config: dict,
+    headroom: float = 0.25,
+    slack_bytes: int = default_slack_bytes,
+):
+    return {
+        "config": config,
+        "stages": {
+            stage: {
+                metric: int(max(stage_data[metric], 0) * (1 + headroom)) + slack_bytes
+                for metric in checked_metrics
+            }
+            for stage, stage_data in memory_profile["stages"].items()
+        },
+    }
+
+
+def check_ceilings(memory_profile: dict, config: dict, ceilings: dict):
+    if ceilings["config"] != config:
+        raise Exception("Ceilings were recorded for a different configuration!")
+
+    failures = []
+    for stage, stage_ceilings in ceilings["stages"].items():
+        stage_data = memory_profile["stages"].get(stage)
+        if stage_data is None:
+            continue
+        for metric, ceiling in stage_ceilings.items():
+            # Without a per-stage RSS peak, earlier stages would leak into later ones
+            if (
+                metric.startswith("peak_rss")
+                and not stage_data["is_peak_rss_per_stage"]
+            ):
+                continue
+            if stage_data[metric] > ceiling:
+                failures.append(
+                    f"{stage}: {metric} {stage_data[metric] / 2**20:.1f} MiB "
+                    f"exceeds the ceiling of {ceiling / 2**20:.1f} MiB"
+                )
+    return failures
+
+
+def check_synthetic_evaluation_memory(
+    config: dict, ceilings_path: Path = default_ceilings_path
+):
+    # Ceilings are committed, a missing file fails instead of recording new ones
+    if not ceilings_path.is_file():
+        raise Exception(
+            f"No memory ceilings at {ceilings_path}, record them with --update-ceilings!"
+        )
+    ceilings = core_qa_utils.read_json_as_dict(ceilings_path)
+    memory_profile = profile_synthetic_evaluation(**config)
+    failures = check_ceilings(memory_profile, config, ceilings)
+    return memory_profile, failures
+
+
+def print_memory_profile(memory_profile: dict):
+    for stage, stage_data in memory_profile["stages"].items():
+        print(
+            f"{stage}: peak RSS growth "
+            f"{stage_data['peak_rss_growth_bytes'] / 2**20:.1f} MiB, "
+            f"peak traced {stage_data['peak_traced_bytes'] / 2**20:.1f} MiB, "
+            f"retained traced {stage_data['retained_traced_bytes'] / 2**20:.1f} MiB"
+        )
+        for allocator in stage_data["top_allocators"][:3]:
+            print(
+                f"    {allocator['size_diff_bytes'] / 2**20:+.1f} MiB "
+                f"{allocator['location']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Profile evaluation memory per stage and check it against ceilings."
+    )
+    parser.add_argument("--num-examples", type=int, default=default_num_examples)
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--max-length", type=int, default=default_max_length)
+    parser.add_argument("--stride", type=int, default=default_stride)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--headroom", type=float, default=0.25)
+    parser.add_argument("--slack-mib", type=float, default=default_slack_bytes / 2**20)
+    parser.add_argument("--ceilings-path", type=Path, default=default_ceilings_path)
+    parser.add_argument("--update-ceilings", action="store_true")
+    parser.add_argument("--output-name", default="memory_profile_latest.json")
+    # A real model and dataset are profiled instead of synthetic data, unchecked
+    parser.add_argument("--model-checkpoint", default=None)
+    parser.add_argument("--model-name", default=None)
+    parser.add_argument("--dataset-dir", type=Path, default=None)
+    parser.add_argument("--filename", default="original_test.json")
+    args = parser.parse_args()
+
+    datasets.disable_progress_bar()
+    if args.model_checkpoint is not None:
+        tokenizer = AutoTokenizer.from_pretrained(args.model_checkpoint)
+        model = model_registry.get_model(
+            model_checkpoint=args.model_checkpoint, model_name=args.model_name
+        )
+        memory_profile = memory_profiling.profile_evaluation(
+            model=model,
+            tokenizer=tokenizer,
+            squad2=args.squad2,
+            dataset_dir=args.dataset_dir,
+            filename=args.filename,
+            max_length=args.max_length,
+            stride=None if args.squad2 else args.stride,
+            batch_size=args.batch_size,
+        )
+        print_memory_profile(memory_profile)
+        core_qa_utils.save_dict_as_json(
+            memory_profile,
+            dir_path=extractive_qa_paths.model_evaluation_dir / args.model_name,
+            filename=memory_profiling.memory_profile_filename,
+        )
+        return
+
+    config = {
+        "num_examples": args.num_examples,
+        "squad2": args.squad2,
+        "max_length": args.max_length,
+        "stride": args.stride,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+    }
+    if args.update_ceilings:
+        memory_profile = profile_synthetic_evaluation(**config)
+        core_qa_utils.save_dict_as_json(
+            get_ceilings(
+                memory_profile,
+                config,
+                headroom=args.headroom,
+                slack_bytes=int(args.slack_mib * 2**20),
+            ),
+            dir_path=args.ceilings_path.parent,
+            filename=args.ceilings_path.name,
+        )
+        print(f"Ceilings saved to {args.ceilings_path}")
+        failures = []
+    else:
+        memory_profile, failures = check_synthetic_evaluation_memory(
+            config, ceilings_path=args.ceilings_path
+        )
+    print_memory_profile(memory_profile)
+    core_qa_utils.save_dict_as_json(
+        memory_profile,
+        dir_path=extractive_qa_paths.benchmarks_dir,
+        filename=args.output_name,
+    )
+
+    for failure in failures:
+        print(failure)
+    if len(failures) > 0:
+        raise Exception("Evaluation memory exceeded the ceilings!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import random
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from datasets import Dataset
+from transformers import (
+    BertConfig,
+    BertTokenizerFast,
+    TFAutoModelForQuestionAnswering,
+)
+
+special_tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+punctuation_tokens = [".", ",", "?"]
+
+
+def get_synthetic_words(vocab_size: int = 2000):
+    return [f"w{i}" for i in range(vocab_size)]
+
+
+def create_tiny_tokenizer(
+    vocab_size: int = 2000, model_max_length: int = 512, vocab_dir: Path | None = None
+):
+    # A local WordPiece vocabulary, so benchmarks never need the network
+    vocab_dir = Path(vocab_dir or tempfile.mkdtemp())
+    vocab_dir.mkdir(parents=True, exist_ok=True)
+    vocab_path = vocab_dir / "vocab.txt"
+    vocab_path.write_text(
+        "\n".join(special_tokens + get_synthetic_words(vocab_size) + punctuation_tokens)
+    )
+    return BertTokenizerFast(str(vocab_path), model_max_length=model_max_length)
+
+
+def create_tiny_qa_model(
+    tokenizer,
+    hidden_size: int = 32,
+    num_hidden_layers: int = 2,
+    num_attention_heads: int = 2,
+    max_position_embeddings: int = 512,
+):
+    config = BertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=num_attention_heads,
+        intermediate_size=hidden_size * 2,
+        max_position_embeddings=max_position_embeddings,
+    )
+    return TFAutoModelForQuestionAnswering.from_config(config)
+
+
+def generate_squad_examples(
+    num_examples: int,
+    squad2: bool = False,
+    seed: int = 42,
+    vocab_size: int = 2000,
+    context_word_range: tuple[int, int] = (40, 420),
+    question_word_range: tuple[int, int] = (6, 14),
+    answer_word_range: tuple[int, int] = (1, 4),
+    num_answers: int = 1,
+    unanswerable_ratio: float = 0.33,
+):
+    # Word count ranges follow SQuAD, with contexts long enough to need striding
+    rng = random.Random(seed)
+    words = get_synthetic_words(vocab_size)
+    samples = {
+        "id": [],
+        "question": [],
+        "context": [],
+        "answer_start": [],
+        "answer_text": [],
+    }
+
+    for i in range(num_examples):
+        context_words = [
+            rng.choice(words) for _ in range(rng.randint(*context_word_range))
+        ]
+        for j in range(15, len(context_words), rng.randint(15, 25)):
+            context_words[j - 1] += "."
+        context = " ".join(context_words)
+        question = " ".join(
+            rng.choice(words) for _ in range(rng.randint(*question_word_range))
+        )
+
+        answer_starts = []
+        answer_texts = []
+        if not squad2 or rng.random() >= unanswerable_ratio:
+            for _ in range(num_answers):
+                answer_length = rng.randint(*answer_word_range)
+                first_word = rng.randint(0, len(context_words) - answer_length)
+                answer_starts.append(
+                    len(" ".join(context_words[:first_word])) + (first_word > 0)
+                )
+                answer_texts.append(
+                    " ".join(context_words[first_word : first_word + answer_length])
+                )
+                question += " " + answer_texts[-1].rstrip(".")
+
+        samples["id"].append(str(i))
+        samples["question"].append(question + " ?")
+        samples["context"].append(context)
+        samples["answer_start"].append(answer_starts)
+        samples["answer_text"].append(answer_texts)
+
+    return Dataset.from_dict(samples)
+
+
+def generate_logits(features: Dataset, seed: int = 42):
+    num_features = len(features)
+    sequence_length = len(features[0]["input_ids"])
+    rng = np.random.default_rng(seed)
+    start_logits = rng.normal(size=(num_features, sequence_length)).astype(np.float32)
+    end_logits = rng.normal(size=(num_features, sequence_length)).astype(np.float32)
+    return start_logits, end_logits
+
+
+def generate_predicted_texts(
+    examples: Dataset, seed: int = 42, correct_ratio: float = 0.6
+):
+    # A mix of exact, partially overlapping, empty and wrong predictions
+    rng = random.Random(seed)
+    predicted_texts = []
+    for context, answers in zip(examples["context"], examples["answer_text"]):
+        draw = rng.random()
+        if len(answers) > 0 and draw < correct_ratio:
+            predicted_texts.append(answers[0])
+        elif len(answers) > 0 and draw < correct_ratio + 0.15:
+            predicted_texts.append(answers[0].split()[0])
+        elif draw < correct_ratio + 0.25:
+            predicted_texts.append("")
+        else:
+            context_words = context.split()
+            first_word = rng.randint(0, len(context_words) - 3)
+            predicted_texts.append(" ".join(context_words[first_word : first_word + 3]))
+    return predicted_texts
+
+
+def generate_positions(features: Dataset, seed: int = 42):
+    sequence_length = len(features[0]["input_ids"])
+    rng = np.random.default_rng(seed)
+    start_preds = rng.integers(0, sequence_length, size=len(features))
+    end_preds = np.minimum(
+        start_preds + rng.integers(-2, 6, size=len(features)), sequence_length - 1
+    )
+    # Part of the predictions hit the labels, so every branch of the metrics is used
+    start_actual = features["start_positions"]
+    end_actual = features["end_positions"]
+    for i in range(0, len(features), 3):
+        start_preds[i] = start_actual[i][0]
+        end_preds[i] = end_actual[i][0]
+    return start_preds.tolist(), end_preds.tolist()
@@ -1,3 +1,5 @@
 figures_dir_name = "figures"
 checkpoint_filename_template = "cp-{epoch:02d}.ckpt"
 saved_model_weights_name = "model_weights"
+serving_signature_template = "serving_{sequence_length}"
+model_input_names = ["input_ids", "token_type_ids", "attention_mask"]
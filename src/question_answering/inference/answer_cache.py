@@ -0,0 +1,350 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+import tensorflow as tf
+
+from question_answering.inference import qa_inference
+
+
+def normalize_question(question: str, lowercase: bool = False):
+    # Case is only folded for readers that never see it
+    question = question.lower() if lowercase else question
+    return " ".join(question.split())
+
+
+def hash_text(text: str):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_answer_cache_key(
+    model_id: str,
+    question: str,
+    context: str,
+    decoding_params: dict,
+    lowercase: bool = False,
+):
+    return hash_text(
+        json.dumps(
+            [
+                model_id,
+                normalize_question(question, lowercase=lowercase),
+                hash_text(context.strip()),
+                decoding_params,
+            ],
+            sort_keys=True,
+        )
+    )
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float | None = None,
+        disk_path: Path | None = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.max_disk_entries = max_disk_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        # The disk tier has its own lock, so its I/O never blocks memory lookups
+        self._disk_connection = None
+        self._disk_lock = threading.Lock()
+        self._disk_entries = 0
+        if disk_path is not None:
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            self._disk_connection = sqlite3.connect(
+                str(disk_path), check_same_thread=False
+            )
+            self._disk_connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(key TEXT PRIMARY KEY, answer TEXT, created REAL, accessed REAL)"
+            )
+            columns = [
+                row[1]
+                for row in self._disk_connection.execute("PRAGMA table_info(answers)")
+            ]
+            # Caches written before the size bound have no access times yet
+            if "accessed" not in columns:
+                self._disk_connection.execute(
+                    "ALTER TABLE answers ADD COLUMN accessed REAL"
+                )
+                self._disk_connection.execute("UPDATE answers SET accessed = created")
+            self._disk_connection.execute(
+                "CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)"
+            )
+            self._disk_connection.commit()
+            self._disk_entries = self._disk_connection.execute(
+                "SELECT COUNT(*) FROM answers"
+            ).fetchone()[0]
+            self.purge_expired()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                answer, created = self._entries[key]
+                if not self.__is_expired(created, now):
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return answer
+                del self._entries[key]
+                self.stats["expirations"] += 1
+
+        row = self.__get_from_disk(key, now)
+        with self._lock:
+            if row is not None:
+                self.__put_in_memory(key, row[0], row[1])
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, answer: str):
+        created = time.time()
+        with self._lock:
+            self.__put_in_memory(key, answer, created)
+        if self._disk_connection is not None:
+            with self._disk_lock:
+                updated = self._disk_connection.execute(
+                    "UPDATE answers SET answer = ?, created = ?, accessed = ? "
+                    "WHERE key = ?",
+                    (answer, created, created, key),
+                ).rowcount
+                if updated == 0:
+                    self._disk_connection.execute(
+                        "INSERT INTO answers VALUES (?, ?, ?, ?)",
+                        (key, answer, created, created),
+                    )
+                    self._disk_entries += 1
+                if self._disk_entries > self.max_disk_entries:
+                    self.__evict_from_disk()
+                self._disk_connection.commit()
+
+    def purge_expired(self):
+        if self._disk_connection is None or self.ttl_seconds is None:
+            return 0
+        with self._disk_lock:
+            purged = self._disk_connection.execute(
+                "DELETE FROM answers WHERE created < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+            self._disk_connection.commit()
+            self._disk_entries -= purged
+        with self._lock:
+            self.stats["expirations"] += purged
+        return purged
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "disk_entries": self._disk_entries,
+                "hits": self.stats["hits"],
+                "disk_hits": self.stats["disk_hits"],
+                "misses": self.stats["misses"],
+                "evictions": self.stats["evictions"],
+                "disk_evictions": self.stats["disk_evictions"],
+                "expirations": self.stats["expirations"],
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._disk_connection is not None:
+            with self._disk_lock:
+                self._disk_connection.execute("DELETE FROM answers")
+                self._disk_connection.commit()
+                self._disk_entries = 0
+
+    def __get_from_disk(self, key: str, now: float):
+        if self._disk_connection is None:
+            return None
+        with self._disk_lock:
+            row = self._disk_connection.execute(
+                "SELECT answer, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.__is_expired(row[1], now):
+                self._disk_connection.execute(
+                    "DELETE FROM answers WHERE key = ?", (key,)
+                )
+                self._disk_entries -= 1
+                with self._lock:
+                    self.stats["expirations"] += 1
+                row = None
+            else:
+                self._disk_connection.execute(
+                    "UPDATE answers SET accessed = ? WHERE key = ?", (now, key)
+                )
+            self._disk_connection.commit()
+        return row
+
+    def __evict_from_disk(self):
+        # Least recently accessed rows go first, a tenth of the bound at a time
+        num_evicted = self._disk_entries - self.max_disk_entries
+        num_evicted += self.max_disk_entries // 10
+        evicted = self._disk_connection.execute(
+            "DELETE FROM answers WHERE key IN "
+            "(SELECT key FROM answers ORDER BY accessed LIMIT ?)",
+            (num_evicted,),
+        ).rowcount
+        self._disk_entries -= evicted
+        with self._lock:
+            self.stats["disk_evictions"] += evicted
+
+    def __put_in_memory(self, key: str, answer: str, created: float):
+        self._entries[key] = (answer, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def __is_expired(self, created: float, now: float):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+
+class ContextTokenCache:
+    def __init__(self, tokenizer, max_entries: int = 1_000):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+
+        self._encodings = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get_encoding(self, context: str):
+        key = hash_text(context.strip())
+        with self._lock:
+            if key in self._encodings:
+                self._encodings.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._encodings[key]
+            self.stats["misses"] += 1
+
+        encoding = qa_inference.tokenize_context(self.tokenizer, context)
+        with self._lock:
+            self._encodings[key] = encoding
+            while len(self._encodings) > self.max_entries:
+                self._encodings.popitem(last=False)
+        return encoding
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._encodings),
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+            }
+
+
+class CachedQAReader:
+    def __init__(
+        self,
+        model: tf.keras.Model,
+        tokenizer,
+        model_id: str,
+        max_length: int,
+        stride: int,
+        squad2: bool = False,
+        n_best: int = 20,
+        max_answer_length: int = 30,
+        batch_size: int = 32,
+        answer_cache: AnswerCache | None = None,
+        context_cache: ContextTokenCache | None = None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_id = model_id
+        self.max_length = max_length
+        self.stride = stride
+        self.squad2 = squad2
+        self.n_best = n_best
+        self.max_answer_length = max_answer_length
+        self.batch_size = batch_size
+        self.answer_cache = answer_cache or AnswerCache()
+        self.context_cache = context_cache or ContextTokenCache(tokenizer)
+
+    def answer(self, questions: list[str], contexts: list[str]):
+        decoding_params = {
+            "max_length": self.max_length,
+            "stride": self.stride,
+            "squad2": self.squad2,
+            "n_best": self.n_best,
+            "max_answer_length": self.max_answer_length,
+        }
+        lowercase = getattr(self.tokenizer, "do_lower_case", False)
+        keys = [
+            get_answer_cache_key(
+                self.model_id, question, context, decoding_params, lowercase=lowercase
+            )
+            for question, context in zip(questions, contexts)
+        ]
+        answers = [self.answer_cache.get(key) for key in keys]
+
+        # Identical uncached pairs within one call are computed only once
+        key_to_index = {}
+        for index, (key, answer) in enumerate(zip(keys, answers)):
+            if answer is None:
+                key_to_index.setdefault(key, index)
+        missing_keys = list(key_to_index)
+        if missing_keys:
+            features = qa_inference.concatenate_features(
+                [
+                    qa_inference.tokenize_qa_pair_with_context_encoding(
+                        tokenizer=self.tokenizer,
+                        question=questions[key_to_index[key]],
+                        context_encoding=self.context_cache.get_encoding(
+                            contexts[key_to_index[key]]
+                        ),
+                        example_id=key,
+                        max_length=self.max_length,
+                        stride=self.stride,
+                    )
+                    for key in missing_keys
+                ]
+            )
+            start_logits, end_logits = qa_inference.predict_feature_logits(
+                model=self.model, features=features, batch_size=self.batch_size
+            )
+            predicted_texts = qa_inference.decode_predicted_texts(
+                start_logits=start_logits,
+                end_logits=end_logits,
+                features=features,
+                example_ids=missing_keys,
+                contexts=[contexts[key_to_index[key]] for key in missing_keys],
+                squad2=self.squad2,
+                n_best=self.n_best,
+                max_answer_length=self.max_answer_length,
+            )
+
+            computed_answers = dict(zip(missing_keys, predicted_texts))
+            for key, predicted_text in computed_answers.items():
+                self.answer_cache.put(key, predicted_text)
+            answers = [
+                computed_answers[key] if answer is None else answer
+                for key, answer in zip(keys, answers)
+            ]
+
+        return answers
+
+    def get_stats(self):
+        return {
+            "answers": self.answer_cache.get_stats(),
+            "contexts": self.context_cache.get_stats(),
+        }
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+from transformers import AutoTokenizer
+
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import (
+    core_preprocessing,
+    core_qa_utils,
+    evaluation,
+    model_registry,
+    predictions,
+    runtime_config,
+)
+from question_answering.utils.logit_cache import (
+    compute_features_fingerprint,
+    compute_weights_fingerprint,
+)
+
+journal_filename = "journal.json"
+logits_filenames = ["start_logits.npy", "end_logits.npy"]
+
+
+def run_batch_inference(
+    model: tf.keras.Model,
+    features: Dataset,
+    work_dir: Path,
+    batch_size: int,
+    journal_every: int = 10,
+    verbose: bool = False,
+):
+    num_features = len(features)
+    sequence_length = len(features[0]["input_ids"])
+    num_batches = (num_features + batch_size - 1) // batch_size
+    features_fingerprint = compute_features_fingerprint(features)
+    # Retrained weights under the same model name must not reuse older logits
+    weights_fingerprint = compute_weights_fingerprint(model)
+
+    journal = __read_journal(work_dir)
+    resume = (
+        journal is not None
+        and journal["features_fingerprint"] == features_fingerprint
+        and journal.get("weights_fingerprint") == weights_fingerprint
+        and journal["batch_size"] == batch_size
+        and all((work_dir / filename).is_file() for filename in logits_filenames)
+    )
+    if not resume:
+        journal = {
+            "features_fingerprint": features_fingerprint,
+            "weights_fingerprint": weights_fingerprint,
+            "num_features": num_features,
+            "batch_size": batch_size,
+            "completed_batches": 0,
+        }
+
+    # Logits are preallocated once and filled in place, so memory stays flat
+    logits_mode = "r+" if resume else "w+"
+    core_qa_utils.create_dirs_if_not_exists(work_dir)
+    start_logits, end_logits = [
+        np.lib.format.open_memmap(
+            work_dir / filename,
+            mode=logits_mode,
+            dtype=np.float32,
+            shape=(num_features, sequence_length),
+        )
+        for filename in logits_filenames
+    ]
+    __write_journal(work_dir, journal)
+
+    input_names = evaluation.get_model_input_names(features.column_names)
+    numpy_features = features.select_columns(input_names).with_format("numpy")
+
+    for batch_index in range(journal["completed_batches"], num_batches):
+        batch_start = batch_index * batch_size
+        batch_end = min(batch_start + batch_size, num_features)
+        batch = numpy_features[batch_start:batch_end]
+
+        output = model(
+            {name: tf.constant(batch[name]) for name in input_names}, training=False
+        )
+        start_logits[batch_start:batch_end] = predictions.get_preds(
+            output, output_key="start_logits", return_type="logits"
+        )
+        end_logits[batch_start:batch_end] = predictions.get_preds(
+            output, output_key="end_logits", return_type="logits"
+        )
+
+        if (batch_index + 1) % journal_every == 0 or batch_index + 1 == num_batches:
+            # Logits must reach the disk before the journal claims they are done
+            start_logits.flush()
+            end_logits.flush()
+            journal["completed_batches"] = batch_index + 1
+            __write_journal(work_dir, journal)
+            if verbose:
+                print(f"Completed batches: {batch_index + 1}/{num_batches}")
+
+    return start_logits, end_logits
+
+
+def __read_journal(work_dir: Path):
+    journal_path = work_dir / journal_filename
+    if not journal_path.is_file():
+        return None
+    return core_qa_utils.read_json_as_dict(journal_path)
+
+
+def __write_journal(work_dir: Path, journal: dict):
+    temporary_path = work_dir / f"{journal_filename}.tmp"
+    with open(temporary_path, "w") as fp:
+        json.dump(journal, fp, sort_keys=True, indent=4)
+    os.replace(temporary_path, work_dir / journal_filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a trained model over a JSON dataset and evaluate it"
+    )
+    parser.add_argument("--model-checkpoint", required=True)
+    parser.add_argument("--model-name", required=True)
+    parser.add_argument("--dataset-dir", type=Path, required=True)
+    parser.add_argument("--filename", default="original_test.json")
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--stride", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--journal-every", type=int, default=10)
+    parser.add_argument("--output-dir", type=Path, default=None)
+    parser.add_argument("--evaluation-filename", default="evaluation_data.json")
+    runtime_config.add_runtime_config_args(parser)
+    args = parser.parse_args()
+    runtime_config.configure_runtime_from_args(
+        args,
+        model_checkpoint=args.model_checkpoint,
+        model_name=args.model_name,
+        sequence_length=args.max_length,
+        verbose=True,
+    )
+
+    output_dir = args.output_dir or (
+        extractive_qa_paths.model_evaluation_dir / args.model_name
+    )
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_checkpoint)
+    max_length = args.max_length or tokenizer.model_max_length
+
+    examples = core_qa_utils.load_datasets_from_json(
+        dataset_path=args.dataset_dir, filenames=[args.filename]
+    )[0]
+    examples, features = core_preprocessing.preprocess_examples(
+        examples=examples,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=args.squad2,
+        stride=args.stride,
+    )
+
+    model = model_registry.get_model(
+        model_checkpoint=args.model_checkpoint, model_name=args.model_name
+    )
+    start_logits, end_logits = run_batch_inference(
+        model=model,
+        features=features,
+        work_dir=extractive_qa_paths.batch_inference_dir
+        / args.model_name
+        / Path(args.filename).stem,
+        batch_size=args.batch_size,
+        journal_every=args.journal_every,
+        verbose=True,
+    )
+
+    evaluation_data = evaluation.evaluate_predictions(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        examples=examples,
+        squad2=args.squad2,
+        prediction_log_dir=output_dir,
+    )
+    core_qa_utils.save_dict_as_json(
+        evaluation_data, dir_path=output_dir, filename=args.evaluation_filename
+    )
+
+
+if __name__ == "__main__":
+    main()
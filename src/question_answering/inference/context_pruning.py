@@ -0,0 +1,298 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.inference import qa_inference
+from question_answering.retrieval.bm25_retriever import tokenize_text
+from question_answering.utils import evaluation
+
+# Terminators only end a sentence before whitespace, so "3.5" and "U.S" stay whole
+sentence_pattern = re.compile(r".+?(?:[.!?]+(?=\s|\Z)|\Z)", re.DOTALL)
+sentence_separator = " "
+
+
+def split_sentences(context: str):
+    spans = []
+    for match in sentence_pattern.finditer(context):
+        start, end = match.span()
+        # Trim surrounding whitespace so sentences map exactly onto the context
+        while start < end and context[start].isspace():
+            start += 1
+        while end > start and context[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+def score_sentences(
+    question: str, sentences: list[str], k1: float = 1.5, b: float = 0.75
+):
+    question_terms = set(tokenize_text(question))
+    sentences_terms = [tokenize_text(sentence) for sentence in sentences]
+    average_length = max(np.mean([len(terms) for terms in sentences_terms]), 1.0)
+    document_frequencies = Counter(
+        term for terms in sentences_terms for term in set(terms)
+    )
+
+    scores = []
+    for terms in sentences_terms:
+        term_frequencies = Counter(terms)
+        length_norm = k1 * (1 - b + b * len(terms) / average_length)
+        score = 0.0
+        for term in question_terms:
+            if term not in term_frequencies:
+                continue
+            idf = math.log(
+                1
+                + (len(sentences) - document_frequencies[term] + 0.5)
+                / (document_frequencies[term] + 0.5)
+            )
+            score += (
+                idf
+                * term_frequencies[term]
+                * (k1 + 1)
+                / (term_frequencies[term] + length_norm)
+            )
+        scores.append(score)
+    return scores
+
+
+def prune_context(tokenizer, question: str, context: str, token_budget: int):
+    context = context.strip()
+    spans = split_sentences(context)
+    sentences = [context[start:end] for start, end in spans]
+    token_counts = [
+        len(input_ids)
+        for input_ids in tokenizer(sentences, add_special_tokens=False, verbose=False)[
+            "input_ids"
+        ]
+    ]
+    scores = score_sentences(question, sentences)
+
+    # Best sentences are kept up to the budget, the best one always survives
+    kept_sentences = []
+    used_tokens = 0
+    for sentence_index in np.argsort(scores, kind="stable")[::-1]:
+        if kept_sentences and used_tokens + token_counts[sentence_index] > token_budget:
+            continue
+        kept_sentences.append(sentence_index)
+        used_tokens += token_counts[sentence_index]
+
+    # Kept sentences stay in their original order, adjacent ones keep the original
+    # gap between them and form one segment, only pruned gaps start a new one
+    pruned_parts = []
+    offset_map = []
+    pruned_position = 0
+    previous_index = None
+    for sentence_index in sorted(kept_sentences):
+        start, end = spans[sentence_index]
+        if previous_index is not None and sentence_index == previous_index + 1:
+            segment_start = spans[previous_index][1]
+            offset_map[-1][2] = end - offset_map[-1][1]
+        else:
+            if pruned_parts:
+                pruned_parts.append(sentence_separator)
+                pruned_position += len(sentence_separator)
+            segment_start = start
+            offset_map.append([pruned_position, start, end - start])
+        pruned_parts.append(context[segment_start:end])
+        pruned_position += end - segment_start
+        previous_index = sentence_index
+
+    return "".join(pruned_parts), offset_map
+
+
+def map_position_to_original(position: int, offset_map: list, is_end: bool = False):
+    # End offsets are exclusive, so they are mapped through the preceding character
+    lookup_position = position - 1 if is_end else position
+    for pruned_start, original_start, length in offset_map:
+        if pruned_start <= lookup_position < pruned_start + length:
+            return original_start + (lookup_position - pruned_start) + int(is_end)
+    return None
+
+
+def map_position_to_pruned(position: int, offset_map: list):
+    for pruned_start, original_start, length in offset_map:
+        if original_start <= position < original_start + length:
+            return pruned_start + (position - original_start)
+    return -1
+
+
+def map_position_to_segment(position: int, offset_map: list):
+    for segment_index, (pruned_start, _, length) in enumerate(offset_map):
+        if pruned_start <= position < pruned_start + length:
+            return segment_index
+    return -1
+
+
+def prune_dataset_contexts(dataset: Dataset, tokenizer, token_budget: int):
+    def prune_samples(samples):
+        pruned_contexts = []
+        offset_maps = []
+        answer_starts_batch = []
+
+        for i, context in enumerate(samples["context"]):
+            pruned_context, offset_map = prune_context(
+                tokenizer=tokenizer,
+                question=samples["question"][i],
+                context=context,
+                token_budget=token_budget,
+            )
+            stripped_shift = len(context) - len(context.lstrip())
+
+            # Answers which were pruned away get -1, preprocessing labels them (0, 0)
+            answer_starts = [
+                map_position_to_pruned(answer_start - stripped_shift, offset_map)
+                for answer_start in samples["answer_start"][i]
+            ]
+
+            pruned_contexts.append(pruned_context)
+            offset_maps.append(offset_map)
+            answer_starts_batch.append(answer_starts)
+
+        return {
+            "original_context": samples["context"],
+            "context": pruned_contexts,
+            "context_offset_map": offset_maps,
+            "answer_start": answer_starts_batch,
+        }
+
+    return dataset.map(prune_samples, batched=True)
+
+
+def restore_original_offsets(features: dict, example_id_to_offset_map: dict):
+    restored_offset_mapping = []
+    context_segments = []
+    for example_id, offsets in zip(features["example_id"], features["offset_mapping"]):
+        offset_map = example_id_to_offset_map[example_id]
+        restored_offsets = []
+        segments = []
+        for offset in offsets:
+            if offset is None:
+                restored_offsets.append(None)
+                segments.append(-1)
+                continue
+            # Decoding rejects spans whose ends lie in different kept sentences
+            segments.append(map_position_to_segment(offset[0], offset_map))
+            start = map_position_to_original(offset[0], offset_map)
+            end = map_position_to_original(offset[1], offset_map, is_end=True)
+            restored_offsets.append(
+                None if start is None or end is None else (start, end)
+            )
+        restored_offset_mapping.append(restored_offsets)
+        context_segments.append(segments)
+
+    restored_features = dict(features)
+    restored_features["offset_mapping"] = restored_offset_mapping
+    restored_features["context_segment"] = context_segments
+    return restored_features
+
+
+def predict_with_pruned_contexts(
+    model: tf.keras.Model,
+    tokenizer,
+    examples: Dataset,
+    token_budget: int | None,
+    max_length: int,
+    stride: int,
+    squad2: bool,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+    batch_size: int = 32,
+):
+    original_contexts = [context.strip() for context in examples["context"]]
+    contexts = original_contexts
+    example_id_to_offset_map = None
+    if token_budget is not None:
+        pruned_examples = prune_dataset_contexts(
+            dataset=examples, tokenizer=tokenizer, token_budget=token_budget
+        )
+        contexts = pruned_examples["context"]
+        example_id_to_offset_map = dict(
+            zip(pruned_examples["id"], pruned_examples["context_offset_map"])
+        )
+
+    features = qa_inference.tokenize_qa_pairs(
+        tokenizer=tokenizer,
+        questions=examples["question"],
+        contexts=contexts,
+        example_ids=examples["id"],
+        max_length=max_length,
+        stride=stride,
+    )
+    start_logits, end_logits = qa_inference.predict_feature_logits(
+        model=model, features=features, batch_size=batch_size
+    )
+    if example_id_to_offset_map is not None:
+        features = restore_original_offsets(features, example_id_to_offset_map)
+
+    # Offsets now point into the original contexts, so spans are decoded from them
+    predicted_texts = qa_inference.decode_predicted_texts(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        example_ids=examples["id"],
+        contexts=original_contexts,
+        squad2=squad2,
+        n_best=n_best,
+        max_answer_length=max_answer_length,
+    )
+    context_tokens = sum(
+        len(input_ids)
+        for input_ids in tokenizer(contexts, add_special_tokens=False, verbose=False)[
+            "input_ids"
+        ]
+    )
+    return predicted_texts, context_tokens, len(features["input_ids"])
+
+
+def evaluate_pruning_trade_off(
+    model: tf.keras.Model,
+    tokenizer,
+    examples: Dataset,
+    token_budgets: list[int],
+    max_length: int,
+    stride: int,
+    squad2: bool,
+    batch_size: int = 32,
+):
+    metrics_module = evaluation.get_metrics_module(squad2)
+
+    report = []
+    baseline_context_tokens = None
+    for token_budget in [None] + sorted(token_budgets, reverse=True):
+        predicted_texts, context_tokens, num_features = predict_with_pruned_contexts(
+            model=model,
+            tokenizer=tokenizer,
+            examples=examples,
+            token_budget=token_budget,
+            max_length=max_length,
+            stride=stride,
+            squad2=squad2,
+            batch_size=batch_size,
+        )
+        if baseline_context_tokens is None:
+            baseline_context_tokens = context_tokens
+
+        qa_metrics = metrics_module.calculate_squad_qa_metrics(
+            answers=examples["answer_text"],
+            predicted_texts=predicted_texts,
+            normalize=True,
+        )
+        report.append(
+            {
+                "token_budget": token_budget,
+                "context_tokens": context_tokens,
+                "tokens_saved_ratio": 1 - context_tokens / baseline_context_tokens,
+                "num_features": num_features,
+                "exact_match": qa_metrics["exact_match"],
+                "f1": qa_metrics["f1"],
+            }
+        )
+
+    return report
@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.utils import evaluation, model_registry, predictions
+
+
+def load_ensemble_members(model_checkpoint: str, model_names: list[str]):
+    return [
+        model_registry.get_model(
+            model_checkpoint=model_checkpoint, model_name=model_name
+        )
+        for model_name in model_names
+    ]
+
+
+def predict_ensemble_logits(
+    models: list[tf.keras.Model],
+    features: Dataset,
+    batch_size: int = 32,
+    concurrent: bool = False,
+):
+    input_names = evaluation.get_model_input_names(features.features)
+    inputs = features.select_columns(input_names).with_format("numpy")
+    num_features = len(features)
+    sequence_length = len(features[0]["input_ids"])
+
+    # Only the running sums are kept, never a full logit array per member
+    start_logits_sum = np.zeros((num_features, sequence_length), dtype=np.float32)
+    end_logits_sum = np.zeros((num_features, sequence_length), dtype=np.float32)
+    member_times = np.zeros(len(models))
+    member_times_lock = threading.Lock()
+
+    def predict_member(member_index: int, batch: dict):
+        start_time = timer()
+        output = models[member_index](batch, training=False)
+        start_logits = np.asarray(
+            predictions.get_preds(
+                output, output_key="start_logits", return_type="logits"
+            )
+        )
+        end_logits = np.asarray(
+            predictions.get_preds(output, output_key="end_logits", return_type="logits")
+        )
+        with member_times_lock:
+            member_times[member_index] += timer() - start_time
+        return start_logits, end_logits
+
+    executor = ThreadPoolExecutor(max_workers=len(models)) if concurrent else None
+    try:
+        for batch_start in range(0, num_features, batch_size):
+            batch_end = min(batch_start + batch_size, num_features)
+            batch_inputs = inputs[batch_start:batch_end]
+            # The same batch tensors are shared by all members
+            batch = {name: tf.constant(batch_inputs[name]) for name in input_names}
+            member_indices = range(len(models))
+            if executor is not None:
+                member_outputs = executor.map(
+                    predict_member, member_indices, [batch] * len(models)
+                )
+            else:
+                member_outputs = (
+                    predict_member(member_index, batch)
+                    for member_index in member_indices
+                )
+            for start_logits, end_logits in member_outputs:
+                start_logits_sum[batch_start:batch_end] += start_logits
+                end_logits_sum[batch_start:batch_end] += end_logits
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    start_logits_sum /= len(models)
+    end_logits_sum /= len(models)
+    return start_logits_sum, end_logits_sum, member_times.tolist()
+
+
+def evaluate_ensemble(
+    models: list[tf.keras.Model],
+    features: Dataset,
+    examples: Dataset,
+    squad2: bool,
+    batch_size: int = 32,
+    concurrent: bool = False,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+):
+    get_predicted_texts = evaluation.get_predicted_texts_function(squad2)
+    metrics_module = evaluation.get_metrics_module(squad2)
+
+    start_time = timer()
+    start_logits, end_logits, member_times = predict_ensemble_logits(
+        models=models, features=features, batch_size=batch_size, concurrent=concurrent
+    )
+    inference_time = timer() - start_time
+
+    # Averaged logits are decoded once for the whole ensemble
+    start_time = timer()
+    predicted_texts = get_predicted_texts(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        examples=examples,
+        n_best=n_best,
+        max_answer_length=max_answer_length,
+    )
+    decoding_time = timer() - start_time
+
+    qa_metrics = metrics_module.calculate_squad_qa_metrics(
+        answers=examples["answer_text"],
+        predicted_texts=predicted_texts,
+        normalize=True,
+    )
+
+    # The first member's time from the ensemble pass stands in for a single model,
+    # which includes contention from the other members when run concurrently
+    single_model_time = member_times[0] + decoding_time
+
+    return {
+        "exact_match": qa_metrics["exact_match"],
+        "f1": qa_metrics["f1"],
+        "num_members": len(models),
+        "concurrent": concurrent,
+        "inference_time": inference_time,
+        "decoding_time": decoding_time,
+        "member_inference_times": member_times,
+        "examples_per_second": len(examples) / (inference_time + decoding_time),
+        "single_model_time": single_model_time,
+        "relative_cost": (inference_time + decoding_time) / single_model_time,
+    }
@@ -0,0 +1,155 @@
+import heapq
+
+import numpy as np
+import tensorflow as tf
+
+from question_answering.inference import qa_inference
+
+
+def extract_window_candidates(
+    start_logit: np.ndarray,
+    end_logit: np.ndarray,
+    offsets: list,
+    n_best: int,
+    max_answer_length: int,
+):
+    is_context = np.array([offset is not None for offset in offsets])
+    best_start_indices = np.argsort(start_logit)[-1 : -n_best - 1 : -1]
+    best_end_indices = np.argsort(end_logit)[-1 : -n_best - 1 : -1]
+
+    # Score every (start, end) pair at once and mask out the invalid ones
+    scores = start_logit[best_start_indices][:, None] + end_logit[best_end_indices]
+    span_lengths = best_end_indices[None, :] - best_start_indices[:, None] + 1
+    is_valid = (
+        is_context[best_start_indices][:, None]
+        & is_context[best_end_indices][None, :]
+        & (span_lengths > 0)
+        & (span_lengths <= max_answer_length)
+    )
+
+    candidates = []
+    for start_position, end_position in zip(*np.nonzero(is_valid)):
+        start_index = best_start_indices[start_position]
+        end_index = best_end_indices[end_position]
+        candidates.append(
+            (
+                offsets[start_index][0],
+                offsets[end_index][1],
+                float(scores[start_position, end_position]),
+            )
+        )
+    return candidates
+
+
+def push_span(heap: list, heap_scores: dict, span: tuple, score: float, max_spans: int):
+    # A min-heap of at most max_spans spans, each kept with its best score
+    if span in heap_scores:
+        if score > heap_scores[span]:
+            heap_scores[span] = score
+            heap[:] = [(heap_scores[heap_span], heap_span) for _, heap_span in heap]
+            heapq.heapify(heap)
+    elif len(heap) < max_spans:
+        heapq.heappush(heap, (score, span))
+        heap_scores[span] = score
+    elif score > heap[0][0]:
+        _, evicted_span = heapq.heapreplace(heap, (score, span))
+        del heap_scores[evicted_span]
+        heap_scores[span] = score
+
+
+def answer_long_document(
+    model: tf.keras.Model,
+    tokenizer,
+    question: str,
+    document: str,
+    max_length: int,
+    stride: int,
+    batch_size: int = 64,
+    top_k: int = 5,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+    early_stopping: bool = True,
+    patience_batches: int = 1,
+    min_pre_score_ratio: float = 0.5,
+    context_encoding: dict | None = None,
+):
+    document = document.strip()
+    if context_encoding is None:
+        context_encoding = qa_inference.tokenize_context(tokenizer, document)
+
+    # The document is windowed once, only the question changes between calls
+    features = qa_inference.tokenize_qa_pair_with_context_encoding(
+        tokenizer=tokenizer,
+        question=question,
+        context_encoding=context_encoding,
+        example_id="document",
+        max_length=max_length,
+        stride=stride,
+    )
+    pre_scores = qa_inference.score_windows_by_question_overlap(features)
+    window_order = np.argsort(pre_scores, kind="stable")[::-1].tolist()
+
+    # Running top-k of spans, overlapping windows produce the same span offsets
+    best_spans = []
+    best_span_scores = {}
+    best_score = -np.inf
+    best_pre_score = None
+    batches_without_improvement = 0
+    windows_processed = 0
+
+    for batch_start in range(0, len(window_order), batch_size):
+        batch_windows = window_order[batch_start : batch_start + batch_size]
+        batch_features = qa_inference.select_features(features, batch_windows)
+        start_logits, end_logits = qa_inference.predict_feature_logits(
+            model=model, features=batch_features, batch_size=batch_size
+        )
+        windows_processed += len(batch_windows)
+        if best_pre_score is None:
+            best_pre_score = pre_scores[batch_windows[0]]
+
+        previous_best_score = best_score
+        for i, offsets in enumerate(batch_features["offset_mapping"]):
+            for start_char, end_char, score in extract_window_candidates(
+                start_logit=start_logits[i],
+                end_logit=end_logits[i],
+                offsets=offsets,
+                n_best=n_best,
+                max_answer_length=max_answer_length,
+            ):
+                push_span(
+                    best_spans,
+                    best_span_scores,
+                    span=(start_char, end_char),
+                    score=score,
+                    max_spans=top_k,
+                )
+                best_score = max(best_score, score)
+
+        if best_score > previous_best_score:
+            batches_without_improvement = 0
+        else:
+            batches_without_improvement += 1
+
+        remaining_windows = window_order[batch_start + batch_size :]
+        if (
+            early_stopping
+            and remaining_windows
+            and batches_without_improvement >= patience_batches
+            and pre_scores[remaining_windows[0]] < min_pre_score_ratio * best_pre_score
+        ):
+            break
+
+    best_spans = sorted(best_spans, reverse=True)
+    return {
+        "answers": [
+            {
+                "text": document[start_char:end_char],
+                "start_char": start_char,
+                "end_char": end_char,
+                "logit_score": score,
+            }
+            for score, (start_char, end_char) in best_spans
+        ],
+        "windows_processed": windows_processed,
+        "windows_total": len(window_order),
+    }
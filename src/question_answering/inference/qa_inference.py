@@ -0,0 +1,203 @@
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.utils import evaluation, predictions
+
+
+def tokenize_qa_pairs(
+    tokenizer,
+    questions: list[str],
+    contexts: list[str],
+    example_ids: list[str],
+    max_length: int,
+    stride: int,
+):
+    questions = [q.strip() for q in questions]
+    contexts = [c.strip() for c in contexts]
+
+    inputs = tokenizer(
+        questions,
+        contexts,
+        max_length=max_length,
+        padding="max_length",
+        truncation="only_second",
+        stride=stride,
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
+    )
+
+    offset_mapping = inputs["offset_mapping"]
+    sample_map = inputs["overflow_to_sample_mapping"]
+
+    features = {name: inputs[name] for name in evaluation.get_model_input_names(inputs)}
+    features["example_id"] = [example_ids[sample_idx] for sample_idx in sample_map]
+    features["offset_mapping"] = [
+        [o if inputs.sequence_ids(i)[k] == 1 else None for k, o in enumerate(offset)]
+        for i, offset in enumerate(offset_mapping)
+    ]
+    return features
+
+
+def tokenize_context(tokenizer, context: str):
+    encoding = tokenizer(
+        context.strip(),
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False,
+    )
+    return {
+        "input_ids": encoding["input_ids"],
+        "offset_mapping": [tuple(offset) for offset in encoding["offset_mapping"]],
+    }
+
+
+def tokenize_qa_pair_with_context_encoding(
+    tokenizer,
+    question: str,
+    context_encoding: dict,
+    example_id: str,
+    max_length: int,
+    stride: int,
+):
+    question_ids = tokenizer(question.strip(), add_special_tokens=False)["input_ids"]
+    context_ids = context_encoding["input_ids"]
+    context_offsets = context_encoding["offset_mapping"]
+
+    window_length = (
+        max_length - len(question_ids) - tokenizer.num_special_tokens_to_add(pair=True)
+    )
+    if window_length <= stride:
+        raise Exception("Question is too long for the given max_length and stride!")
+
+    # Same windowing as truncation="only_second" with return_overflowing_tokens
+    window_starts = list(
+        range(0, max(len(context_ids) - stride, 1), window_length - stride)
+    )
+
+    features = {name: [] for name in tokenizer.model_input_names}
+    features["example_id"] = []
+    features["offset_mapping"] = []
+    for window_start in window_starts:
+        window_ids = context_ids[window_start : window_start + window_length]
+        input_ids = tokenizer.build_inputs_with_special_tokens(question_ids, window_ids)
+        context_start = __find_sublist(
+            input_ids, window_ids, search_start=len(question_ids)
+        )
+
+        offset_mapping = [None] * len(input_ids)
+        offset_mapping[context_start : context_start + len(window_ids)] = (
+            context_offsets[window_start : window_start + len(window_ids)]
+        )
+
+        padding_length = max_length - len(input_ids)
+        features["input_ids"].append(
+            input_ids + [tokenizer.pad_token_id] * padding_length
+        )
+        if "token_type_ids" in features:
+            features["token_type_ids"].append(
+                tokenizer.create_token_type_ids_from_sequences(question_ids, window_ids)
+                + [tokenizer.pad_token_type_id] * padding_length
+            )
+        if "attention_mask" in features:
+            features["attention_mask"].append(
+                [1] * len(input_ids) + [0] * padding_length
+            )
+        features["example_id"].append(example_id)
+        features["offset_mapping"].append(offset_mapping + [None] * padding_length)
+
+    return features
+
+
+def score_windows_by_question_overlap(features: dict):
+    # Cheap pre-score: how many context tokens of a window appear in the question
+    window_scores = []
+    for input_ids, offsets in zip(features["input_ids"], features["offset_mapping"]):
+        question_ids = {
+            token_id for token_id, offset in zip(input_ids, offsets) if offset is None
+        }
+        window_scores.append(
+            sum(
+                1
+                for token_id, offset in zip(input_ids, offsets)
+                if offset is not None and token_id in question_ids
+            )
+        )
+    return window_scores
+
+
+def select_features(features: dict, indices: list[int]):
+    return {name: [values[i] for i in indices] for name, values in features.items()}
+
+
+def concatenate_features(features_list: list[dict]):
+    concatenated = {name: [] for name in features_list[0].keys()}
+    for features in features_list:
+        for name, values in features.items():
+            concatenated[name].extend(values)
+    return concatenated
+
+
+def predict_feature_logits(model: tf.keras.Model, features: dict, batch_size: int):
+    input_names = evaluation.get_model_input_names(features)
+    num_features = len(features["input_ids"])
+
+    start_logits = []
+    end_logits = []
+    for batch_start in range(0, num_features, batch_size):
+        batch = {
+            name: tf.constant(features[name][batch_start : batch_start + batch_size])
+            for name in input_names
+        }
+        output = model(batch, training=False)
+        start_logits.append(
+            np.asarray(
+                predictions.get_preds(
+                    output, output_key="start_logits", return_type="logits"
+                )
+            )
+        )
+        end_logits.append(
+            np.asarray(
+                predictions.get_preds(
+                    output, output_key="end_logits", return_type="logits"
+                )
+            )
+        )
+
+    return np.concatenate(start_logits), np.concatenate(end_logits)
+
+
+def decode_predicted_texts(
+    start_logits: np.ndarray,
+    end_logits: np.ndarray,
+    features: dict,
+    example_ids: list[str],
+    contexts: list[str],
+    squad2: bool,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+):
+    return evaluation.get_predicted_texts_function(squad2)(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=Dataset.from_dict(
+            {
+                name: features[name]
+                for name in ["example_id", "offset_mapping", "context_segment"]
+                if name in features
+            }
+        ),
+        examples=Dataset.from_dict(
+            {"id": example_ids, "context": [c.strip() for c in contexts]}
+        ),
+        n_best=n_best,
+        max_answer_length=max_answer_length,
+    )
+
+
+def __find_sublist(values: list, sublist: list, search_start: int):
+    for start in range(search_start, len(values) - len(sublist) + 1):
+        if values[start : start + len(sublist)] == sublist:
+            return start
+    raise Exception("Context tokens not found in the encoded pair!")
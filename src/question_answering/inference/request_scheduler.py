@@ -0,0 +1,286 @@
+import heapq
+import itertools
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from timeit import default_timer as timer
+from uuid import uuid4
+
+import numpy as np
+import tensorflow as tf
+
+from question_answering.inference import qa_inference
+
+
+@dataclass
+class QARequest:
+    question: str
+    context: str
+    timeout: float
+    priority: int = 0
+    n_best: int = 20
+    max_answer_length: int = 30
+    request_id: str = field(default_factory=lambda: uuid4().hex)
+
+
+@dataclass
+class QAResponse:
+    request_id: str
+    priority: int
+    status: str
+    predicted_text: str | None
+    latency: float
+    windows_used: int
+    windows_total: int
+
+
+@dataclass
+class _ScheduledRequest:
+    request: QARequest
+    features: dict
+    arrival_time: float
+    deadline: float
+
+    @property
+    def num_windows(self):
+        return len(self.features["input_ids"])
+
+
+class DeadlineAwareScheduler:
+    statuses = ["completed", "degraded", "rejected"]
+
+    def __init__(
+        self,
+        model: tf.keras.Model,
+        tokenizer,
+        max_length: int,
+        stride: int,
+        squad2: bool = False,
+        max_batch_windows: int = 32,
+        initial_seconds_per_window: float = 0.05,
+        cost_smoothing: float = 0.2,
+        degraded_n_best: int = 5,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.stride = stride
+        self.squad2 = squad2
+        self.max_batch_windows = max_batch_windows
+        self.seconds_per_window = initial_seconds_per_window
+        self.cost_smoothing = cost_smoothing
+        self.degraded_n_best = degraded_n_best
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._status_counts = defaultdict(Counter)
+        self._deadline_misses = Counter()
+
+    def submit(self, request: QARequest):
+        arrival_time = timer()
+        features = qa_inference.tokenize_qa_pairs(
+            tokenizer=self.tokenizer,
+            questions=[request.question],
+            contexts=[request.context],
+            example_ids=[request.request_id],
+            max_length=self.max_length,
+            stride=self.stride,
+        )
+        scheduled_request = _ScheduledRequest(
+            request=request,
+            features=features,
+            arrival_time=arrival_time,
+            deadline=arrival_time + request.timeout,
+        )
+
+        with self._lock:
+            heapq.heappush(
+                self._queue,
+                (
+                    request.priority,
+                    scheduled_request.deadline,
+                    next(self._counter),
+                    scheduled_request,
+                ),
+            )
+
+    def pending_requests(self):
+        with self._lock:
+            return len(self._queue)
+
+    def estimate_cost(self, num_windows: int):
+        return num_windows * self.seconds_per_window
+
+    def process_next_batch(self):
+        admitted, rejected = self.__pack_batch(now=timer())
+
+        responses = [
+            self.__record(scheduled_request, "rejected", None, 0)
+            for scheduled_request in rejected
+        ]
+        if not admitted:
+            return responses
+
+        batch_features = qa_inference.concatenate_features(
+            [features for _, features, _, _ in admitted]
+        )
+        batch_windows = len(batch_features["input_ids"])
+
+        start_time = timer()
+        start_logits, end_logits = qa_inference.predict_feature_logits(
+            model=self.model, features=batch_features, batch_size=batch_windows
+        )
+        self.__update_cost_estimate(timer() - start_time, batch_windows)
+
+        feature_start = 0
+        for scheduled_request, features, n_best, status in admitted:
+            request = scheduled_request.request
+            num_features = len(features["input_ids"])
+            feature_end = feature_start + num_features
+
+            predicted_text = qa_inference.decode_predicted_texts(
+                start_logits=start_logits[feature_start:feature_end],
+                end_logits=end_logits[feature_start:feature_end],
+                features=features,
+                example_ids=[request.request_id],
+                contexts=[request.context],
+                squad2=self.squad2,
+                n_best=n_best,
+                max_answer_length=request.max_answer_length,
+            )[0]
+            responses.append(
+                self.__record(scheduled_request, status, predicted_text, num_features)
+            )
+            feature_start = feature_end
+
+        return responses
+
+    def run_until_empty(self):
+        responses = []
+        while self.pending_requests() > 0:
+            responses.extend(self.process_next_batch())
+        return responses
+
+    def get_metrics(self):
+        metrics = {}
+        for priority in sorted(self._status_counts.keys()):
+            status_counts = self._status_counts[priority]
+            total = sum(status_counts.values())
+            latencies = self._latencies[priority]
+
+            priority_metrics = {
+                status: status_counts[status] for status in self.statuses
+            }
+            priority_metrics["total"] = total
+            priority_metrics["rejection_rate"] = status_counts["rejected"] / total
+            priority_metrics["deadline_misses"] = self._deadline_misses[priority]
+            if latencies:
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                priority_metrics["latency_p50"] = float(p50)
+                priority_metrics["latency_p95"] = float(p95)
+                priority_metrics["latency_p99"] = float(p99)
+
+            metrics[priority] = priority_metrics
+        return metrics
+
+    def __pack_batch(self, now: float):
+        admitted = []
+        rejected = []
+        deferred = []
+        batch_windows = 0
+
+        with self._lock:
+            while self._queue and batch_windows < self.max_batch_windows:
+                queue_entry = heapq.heappop(self._queue)
+                scheduled_request = queue_entry[-1]
+                request = scheduled_request.request
+                num_windows = scheduled_request.num_windows
+                available_windows = self.max_batch_windows - batch_windows
+                time_left = scheduled_request.deadline - now
+
+                # Windows which can be computed before the deadline, including
+                # the ones already packed into this batch
+                affordable_windows = (
+                    int(time_left / self.seconds_per_window) - batch_windows
+                )
+
+                # An oversized request is allowed to take a whole batch on its own
+                if num_windows <= affordable_windows and (
+                    num_windows <= available_windows or batch_windows == 0
+                ):
+                    admitted.append(
+                        (
+                            scheduled_request,
+                            scheduled_request.features,
+                            request.n_best,
+                            "completed",
+                        )
+                    )
+                    batch_windows += num_windows
+                elif (
+                    int(time_left / self.seconds_per_window)
+                    >= self.max_batch_windows + num_windows
+                ):
+                    # Request does not fit this batch but can still wait for the next one
+                    deferred.append(queue_entry)
+                elif min(available_windows, affordable_windows) >= 1:
+                    kept_windows = min(available_windows, affordable_windows)
+                    admitted.append(
+                        (
+                            scheduled_request,
+                            self.__select_best_windows(
+                                scheduled_request.features, kept_windows
+                            ),
+                            min(request.n_best, self.degraded_n_best),
+                            "degraded",
+                        )
+                    )
+                    batch_windows += kept_windows
+                else:
+                    rejected.append(scheduled_request)
+
+            for queue_entry in deferred:
+                heapq.heappush(self._queue, queue_entry)
+
+        return admitted, rejected
+
+    def __select_best_windows(self, features: dict, num_windows: int):
+        window_scores = qa_inference.score_windows_by_question_overlap(features)
+        best_windows = sorted(np.argsort(window_scores)[::-1][:num_windows].tolist())
+        return qa_inference.select_features(features, best_windows)
+
+    def __update_cost_estimate(self, elapsed_time: float, num_windows: int):
+        observed_seconds_per_window = elapsed_time / num_windows
+        self.seconds_per_window = (
+            (1 - self.cost_smoothing) * self.seconds_per_window
+            + self.cost_smoothing * observed_seconds_per_window
+        )
+
+    def __record(
+        self,
+        scheduled_request: _ScheduledRequest,
+        status: str,
+        predicted_text: str | None,
+        windows_used: int,
+    ):
+        request = scheduled_request.request
+        finish_time = timer()
+        latency = finish_time - scheduled_request.arrival_time
+
+        self._status_counts[request.priority][status] += 1
+        if status != "rejected":
+            self._latencies[request.priority].append(latency)
+            if finish_time > scheduled_request.deadline:
+                self._deadline_misses[request.priority] += 1
+
+        return QAResponse(
+            request_id=request.request_id,
+            priority=request.priority,
+            status=status,
+            predicted_text=predicted_text,
+            latency=latency,
+            windows_used=windows_used,
+            windows_total=scheduled_request.num_windows,
+        )
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.utils import core_qa_utils, evaluation
+
+
+class BackgroundEvaluationCallback(tf.keras.callbacks.Callback):
+    def __init__(
+        self,
+        model_factory,
+        features: Dataset,
+        examples: Dataset,
+        squad2: bool,
+        batch_size: int = 32,
+        metric_variant: str = "01_best_normalized",
+        max_answer_length: int = 30,
+        model_name: str | None = None,
+    ):
+        super().__init__()
+        self.model_factory = model_factory
+        self.features = features
+        self.examples = examples
+        self.squad2 = squad2
+        self.batch_size = batch_size
+        self.metric_variant = metric_variant
+        self.max_answer_length = max_answer_length
+        self.model_name = model_name
+
+        self.evaluation_model = None
+        self.executor = None
+        self.futures = []
+        self.results = []
+        self.wait_time = 0.0
+
+    def on_train_begin(self, logs=None):
+        # One worker keeps evaluations in epoch order and bounds extra memory
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+        self.results = []
+        self.wait_time = 0.0
+
+    def on_epoch_end(self, epoch, logs=None):
+        # Weights are copied to host memory, training continues right away
+        weights = self.model.get_weights()
+        self.futures.append(self.executor.submit(self.__evaluate, epoch, weights))
+
+    def on_train_end(self, logs=None):
+        start_time = timer()
+        self.results = [future.result() for future in self.futures]
+        self.executor.shutdown()
+        self.wait_time = timer() - start_time
+
+        # Metrics land in the history, so get_best_epoch can select on them
+        history = self.model.history.history
+        for metric in ["val_exact_match", "val_f1"]:
+            history[metric] = [result[metric] for result in self.results]
+
+    def get_best_epoch(self, metric: str = "val_f1"):
+        return core_qa_utils.get_best_epoch(
+            {metric: [result[metric] for result in self.results]},
+            metric=metric,
+            metric_evaluator="max",
+        )
+
+    def __evaluate(self, epoch: int, weights: list):
+        start_time = timer()
+        if self.evaluation_model is None:
+            self.evaluation_model = self.model_factory()
+            if not self.evaluation_model.built:
+                self.evaluation_model(self.evaluation_model.dummy_inputs)
+        self.evaluation_model.set_weights(weights)
+
+        tf_dataset = core_qa_utils.build_tf_dataset(
+            hf_dataset=self.features,
+            columns=evaluation.get_model_input_names(self.features.features),
+            label_cols=None,
+            batch_size=self.batch_size,
+        )
+        start_logits, end_logits = evaluation.predict_logits(
+            model=self.evaluation_model,
+            tf_dataset=tf_dataset,
+            features=self.features,
+            use_logit_cache=False,
+        )
+        evaluation_data = evaluation.evaluate_predictions(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=self.features,
+            examples=self.examples,
+            squad2=self.squad2,
+            n_bests=[self.metric_variant.split("_")[0]],
+            max_answer_length=self.max_answer_length,
+            model_name=self.model_name,
+            prediction_log_filename=f"predictions_epoch_{epoch + 1:02d}.arrow",
+        )
+        return {
+            "epoch": epoch + 1,
+            "val_exact_match": evaluation_data["exact_match"][self.metric_variant],
+            "val_f1": evaluation_data["f1"][self.metric_variant],
+            "evaluation_time": timer() - start_time,
+        }
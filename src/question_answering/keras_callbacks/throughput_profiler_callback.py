@@ -0,0 +1,125 @@
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.utils import core_qa_utils
+from question_answering.utils.instrumentation import get_peak_rss_in_bytes
+
+
+def count_real_tokens(hf_dataset: Dataset, mask_column: str = "attention_mask"):
+    return int(sum(np.sum(mask) for mask in hf_dataset[mask_column]))
+
+
+class ThroughputProfilerCallback(tf.keras.callbacks.Callback):
+    def __init__(
+        self,
+        num_examples: int,
+        num_real_tokens: int | None = None,
+        sequence_length: int | None = None,
+        skip_first_steps: int = 1,
+        tf_dataset: tf.data.Dataset | None = None,
+        input_benchmark_batches: int = 50,
+    ):
+        super().__init__()
+        self.num_examples = num_examples
+        self.num_real_tokens = num_real_tokens
+        self.sequence_length = sequence_length
+        self.skip_first_steps = skip_first_steps
+        self.tf_dataset = tf_dataset
+        self.input_benchmark_batches = input_benchmark_batches
+
+        self.batch_start_time = None
+        self.epoch_start_time = None
+        self.training_start_time = None
+        self.training_end_time = None
+        self.input_time_per_step = None
+        self.epochs = []
+        self.step_times = []
+
+    def on_train_begin(self, logs=None):
+        # Keras fetches batches inside the train step, so callbacks cannot see the
+        # input wait. The pipeline is timed on its own instead, without the model.
+        if self.tf_dataset is not None:
+            input_benchmark = core_qa_utils.benchmark_tf_dataset(
+                self.tf_dataset, num_epochs=1, max_batches=self.input_benchmark_batches
+            )[0]
+            self.input_time_per_step = 1 / input_benchmark["batches_per_second"]
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start_time = timer()
+        self.training_start_time = None
+        self.step_times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start_time = timer()
+        if self.training_start_time is None:
+            self.training_start_time = self.batch_start_time
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.training_end_time = timer()
+        self.step_times.append(self.training_end_time - self.batch_start_time)
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = timer() - self.epoch_start_time
+        # Validation runs before on_epoch_end, throughput only covers training steps
+        training_time = self.training_end_time - self.training_start_time
+        # The first steps include tracing and are left out of the latency statistics
+        step_times = np.array(
+            self.step_times[self.skip_first_steps :] or self.step_times
+        )
+
+        epoch_summary = {
+            "epoch": epoch + 1,
+            "epoch_time": epoch_time,
+            "training_time": training_time,
+            "steps": len(self.step_times),
+            "step_time_p50": float(np.percentile(step_times, 50)),
+            "step_time_p95": float(np.percentile(step_times, 95)),
+            "step_time_p99": float(np.percentile(step_times, 99)),
+            "step_time_mean": float(np.mean(step_times)),
+            # Steps include fetching their batch as well as computing on it
+            "step_time_total": float(np.sum(self.step_times)),
+            "examples_per_second": self.num_examples / training_time,
+            "peak_rss_bytes": get_peak_rss_in_bytes(),
+        }
+        if self.input_time_per_step is not None:
+            # Close to 1 means the pipeline alone needs as long as a whole step
+            epoch_summary["input_time_per_step"] = self.input_time_per_step
+            epoch_summary["input_bound_ratio"] = min(
+                1.0, self.input_time_per_step / epoch_summary["step_time_mean"]
+            )
+        if self.num_real_tokens is not None:
+            epoch_summary["real_tokens_per_second"] = (
+                self.num_real_tokens / training_time
+            )
+            if self.sequence_length is not None:
+                epoch_summary["padding_ratio"] = 1 - self.num_real_tokens / (
+                    self.num_examples * self.sequence_length
+                )
+        self.epochs.append(epoch_summary)
+
+    def get_summary(self):
+        summary = {"epochs": self.epochs}
+        if self.epochs:
+            summary["peak_rss_bytes"] = max(
+                epoch["peak_rss_bytes"] for epoch in self.epochs
+            )
+            for key in [
+                "step_time_p50",
+                "step_time_p95",
+                "step_time_p99",
+                "input_bound_ratio",
+                "examples_per_second",
+                "real_tokens_per_second",
+            ]:
+                if key in self.epochs[0]:
+                    summary[key] = float(np.mean([epoch[key] for epoch in self.epochs]))
+        return summary
+
+    def save_summary(self, dir_path: Path, filename: str = "profiling_summary.json"):
+        core_qa_utils.save_dict_as_json(
+            dictionary=self.get_summary(), dir_path=dir_path, filename=filename
+        )
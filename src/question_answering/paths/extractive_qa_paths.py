@@ -5,10 +5,18 @@ root = find_root(has_dir(".git"))
 extractive_qa_dir = root / "extractive-qa"
 training_checkpoints_dir = extractive_qa_dir / "training-checkpoints"
 saved_models_dir = extractive_qa_dir / "tf-models"
+exported_models_dir = extractive_qa_dir / "exported-models"
 hub_models_location = extractive_qa_dir / "hub-models"
 data_dir = extractive_qa_dir / "data"
 datasets_dir = data_dir / "datasets"
 squad1_dataset_dir = datasets_dir / "squad1"
 squad2_dataset_dir = datasets_dir / "squad2"
+retrieval_indexes_dir = data_dir / "retrieval-indexes"
 model_evaluation_dir = extractive_qa_dir / "model-evaluation"
+results_store_path = extractive_qa_dir / "results-store" / "results.sqlite"
+logit_cache_dir = extractive_qa_dir / "logit-cache"
+batch_inference_dir = extractive_qa_dir / "batch-inference"
+sweeps_dir = extractive_qa_dir / "sweeps"
+benchmarks_dir = extractive_qa_dir / "benchmarks"
+runtime_config_path = extractive_qa_dir / "runtime-config" / "runtime_config.json"
 general_figures_dir = extractive_qa_dir / "figures"
@@ -0,0 +1,310 @@
+import argparse
+import hashlib
+import json
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from shutil import rmtree
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.inference import qa_inference
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import core_qa_utils
+
+token_pattern = re.compile(r"\w+")
+passage_separator = "\n\n"
+
+
+def tokenize_text(text: str):
+    return token_pattern.findall(text.lower())
+
+
+def get_unique_contexts(datasets: list[Dataset]):
+    contexts = []
+    for dataset in datasets:
+        contexts.extend(dataset["context"])
+    return list(dict.fromkeys(contexts))
+
+
+def build_bm25_index(passages: list[str], index_dir: Path):
+    term_to_id = {}
+    term_postings = defaultdict(list)
+    document_lengths = np.zeros(len(passages), dtype=np.int32)
+
+    for doc_id, passage in enumerate(passages):
+        tokens = tokenize_text(passage)
+        document_lengths[doc_id] = len(tokens)
+        for term, term_frequency in Counter(tokens).items():
+            term_id = term_to_id.setdefault(term, len(term_to_id))
+            term_postings[term_id].append((doc_id, term_frequency))
+
+    # Postings of all terms are stored back to back, term_offsets marks the slices
+    term_offsets = np.zeros(len(term_to_id) + 1, dtype=np.int64)
+    for term_id in range(len(term_to_id)):
+        term_offsets[term_id + 1] = term_offsets[term_id] + len(term_postings[term_id])
+
+    postings_doc_ids = np.empty(term_offsets[-1], dtype=np.int32)
+    postings_term_frequencies = np.empty(term_offsets[-1], dtype=np.float32)
+    for term_id, postings in term_postings.items():
+        start, end = term_offsets[term_id], term_offsets[term_id + 1]
+        postings_doc_ids[start:end] = [doc_id for doc_id, _ in postings]
+        postings_term_frequencies[start:end] = [frequency for _, frequency in postings]
+
+    core_qa_utils.create_dirs_if_not_exists(index_dir)
+    np.save(index_dir / "term_offsets.npy", term_offsets)
+    np.save(index_dir / "postings_doc_ids.npy", postings_doc_ids)
+    np.save(index_dir / "postings_term_frequencies.npy", postings_term_frequencies)
+    np.save(index_dir / "document_lengths.npy", document_lengths)
+    with open(index_dir / "vocabulary.json", "w") as fp:
+        json.dump(term_to_id, fp)
+    with open(index_dir / "passages.json", "w") as fp:
+        json.dump(passages, fp)
+
+
+def get_index_params(dataset_dir: Path, index_filenames: list[str]):
+    # Source files are fingerprinted by content, edited datasets keep their names
+    sources_hash = hashlib.sha256()
+    for filename in index_filenames:
+        sources_hash.update(filename.encode())
+        with open(dataset_dir / filename, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                sources_hash.update(chunk)
+    return {
+        "index_filenames": index_filenames,
+        "sources_fingerprint": sources_hash.hexdigest(),
+    }
+
+
+def build_bm25_index_if_changed(
+    dataset_dir: Path, index_filenames: list[str], index_dir: Path
+):
+    index_params = get_index_params(dataset_dir, index_filenames)
+    index_params_path = index_dir / "index_params.json"
+    if (
+        index_params_path.is_file()
+        and core_qa_utils.read_json_as_dict(index_params_path) == index_params
+    ):
+        return False
+
+    passages = get_unique_contexts(
+        core_qa_utils.load_datasets_from_json(
+            dataset_path=dataset_dir, filenames=index_filenames
+        )
+    )
+    build_bm25_index(passages, index_dir)
+    # Written last, its presence marks the index as complete
+    core_qa_utils.save_dict_as_json(
+        index_params, dir_path=index_dir, filename=index_params_path.name
+    )
+    return True
+
+
+class BM25Retriever:
+    def __init__(self, index_dir: Path, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        with open(index_dir / "vocabulary.json", "r") as fp:
+            self.term_to_id = json.load(fp)
+        with open(index_dir / "passages.json", "r") as fp:
+            self.passages = json.load(fp)
+
+        self.term_offsets = np.load(index_dir / "term_offsets.npy", mmap_mode="r")
+        self.postings_doc_ids = np.load(
+            index_dir / "postings_doc_ids.npy", mmap_mode="r"
+        )
+        self.postings_term_frequencies = np.load(
+            index_dir / "postings_term_frequencies.npy", mmap_mode="r"
+        )
+        document_lengths = np.load(index_dir / "document_lengths.npy")
+
+        self.num_documents = len(document_lengths)
+        document_frequencies = np.diff(self.term_offsets)
+        self.idf = np.log(
+            1
+            + (self.num_documents - document_frequencies + 0.5)
+            / (document_frequencies + 0.5)
+        ).astype(np.float32)
+        self.length_norms = (
+            self.k1 * (1 - self.b + self.b * document_lengths / document_lengths.mean())
+        ).astype(np.float32)
+
+    def retrieve(self, queries: list[str], top_k: int = 10, batch_size: int = 64):
+        results = []
+        for batch_start in range(0, len(queries), batch_size):
+            results.extend(
+                self.__retrieve_batch(
+                    queries[batch_start : batch_start + batch_size], top_k
+                )
+            )
+        return results
+
+    def get_passages(self, doc_ids: list[int]):
+        return [self.passages[doc_id] for doc_id in doc_ids]
+
+    def __retrieve_batch(self, queries: list[str], top_k: int):
+        scores = np.zeros((len(queries), self.num_documents), dtype=np.float32)
+
+        # Each term's postings are scored once for all queries of the batch using it
+        term_to_queries = defaultdict(list)
+        for query_index, query in enumerate(queries):
+            for term in set(tokenize_text(query)):
+                if term in self.term_to_id:
+                    term_to_queries[self.term_to_id[term]].append(query_index)
+
+        for term_id, query_indices in term_to_queries.items():
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            doc_ids = self.postings_doc_ids[start:end]
+            term_frequencies = self.postings_term_frequencies[start:end]
+            term_scores = (
+                self.idf[term_id]
+                * term_frequencies
+                * (self.k1 + 1)
+                / (term_frequencies + self.length_norms[doc_ids])
+            )
+            for query_index in query_indices:
+                scores[query_index, doc_ids] += term_scores
+
+        top_k = min(top_k, self.num_documents)
+        top_doc_ids = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for query_index, doc_ids in enumerate(top_doc_ids):
+            doc_scores = scores[query_index, doc_ids]
+            order = np.argsort(-doc_scores)
+            results.append(
+                [
+                    (int(doc_id), float(score))
+                    for doc_id, score in zip(doc_ids[order], doc_scores[order])
+                ]
+            )
+        return results
+
+
+def answer_open_questions(
+    retriever: BM25Retriever,
+    model: tf.keras.Model,
+    tokenizer,
+    questions: list[str],
+    max_length: int,
+    stride: int,
+    top_k: int = 3,
+    squad2: bool = False,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+    batch_size: int = 32,
+):
+    retrieved = retriever.retrieve(questions, top_k=top_k)
+
+    # Top passages of a question are read as one strided context
+    contexts = [
+        passage_separator.join(
+            retriever.get_passages([doc_id for doc_id, _ in question_results])
+        )
+        for question_results in retrieved
+    ]
+    example_ids = [str(i) for i in range(len(questions))]
+
+    features = qa_inference.tokenize_qa_pairs(
+        tokenizer=tokenizer,
+        questions=questions,
+        contexts=contexts,
+        example_ids=example_ids,
+        max_length=max_length,
+        stride=stride,
+    )
+    start_logits, end_logits = qa_inference.predict_feature_logits(
+        model=model, features=features, batch_size=batch_size
+    )
+    predicted_texts = qa_inference.decode_predicted_texts(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        example_ids=example_ids,
+        contexts=contexts,
+        squad2=squad2,
+        n_best=n_best,
+        max_answer_length=max_answer_length,
+    )
+    return predicted_texts, retrieved
+
+
+def calculate_recall_at_k(
+    retriever: BM25Retriever,
+    dataset: Dataset,
+    ks: tuple[int, ...] = (1, 5, 10, 20),
+    batch_size: int = 64,
+):
+    passage_to_doc_id = {
+        passage: doc_id for doc_id, passage in enumerate(retriever.passages)
+    }
+    gold_doc_ids = [
+        passage_to_doc_id.get(context, -1) for context in dataset["context"]
+    ]
+
+    start_time = timer()
+    retrieved = retriever.retrieve(
+        dataset["question"], top_k=max(ks), batch_size=batch_size
+    )
+    total_time = timer() - start_time
+
+    recall = {}
+    for k in ks:
+        hits = sum(
+            gold_doc_id in [doc_id for doc_id, _ in question_results[:k]]
+            for gold_doc_id, question_results in zip(gold_doc_ids, retrieved)
+        )
+        recall[f"recall@{k}"] = hits / len(gold_doc_ids)
+
+    recall["queries_per_second"] = len(gold_doc_ids) / total_time
+    return recall
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a BM25 index over dataset contexts and report recall@k"
+    )
+    parser.add_argument("--dataset-dir", type=Path, required=True)
+    parser.add_argument(
+        "--index-filenames",
+        nargs="+",
+        default=["original_train.json", "original_test.json"],
+        help="datasets whose contexts make up the indexed corpus",
+    )
+    parser.add_argument("--filename", default="original_test.json")
+    parser.add_argument("--index-name", required=True)
+    parser.add_argument("--rebuild-index", action="store_true")
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    index_dir = extractive_qa_paths.retrieval_indexes_dir / args.index_name
+    if args.rebuild_index and index_dir.exists():
+        rmtree(index_dir)
+    start_time = timer()
+    if build_bm25_index_if_changed(args.dataset_dir, args.index_filenames, index_dir):
+        print(f"Indexed the corpus in {timer() - start_time:.1f}s")
+
+    dataset = core_qa_utils.load_datasets_from_json(
+        dataset_path=args.dataset_dir, filenames=[args.filename]
+    )[0]
+    recall = calculate_recall_at_k(
+        retriever=BM25Retriever(index_dir),
+        dataset=dataset,
+        ks=tuple(args.ks),
+        batch_size=args.batch_size,
+    )
+    for name, value in recall.items():
+        print(f"{name}: {value:.4f}")
+    core_qa_utils.save_dict_as_json(
+        recall,
+        dir_path=extractive_qa_paths.benchmarks_dir,
+        filename=f"bm25_recall_{args.index_name}_{Path(args.filename).stem}.json",
+    )
+
+
+if __name__ == "__main__":
+    main()
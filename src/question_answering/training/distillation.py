@@ -0,0 +1,538 @@
+import argparse
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    TFAutoModelForQuestionAnswering,
+)
+
+from question_answering.benchmarks import synthetic_data
+from question_answering.keras_callbacks.time_measure_callback import (
+    TimeMeasureCallback,
+)
+from question_answering.paths import extractive_qa_paths
+from question_answering.training.multi_worker_training import (
+    model_label_columns,
+    preprocess_training_examples,
+)
+from question_answering.utils import (
+    core_preprocessing,
+    core_qa_utils,
+    evaluation,
+    model_registry,
+    runtime_config,
+)
+from question_answering.utils.logit_cache import LogitCache
+
+teacher_logit_columns = ["teacher_start_logits", "teacher_end_logits"]
+# Models whose encoder shares one set of layer weights instead of a layer list
+shared_layer_model_types = ["albert"]
+
+
+def create_student_config(
+    teacher_config,
+    num_hidden_layers: int,
+    hidden_size: int | None = None,
+    num_attention_heads: int | None = None,
+    intermediate_size: int | None = None,
+):
+    # Vocabulary and position settings stay the same, so the teacher tokenizer fits
+    student_config = teacher_config.__class__.from_dict(teacher_config.to_dict())
+    student_config.num_hidden_layers = num_hidden_layers
+    if hidden_size is not None:
+        student_config.hidden_size = hidden_size
+        student_config.intermediate_size = intermediate_size or 4 * hidden_size
+    if num_attention_heads is not None:
+        student_config.num_attention_heads = num_attention_heads
+    if student_config.hidden_size % student_config.num_attention_heads:
+        raise Exception("Hidden size must be divisible by the number of heads!")
+    return student_config
+
+
+def get_teacher_layer_indices(
+    num_teacher_layers: int, num_student_layers: int
+) -> list[int]:
+    # Evenly spaced teacher layers, e.g. every other layer for a half-depth student
+    if num_student_layers > num_teacher_layers:
+        raise Exception("Student cannot have more layers than the teacher!")
+    step = num_teacher_layers / num_student_layers
+    return [int(i * step) for i in range(num_student_layers)]
+
+
+def validate_teacher_initialization(teacher_config, student_config):
+    if teacher_config.model_type in shared_layer_model_types:
+        raise Exception(
+            f"{teacher_config.model_type.upper()} teachers share their layer weights, "
+            "so the student cannot copy them, use a random init instead!"
+        )
+    if student_config.hidden_size != teacher_config.hidden_size:
+        raise Exception(
+            "Student hidden size must match the teacher to copy its layers!"
+        )
+
+
+def __get_encoder_layers(model: tf.keras.Model):
+    main_layer = getattr(model, model.base_model_prefix)
+    encoder = getattr(main_layer, "encoder", None) or getattr(
+        main_layer, "transformer", None
+    )
+    if not hasattr(encoder, "layer"):
+        raise Exception(
+            f"Cannot find the encoder layers of {model.config.model_type} models!"
+        )
+    return encoder.layer
+
+
+def initialize_student_from_teacher(student: tf.keras.Model, teacher: tf.keras.Model):
+    validate_teacher_initialization(
+        teacher_config=teacher.config, student_config=student.config
+    )
+    # Weights only exist once the models have been called
+    student(student.dummy_inputs)
+    teacher(teacher.dummy_inputs)
+    student_main_layer = getattr(student, student.base_model_prefix)
+    teacher_main_layer = getattr(teacher, teacher.base_model_prefix)
+    student_main_layer.embeddings.set_weights(
+        teacher_main_layer.embeddings.get_weights()
+    )
+    student_layers = __get_encoder_layers(student)
+    teacher_layers = __get_encoder_layers(teacher)
+    layer_indices = get_teacher_layer_indices(
+        num_teacher_layers=len(teacher_layers),
+        num_student_layers=len(student_layers),
+    )
+    for student_layer, teacher_index in zip(student_layers, layer_indices):
+        student_layer.set_weights(teacher_layers[teacher_index].get_weights())
+    student.qa_outputs.set_weights(teacher.qa_outputs.get_weights())
+    return layer_indices
+
+
+def create_student_model(
+    teacher: tf.keras.Model,
+    initialize_from_teacher: bool = True,
+    **student_config_kwargs,
+):
+    student_config = create_student_config(teacher.config, **student_config_kwargs)
+    if initialize_from_teacher:
+        validate_teacher_initialization(
+            teacher_config=teacher.config, student_config=student_config
+        )
+    student = TFAutoModelForQuestionAnswering.from_config(student_config)
+    if initialize_from_teacher:
+        initialize_student_from_teacher(student=student, teacher=teacher)
+    return student
+
+
+def add_teacher_logits(
+    teacher: tf.keras.Model,
+    train_features: Dataset,
+    batch_size: int,
+    logit_cache: LogitCache | None = None,
+):
+    # Teacher logits are computed once instead of on every student step
+    tf_dataset = core_qa_utils.build_tf_dataset(
+        hf_dataset=train_features,
+        columns=evaluation.get_model_input_names(train_features.features),
+        label_cols=None,
+        batch_size=batch_size,
+    )
+    start_logits, end_logits = evaluation.predict_logits(
+        model=teacher,
+        tf_dataset=tf_dataset,
+        features=train_features,
+        logit_cache=logit_cache,
+    )
+    return train_features.add_column(
+        teacher_logit_columns[0], list(np.asarray(start_logits, dtype=np.float32))
+    ).add_column(
+        teacher_logit_columns[1], list(np.asarray(end_logits, dtype=np.float32))
+    )
+
+
+class DistillationModel(tf.keras.Model):
+    def __init__(self, student: tf.keras.Model, temperature: float, alpha: float):
+        super().__init__()
+        self.student = student
+        self.temperature = temperature
+        self.alpha = alpha
+        self.hard_loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(
+            from_logits=True
+        )
+        self.loss_tracker = tf.keras.metrics.Mean(name="loss")
+        self.soft_loss_tracker = tf.keras.metrics.Mean(name="soft_loss")
+        self.hard_loss_tracker = tf.keras.metrics.Mean(name="hard_loss")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.soft_loss_tracker, self.hard_loss_tracker]
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+    def train_step(self, data):
+        inputs, labels = data
+        with tf.GradientTape() as tape:
+            output = self.student(inputs, training=True)
+            soft_loss = 0.0
+            hard_loss = 0.0
+            for position, logit_column in zip(["start", "end"], teacher_logit_columns):
+                student_logits = output[f"{position}_logits"]
+                soft_loss += self.__soft_loss(labels[logit_column], student_logits)
+                hard_loss += self.hard_loss_fn(
+                    labels[f"{position}_positions"], student_logits
+                )
+            soft_loss /= 2
+            hard_loss /= 2
+            loss = self.alpha * soft_loss + (1 - self.alpha) * hard_loss
+
+        gradients = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.soft_loss_tracker.update_state(soft_loss)
+        self.hard_loss_tracker.update_state(hard_loss)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+    def __soft_loss(self, teacher_logits, student_logits):
+        # KL divergence between softened distributions, scaled by T^2 as in Hinton et al.
+        teacher_probs = tf.nn.softmax(teacher_logits / self.temperature, axis=-1)
+        student_log_probs = tf.nn.log_softmax(
+            student_logits / self.temperature, axis=-1
+        )
+        kl_divergence = tf.reduce_sum(
+            teacher_probs * (tf.math.log(teacher_probs + 1e-12) - student_log_probs),
+            axis=-1,
+        )
+        return tf.reduce_mean(kl_divergence) * self.temperature**2
+
+
+def train_student(
+    student: tf.keras.Model,
+    distillation_features: Dataset,
+    epochs: int,
+    batch_size: int,
+    initial_learning_rate: float,
+    temperature: float = 2.0,
+    alpha: float = 0.5,
+    seed: int = 42,
+):
+    tf_train_dataset = core_qa_utils.build_tf_dataset(
+        hf_dataset=distillation_features,
+        columns=evaluation.get_model_input_names(distillation_features.features),
+        label_cols=model_label_columns + teacher_logit_columns,
+        batch_size=batch_size,
+        shuffle=True,
+        seed=seed,
+    )
+    lr_scheduler = tf.keras.optimizers.schedules.PolynomialDecay(
+        initial_learning_rate=initial_learning_rate,
+        end_learning_rate=0.0,
+        decay_steps=len(tf_train_dataset) * epochs,
+    )
+
+    distillation_model = DistillationModel(
+        student=student, temperature=temperature, alpha=alpha
+    )
+    distillation_model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=lr_scheduler)
+    )
+    time_measure_cb = TimeMeasureCallback()
+    history = distillation_model.fit(
+        tf_train_dataset, epochs=epochs, callbacks=[time_measure_cb], verbose=0
+    )
+    history = {
+        metric: [float(value) for value in values]
+        for metric, values in history.history.items()
+    }
+    return student, history, time_measure_cb.total_training_time()
+
+
+def compare_teacher_and_student(
+    teacher: tf.keras.Model,
+    student: tf.keras.Model,
+    test_features: Dataset,
+    test_examples: Dataset,
+    squad2: bool,
+    batch_size: int = 32,
+):
+    get_predicted_texts = evaluation.get_predicted_texts_function(squad2)
+    metrics_module = evaluation.get_metrics_module(squad2)
+    tf_test_dataset = core_qa_utils.build_tf_dataset(
+        hf_dataset=test_features,
+        columns=evaluation.get_model_input_names(test_features.features),
+        label_cols=None,
+        batch_size=batch_size,
+    )
+
+    results = {}
+    for model_role, model in [("teacher", teacher), ("student", student)]:
+        # One untimed batch keeps graph tracing out of the measurement
+        model.predict(tf_test_dataset.take(1), verbose=0)
+        start_time = timer()
+        start_logits, end_logits = evaluation.predict_logits(
+            model=model,
+            tf_dataset=tf_test_dataset,
+            features=test_features,
+            use_logit_cache=False,
+        )
+        inference_time = timer() - start_time
+
+        predicted_texts = get_predicted_texts(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=test_features,
+            examples=test_examples,
+        )
+        qa_metrics = metrics_module.calculate_squad_qa_metrics(
+            answers=test_examples["answer_text"],
+            predicted_texts=predicted_texts,
+            normalize=True,
+        )
+        results[model_role] = {
+            "exact_match": qa_metrics["exact_match"],
+            "f1": qa_metrics["f1"],
+            "inference_time": inference_time,
+            "examples_per_second": len(test_examples) / inference_time,
+            "features_per_second": len(test_features) / inference_time,
+            "num_parameters": int(model.count_params()),
+            "size_in_bytes": model_registry.get_model_size_in_bytes(model),
+        }
+
+    results["speedup"] = (
+        results["student"]["examples_per_second"]
+        / results["teacher"]["examples_per_second"]
+    )
+    results["exact_match_delta"] = (
+        results["student"]["exact_match"] - results["teacher"]["exact_match"]
+    )
+    results["f1_delta"] = results["student"]["f1"] - results["teacher"]["f1"]
+    return results
+
+
+def load_synthetic_teacher_and_datasets(
+    squad2: bool,
+    num_train_examples: int = 32,
+    num_test_examples: int = 16,
+    seed: int = 42,
+):
+    # A tiny random teacher and generated examples for smoke runs without downloads
+    tokenizer = synthetic_data.create_tiny_tokenizer()
+    teacher = synthetic_data.create_tiny_qa_model(tokenizer, num_hidden_layers=4)
+    train_dataset = synthetic_data.generate_squad_examples(
+        num_train_examples, squad2=squad2, seed=seed
+    )
+    test_dataset = synthetic_data.generate_squad_examples(
+        num_test_examples, squad2=squad2, seed=seed + 1
+    )
+    return tokenizer, teacher, train_dataset, test_dataset
+
+
+def distill(
+    teacher_checkpoint: str | None,
+    student_name: str,
+    dataset_dir: Path | None,
+    squad2: bool,
+    num_hidden_layers: int,
+    hidden_size: int | None = None,
+    num_attention_heads: int | None = None,
+    teacher_model_name: str | None = None,
+    train_filename: str = "original_train.json",
+    test_filename: str = "original_test.json",
+    max_length: int | None = None,
+    stride: int | None = None,
+    epochs: int = 2,
+    batch_size: int = 16,
+    initial_learning_rate: float = 5e-5,
+    temperature: float = 2.0,
+    alpha: float = 0.5,
+    max_train_samples: int | None = None,
+    max_test_samples: int | None = None,
+    initialize_from_teacher: bool = True,
+    use_logit_cache: bool = False,
+    synthetic: bool = False,
+):
+    if synthetic:
+        (
+            tokenizer,
+            teacher,
+            train_dataset,
+            test_dataset,
+        ) = load_synthetic_teacher_and_datasets(squad2=squad2)
+    else:
+        if teacher_checkpoint is None or dataset_dir is None:
+            raise Exception(
+                "A teacher checkpoint and dataset dir are needed without synthetic data!"
+            )
+        tokenizer = AutoTokenizer.from_pretrained(teacher_checkpoint)
+        teacher = (
+            model_registry.get_model(
+                model_checkpoint=teacher_checkpoint, model_name=teacher_model_name
+            )
+            if teacher_model_name is not None
+            else TFAutoModelForQuestionAnswering.from_pretrained(teacher_checkpoint)
+        )
+        train_dataset, test_dataset = core_qa_utils.load_datasets_from_json(
+            dataset_path=dataset_dir, filenames=[train_filename, test_filename]
+        )
+    max_length = max_length or tokenizer.model_max_length
+
+    # An invalid student config fails here, before the costly teacher pass
+    student = create_student_model(
+        teacher=teacher,
+        initialize_from_teacher=initialize_from_teacher,
+        num_hidden_layers=num_hidden_layers,
+        hidden_size=hidden_size,
+        num_attention_heads=num_attention_heads,
+    )
+
+    if max_train_samples is not None:
+        train_dataset = train_dataset.select(
+            range(min(max_train_samples, len(train_dataset)))
+        )
+    if max_test_samples is not None:
+        test_dataset = test_dataset.select(
+            range(min(max_test_samples, len(test_dataset)))
+        )
+    train_features = preprocess_training_examples(
+        examples=train_dataset,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=squad2,
+        stride=stride,
+    )
+    test_examples, test_features = core_preprocessing.preprocess_examples(
+        examples=test_dataset,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=squad2,
+        stride=stride,
+    )
+
+    distillation_features = add_teacher_logits(
+        teacher=teacher,
+        train_features=train_features,
+        batch_size=batch_size,
+        logit_cache=LogitCache() if use_logit_cache else None,
+    )
+    student, history, training_time = train_student(
+        student=student,
+        distillation_features=distillation_features,
+        epochs=epochs,
+        batch_size=batch_size,
+        initial_learning_rate=initial_learning_rate,
+        temperature=temperature,
+        alpha=alpha,
+    )
+
+    # The student architecture differs from the checkpoint, so its config is saved too
+    student_dir = extractive_qa_paths.saved_models_dir / student_name
+    student.save_pretrained(student_dir)
+    tokenizer.save_pretrained(student_dir)
+
+    comparison = compare_teacher_and_student(
+        teacher=teacher,
+        student=student,
+        test_features=test_features,
+        test_examples=test_examples,
+        squad2=squad2,
+        batch_size=batch_size,
+    )
+    training_data = {
+        "history": history,
+        "attempted_epochs": epochs,
+        "best_epoch": epochs,
+        "training_time": training_time,
+        "gpu": core_qa_utils.get_gpu_name(),
+        "teacher_checkpoint": teacher_checkpoint,
+        "student_config": student.config.to_diff_dict(),
+        "initialized_from_teacher": initialize_from_teacher,
+        "temperature": temperature,
+        "alpha": alpha,
+    }
+    model_evaluation_dir = extractive_qa_paths.model_evaluation_dir / student_name
+    core_qa_utils.save_dict_as_json(
+        training_data, dir_path=model_evaluation_dir, filename="training_data.json"
+    )
+    core_qa_utils.save_dict_as_json(
+        comparison,
+        dir_path=model_evaluation_dir,
+        filename="distillation_comparison.json",
+    )
+    return student, comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Distil a QA teacher into a smaller student reader"
+    )
+    parser.add_argument("--teacher-checkpoint", default=None)
+    parser.add_argument("--teacher-model-name", default=None)
+    parser.add_argument("--student-name", required=True)
+    parser.add_argument("--dataset-dir", type=Path, default=None)
+    parser.add_argument("--train-filename", default="original_train.json")
+    parser.add_argument("--test-filename", default="original_test.json")
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--num-hidden-layers", type=int, required=True)
+    parser.add_argument("--hidden-size", type=int, default=None)
+    parser.add_argument("--num-attention-heads", type=int, default=None)
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--stride", type=int, default=None)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--max-train-samples", type=int, default=None)
+    parser.add_argument("--max-test-samples", type=int, default=None)
+    # Without it the student starts from alternating teacher layers
+    parser.add_argument("--random-init", action="store_true")
+    parser.add_argument("--use-logit-cache", action="store_true")
+    # Smoke run with a tiny random teacher and generated examples
+    parser.add_argument("--synthetic", action="store_true")
+    runtime_config.add_runtime_config_args(parser)
+    args = parser.parse_args()
+    if not args.synthetic and (
+        args.teacher_checkpoint is None or args.dataset_dir is None
+    ):
+        parser.error(
+            "--teacher-checkpoint and --dataset-dir are required without --synthetic"
+        )
+    runtime_config.configure_runtime_from_args(
+        args,
+        model_checkpoint=args.teacher_checkpoint,
+        model_name=args.teacher_model_name,
+        sequence_length=args.max_length,
+        verbose=True,
+    )
+
+    distill(
+        teacher_checkpoint=args.teacher_checkpoint,
+        teacher_model_name=args.teacher_model_name,
+        student_name=args.student_name,
+        dataset_dir=args.dataset_dir,
+        train_filename=args.train_filename,
+        test_filename=args.test_filename,
+        squad2=args.squad2,
+        num_hidden_layers=args.num_hidden_layers,
+        hidden_size=args.hidden_size,
+        num_attention_heads=args.num_attention_heads,
+        max_length=args.max_length,
+        stride=args.stride,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        initial_learning_rate=args.learning_rate,
+        temperature=args.temperature,
+        alpha=args.alpha,
+        max_train_samples=args.max_train_samples,
+        max_test_samples=args.max_test_samples,
+        initialize_from_teacher=not args.random_init,
+        use_logit_cache=args.use_logit_cache,
+        synthetic=args.synthetic,
+    )
+
+
+if __name__ == "__main__":
+    main()
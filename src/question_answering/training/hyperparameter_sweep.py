@@ -0,0 +1,399 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from shutil import rmtree
+from timeit import default_timer as timer
+
+import tensorflow as tf
+from datasets import load_from_disk
+from transformers import (
+    AutoTokenizer,
+    DefaultDataCollator,
+    TFAutoModelForQuestionAnswering,
+)
+
+from question_answering.keras_callbacks.time_measure_callback import (
+    TimeMeasureCallback,
+)
+from question_answering.paths import extractive_qa_paths
+from question_answering.training.multi_worker_training import (
+    compile_qa_model,
+    model_label_columns,
+    preprocess_training_examples,
+)
+from question_answering.utils import (
+    core_preprocessing,
+    core_qa_utils,
+    evaluation,
+    model_management,
+    runtime_config,
+)
+
+default_trial_config = {
+    "learning_rate": 2e-5,
+    "batch_size": 4,
+    "epochs": 2,
+    "planned_epochs": None,
+    "seed": 42,
+}
+short_config_names = {
+    "learning_rate": "lr",
+    "batch_size": "bs",
+    "epochs": "ep",
+    "planned_epochs": "pep",
+    "seed": "seed",
+}
+
+
+def expand_grid(grid: dict[str, list]):
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def get_trial_name(sweep_name: str, config: dict):
+    def format_value(value):
+        # Learning rates follow the lr2e-5 naming of the existing runs
+        if isinstance(value, float):
+            mantissa, exponent = f"{value:e}".split("e")
+            return f"{float(mantissa):g}e{int(exponent)}"
+        return str(value)
+
+    return "-".join(
+        [sweep_name]
+        + [
+            f"{short_config_names.get(key, key)}{format_value(value)}"
+            for key, value in sorted(config.items())
+        ]
+    )
+
+
+def get_max_concurrent_trials(
+    threads_per_trial: int, memory_per_trial_bytes: int | None = None
+):
+    max_trials = max(1, (os.cpu_count() or 1) // threads_per_trial)
+    if memory_per_trial_bytes is not None:
+        available_memory = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        max_trials = min(max_trials, max(1, available_memory // memory_per_trial_bytes))
+    return max_trials
+
+
+def preprocess_sweep_data(
+    model_checkpoint: str,
+    dataset_dir: Path,
+    train_filename: str,
+    test_filename: str,
+    squad2: bool,
+    data_dir: Path,
+    max_length: int | None = None,
+    stride: int | None = None,
+    max_train_samples: int | None = None,
+    max_test_samples: int | None = None,
+):
+    # Tokenized datasets are shared by all trials, so they are built only once
+    data_params = {
+        "model_checkpoint": model_checkpoint,
+        "dataset_dir": str(dataset_dir),
+        "train_filename": train_filename,
+        "test_filename": test_filename,
+        "squad2": squad2,
+        "max_length": max_length,
+        "stride": stride,
+        "max_train_samples": max_train_samples,
+        "max_test_samples": max_test_samples,
+    }
+    data_params_path = data_dir / "data_params.json"
+    if data_params_path.is_file():
+        if core_qa_utils.read_json_as_dict(data_params_path) == data_params:
+            return data_dir
+    if data_dir.exists():
+        rmtree(data_dir)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+    max_length = max_length or tokenizer.model_max_length
+    train_dataset, test_dataset = core_qa_utils.load_datasets_from_json(
+        dataset_path=dataset_dir, filenames=[train_filename, test_filename]
+    )
+    if max_train_samples is not None:
+        train_dataset = train_dataset.select(
+            range(min(max_train_samples, len(train_dataset)))
+        )
+    if max_test_samples is not None:
+        test_dataset = test_dataset.select(
+            range(min(max_test_samples, len(test_dataset)))
+        )
+
+    train_features = preprocess_training_examples(
+        examples=train_dataset,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=squad2,
+        stride=stride,
+    )
+    test_examples, test_features = core_preprocessing.preprocess_examples(
+        examples=test_dataset,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=squad2,
+        stride=stride,
+    )
+    train_features.save_to_disk(str(data_dir / "train_features"))
+    test_examples.save_to_disk(str(data_dir / "test_examples"))
+    test_features.save_to_disk(str(data_dir / "test_features"))
+    # Written last, its presence marks the preprocessing as complete
+    core_qa_utils.save_dict_as_json(
+        data_params, dir_path=data_dir, filename=data_params_path.name
+    )
+    return data_dir
+
+
+def run_trial(
+    trial_name: str,
+    config: dict,
+    model_checkpoint: str,
+    data_dir: Path,
+    squad2: bool,
+    trial_runtime_config: dict,
+    save_model: bool = False,
+):
+    runtime_config.apply_runtime_config(trial_runtime_config)
+    tf.keras.utils.set_random_seed(config["seed"])
+
+    train_features = load_from_disk(str(data_dir / "train_features"))
+    test_examples = load_from_disk(str(data_dir / "test_examples"))
+    test_features = load_from_disk(str(data_dir / "test_features"))
+
+    data_collator = DefaultDataCollator(return_tensors="tf")
+    tf_train_dataset = core_qa_utils.convert_to_tf_dataset(
+        hf_dataset=train_features,
+        columns=evaluation.get_model_input_names(train_features.features),
+        label_cols=model_label_columns,
+        collator=data_collator,
+        batch_size=config["batch_size"],
+        shuffle=True,
+    )
+    tf_test_dataset = core_qa_utils.convert_to_tf_dataset(
+        hf_dataset=test_features,
+        columns=evaluation.get_model_input_names(test_features.features),
+        label_cols=None,
+        collator=data_collator,
+        batch_size=config["batch_size"],
+    )
+
+    model = TFAutoModelForQuestionAnswering.from_pretrained(model_checkpoint)
+    compile_qa_model(
+        model=model,
+        num_train_steps=len(tf_train_dataset)
+        * (config["planned_epochs"] or config["epochs"]),
+        initial_learning_rate=config["learning_rate"],
+    )
+    time_measure_cb = TimeMeasureCallback()
+    history = model.fit(
+        tf_train_dataset,
+        epochs=config["epochs"],
+        callbacks=[time_measure_cb],
+        verbose=0,
+    )
+    history = {
+        metric: [float(value) for value in values]
+        for metric, values in history.history.items()
+    }
+    if save_model:
+        model_management.save_model(model=model, model_name=trial_name)
+
+    # Every trial has its own weights, so the logit cache would never hit
+    start_logits, end_logits = evaluation.predict_logits(
+        model=model,
+        tf_dataset=tf_test_dataset,
+        features=test_features,
+        use_logit_cache=False,
+    )
+    model_evaluation_dir = extractive_qa_paths.model_evaluation_dir / trial_name
+    evaluation_data = evaluation.evaluate_predictions(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=test_features,
+        examples=test_examples,
+        squad2=squad2,
+        model_name=trial_name,
+    )
+
+    training_data = {
+        "history": history,
+        "attempted_epochs": config["epochs"],
+        "best_epoch": config["epochs"],
+        "training_time": time_measure_cb.total_training_time(),
+        "gpu": core_qa_utils.get_gpu_name(),
+        "config": config,
+        "threads": trial_runtime_config["intra_op_threads"],
+    }
+    core_qa_utils.save_dict_as_json(
+        dictionary=history, dir_path=model_evaluation_dir, filename="history.json"
+    )
+    core_qa_utils.save_dict_as_json(
+        training_data, dir_path=model_evaluation_dir, filename="training_data.json"
+    )
+    core_qa_utils.save_dict_as_json(
+        evaluation_data, dir_path=model_evaluation_dir, filename="evaluation_data.json"
+    )
+
+    return {
+        "trial_name": trial_name,
+        "config": config,
+        "training_time": training_data["training_time"],
+        "exact_match": evaluation_data["exact_match"]["01_best_normalized"],
+        "f1": evaluation_data["f1"]["01_best_normalized"],
+    }
+
+
+def run_sweep(
+    sweep_name: str,
+    grid: dict[str, list],
+    model_checkpoint: str,
+    dataset_dir: Path,
+    squad2: bool,
+    train_filename: str = "original_train.json",
+    test_filename: str = "original_test.json",
+    max_length: int | None = None,
+    stride: int | None = None,
+    threads_per_trial: int = 2,
+    max_concurrent_trials: int | None = None,
+    memory_per_trial_bytes: int | None = None,
+    max_train_samples: int | None = None,
+    max_test_samples: int | None = None,
+    save_models: bool = False,
+):
+    grid_configs = expand_grid(grid)
+    if len(grid_configs) == 0:
+        raise Exception("Sweep grid does not contain any trial configs!")
+
+    start_time = timer()
+    data_dir = preprocess_sweep_data(
+        model_checkpoint=model_checkpoint,
+        dataset_dir=dataset_dir,
+        train_filename=train_filename,
+        test_filename=test_filename,
+        squad2=squad2,
+        data_dir=extractive_qa_paths.sweeps_dir / sweep_name / "data",
+        max_length=max_length,
+        stride=stride,
+        max_train_samples=max_train_samples,
+        max_test_samples=max_test_samples,
+    )
+    preprocessing_time = timer() - start_time
+
+    max_concurrent_trials = max_concurrent_trials or get_max_concurrent_trials(
+        threads_per_trial=threads_per_trial,
+        memory_per_trial_bytes=memory_per_trial_bytes,
+    )
+
+    # Spawned single-use workers start with a clean TensorFlow runtime each and
+    # inherit the environment, which pins the native thread pools of every trial
+    trial_runtime_config = runtime_config.get_runtime_config(
+        num_processes=max_concurrent_trials,
+        intra_op_threads=threads_per_trial,
+        inter_op_threads=1,
+    )
+    parent_environ = dict(os.environ)
+    os.environ.update(runtime_config.get_runtime_environ(trial_runtime_config))
+    trials = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(max_concurrent_trials, len(grid_configs)),
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1,
+        ) as executor:
+            futures = [
+                executor.submit(
+                    run_trial,
+                    # Only the swept values make it into the trial name
+                    trial_name=get_trial_name(sweep_name, grid_config),
+                    config={**default_trial_config, **grid_config},
+                    model_checkpoint=model_checkpoint,
+                    data_dir=data_dir,
+                    squad2=squad2,
+                    trial_runtime_config=trial_runtime_config,
+                    save_model=save_models,
+                )
+                for grid_config in grid_configs
+            ]
+            for future in as_completed(futures):
+                trials.append(future.result())
+    finally:
+        os.environ.clear()
+        os.environ.update(parent_environ)
+
+    trials.sort(key=lambda trial: trial["f1"], reverse=True)
+    sweep_summary = {
+        "sweep_name": sweep_name,
+        "grid": grid,
+        "trials": trials,
+        "best_trial": trials[0]["trial_name"],
+        "max_concurrent_trials": max_concurrent_trials,
+        "threads_per_trial": threads_per_trial,
+        "preprocessing_time": preprocessing_time,
+        "wall_time": timer() - start_time,
+        "serial_training_time": sum(trial["training_time"] for trial in trials),
+    }
+    core_qa_utils.save_dict_as_json(
+        sweep_summary,
+        dir_path=extractive_qa_paths.model_evaluation_dir / sweep_name,
+        filename="sweep_summary.json",
+    )
+    return sweep_summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a grid of fine-tuning trials concurrently"
+    )
+    parser.add_argument("--sweep-name", required=True)
+    parser.add_argument(
+        "--grid",
+        type=json.loads,
+        required=True,
+        help='e.g. \'{"learning_rate": [2e-5, 3e-5, 5e-5], "seed": [1, 2]}\'',
+    )
+    parser.add_argument("--model-checkpoint", required=True)
+    parser.add_argument("--dataset-dir", type=Path, required=True)
+    parser.add_argument("--train-filename", default="original_train.json")
+    parser.add_argument("--test-filename", default="original_test.json")
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--stride", type=int, default=None)
+    parser.add_argument("--threads-per-trial", type=int, default=2)
+    parser.add_argument("--max-concurrent-trials", type=int, default=None)
+    parser.add_argument("--memory-per-trial-gb", type=float, default=None)
+    parser.add_argument("--max-train-samples", type=int, default=None)
+    parser.add_argument("--max-test-samples", type=int, default=None)
+    parser.add_argument("--save-models", action="store_true")
+    args = parser.parse_args()
+
+    run_sweep(
+        sweep_name=args.sweep_name,
+        grid=args.grid,
+        model_checkpoint=args.model_checkpoint,
+        dataset_dir=args.dataset_dir,
+        squad2=args.squad2,
+        train_filename=args.train_filename,
+        test_filename=args.test_filename,
+        max_length=args.max_length,
+        stride=args.stride,
+        threads_per_trial=args.threads_per_trial,
+        max_concurrent_trials=args.max_concurrent_trials,
+        memory_per_trial_bytes=(
+            int(args.memory_per_trial_gb * 1024**3)
+            if args.memory_per_trial_gb is not None
+            else None
+        ),
+        max_train_samples=args.max_train_samples,
+        max_test_samples=args.max_test_samples,
+        save_models=args.save_models,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    DefaultDataCollator,
+    TFAutoModelForQuestionAnswering,
+)
+
+from question_answering.constants import constants
+from question_answering.keras_callbacks.time_measure_callback import (
+    TimeMeasureCallback,
+)
+from question_answering.paths import extractive_qa_paths
+from question_answering.utils import (
+    core_preprocessing,
+    core_qa_utils,
+    evaluation,
+    model_management,
+    runtime_config,
+    squad2_preprocessing,
+    squad_preprocessing,
+)
+
+model_label_columns = ["start_positions", "end_positions"]
+
+
+def get_free_ports(num_ports: int):
+    sockets = [socket.socket() for _ in range(num_ports)]
+    for s in sockets:
+        s.bind(("localhost", 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def build_tf_config(worker_addresses: list[str], task_index: int):
+    return json.dumps(
+        {
+            "cluster": {"worker": worker_addresses},
+            "task": {"type": "worker", "index": task_index},
+        }
+    )
+
+
+def create_multi_worker_strategy():
+    # Must be created before any other TensorFlow op runs in the process
+    return tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+    )
+
+
+def is_chief(strategy: tf.distribute.Strategy):
+    task_type = strategy.cluster_resolver.task_type
+    task_id = strategy.cluster_resolver.task_id
+    return (
+        task_type is None
+        or task_type == "chief"
+        or (task_type == "worker" and task_id == 0)
+    )
+
+
+def shard_tf_dataset(tf_dataset: tf.data.Dataset):
+    # Preprocessed datasets are in memory, so every worker takes every n-th batch
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = (
+        tf.data.experimental.AutoShardPolicy.DATA
+    )
+    return tf_dataset.with_options(options)
+
+
+def gather_from_workers(strategy: tf.distribute.Strategy, values: list[float]):
+    # Collective op, every worker has to call it with the same number of values
+    per_replica_values = strategy.run(
+        lambda: tf.constant(values, dtype=tf.float64)[tf.newaxis]
+    )
+    gathered = strategy.gather(per_replica_values, axis=0)
+    return np.asarray(gathered).tolist()
+
+
+def preprocess_training_examples(
+    examples: Dataset,
+    tokenizer,
+    max_length: int,
+    squad2: bool,
+    stride: int | None = None,
+):
+    # SQuAD2 features are built without overflowing windows
+    if stride is not None and squad2:
+        raise Exception("Stride is not supported for SQuAD2 preprocessing!")
+    if stride is not None:
+        return squad_preprocessing.preprocess_squad_training_dataset(
+            dataset=examples,
+            tokenizer=tokenizer,
+            max_length=max_length,
+            stride=stride,
+            remove_columns=examples.column_names,
+        )
+
+    filtered_examples = core_preprocessing.filter_samples_below_number_of_tokens(
+        tokenizer=tokenizer, dataset=examples, max_tokens=max_length
+    )
+    preprocess_training_dataset = (
+        squad2_preprocessing.preprocess_squad2_training_dataset_no_stride
+        if squad2
+        else squad_preprocessing.preprocess_squad_training_dataset_no_stride
+    )
+    return preprocess_training_dataset(
+        dataset=filtered_examples,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        remove_columns=filtered_examples.column_names,
+    )
+
+
+def compile_qa_model(
+    model: tf.keras.Model,
+    num_train_steps: int,
+    initial_learning_rate: float,
+    end_learning_rate: float = 0.0,
+):
+    lr_scheduler = tf.keras.optimizers.schedules.PolynomialDecay(
+        initial_learning_rate=initial_learning_rate,
+        end_learning_rate=end_learning_rate,
+        decay_steps=num_train_steps,
+    )
+    optimizer = tf.keras.optimizers.Adam(learning_rate=lr_scheduler)
+    loss = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+    model.compile(optimizer=optimizer, loss=loss, metrics=["accuracy"])
+    return model
+
+
+def train_multi_worker(
+    strategy: tf.distribute.Strategy,
+    model_checkpoint: str,
+    model_name: str,
+    dataset_dir: Path,
+    train_filename: str,
+    squad2: bool,
+    epochs: int,
+    per_worker_batch_size: int,
+    initial_learning_rate: float,
+    max_length: int | None = None,
+    stride: int | None = None,
+    planned_epochs: int | None = None,
+    max_train_samples: int | None = None,
+    test_filename: str = "original_test.json",
+    max_test_samples: int | None = None,
+):
+    chief = is_chief(strategy)
+    num_workers = strategy.num_replicas_in_sync
+    global_batch_size = per_worker_batch_size * num_workers
+
+    tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+    max_length = max_length or tokenizer.model_max_length
+    train_dataset, test_dataset = core_qa_utils.load_datasets_from_json(
+        dataset_path=dataset_dir, filenames=[train_filename, test_filename]
+    )
+    if max_train_samples is not None:
+        train_dataset = train_dataset.select(
+            range(min(max_train_samples, len(train_dataset)))
+        )
+    if max_test_samples is not None:
+        test_dataset = test_dataset.select(
+            range(min(max_test_samples, len(test_dataset)))
+        )
+
+    # Batches are built with the global size and split between the workers
+    tf_train_dataset, tf_validation_dataset = [
+        shard_tf_dataset(
+            core_qa_utils.convert_to_tf_dataset(
+                hf_dataset=tokenized_dataset,
+                columns=evaluation.get_model_input_names(tokenized_dataset.features),
+                label_cols=model_label_columns,
+                collator=DefaultDataCollator(return_tensors="tf"),
+                batch_size=global_batch_size,
+            )
+        )
+        for tokenized_dataset in [
+            preprocess_training_examples(
+                examples=examples,
+                tokenizer=tokenizer,
+                max_length=max_length,
+                squad2=squad2,
+                stride=stride,
+            )
+            for examples in [train_dataset, test_dataset]
+        ]
+    ]
+
+    with strategy.scope():
+        model = TFAutoModelForQuestionAnswering.from_pretrained(model_checkpoint)
+        compile_qa_model(
+            model=model,
+            num_train_steps=len(tf_train_dataset) * (planned_epochs or epochs),
+            initial_learning_rate=initial_learning_rate,
+        )
+
+    # Keras redirects checkpoints of non-chief workers to temporary directories
+    checkpoints_path = (
+        extractive_qa_paths.training_checkpoints_dir
+        / model_name
+        / constants.checkpoint_filename_template
+    )
+    checkpoint_cb = tf.keras.callbacks.ModelCheckpoint(
+        checkpoints_path, save_weights_only=True
+    )
+    time_measure_cb = TimeMeasureCallback()
+
+    history = model.fit(
+        tf_train_dataset,
+        validation_data=tf_validation_dataset,
+        epochs=epochs,
+        callbacks=[checkpoint_cb, time_measure_cb],
+        verbose=2 if chief else 0,
+    )
+    history = {
+        metric: [float(value) for value in values]
+        for metric, values in history.history.items()
+    }
+
+    # The slowest worker determines how long an epoch took
+    worker_epoch_times = gather_from_workers(
+        strategy, time_measure_cb.epoch_train_times
+    )
+    epoch_times = np.max(worker_epoch_times, axis=0).tolist()
+    # Validation loss is reduced over all workers, so each one picks the same epoch
+    best_epoch = core_qa_utils.get_best_epoch(
+        history=history, metric="val_loss", metric_evaluator="min"
+    )
+
+    # Only the chief's checkpoints are real, workers need not share a filesystem
+    if not chief:
+        # Saving may run collective ops, so the other workers save to scratch space
+        scratch_dir = Path(tempfile.mkdtemp())
+        model.save_weights(scratch_dir / constants.saved_model_weights_name)
+        rmtree(scratch_dir)
+        return None
+
+    best_model = model_management.load_best_model_from_checkpoints(
+        model=model, model_name=model_name, epoch=best_epoch, remove_checkpoints=True
+    )
+    model_management.save_model(model=best_model, model_name=model_name)
+
+    model_evaluation_dir = extractive_qa_paths.model_evaluation_dir / model_name
+    core_qa_utils.save_dict_as_json(
+        dictionary=history, dir_path=model_evaluation_dir, filename="history.json"
+    )
+    training_data = {
+        "history": history,
+        "attempted_epochs": epochs,
+        "best_epoch": best_epoch,
+        "training_time": sum(epoch_times),
+        "epoch_train_times": epoch_times,
+        "worker_epoch_train_times": worker_epoch_times,
+        "num_workers": num_workers,
+        "global_batch_size": global_batch_size,
+        "gpu": core_qa_utils.get_gpu_name(),
+    }
+    core_qa_utils.save_dict_as_json(
+        training_data, dir_path=model_evaluation_dir, filename="training_data.json"
+    )
+    return training_data
+
+
+def get_local_worker_slot():
+    # Workers sharing this machine split its cores instead of each taking all of them
+    tf_config = json.loads(os.environ.get("TF_CONFIG", "{}"))
+    worker_addresses = tf_config.get("cluster", {}).get("worker", [])
+    task_index = tf_config.get("task", {}).get("index", 0)
+    local_task_indices = [
+        index
+        for index, address in enumerate(worker_addresses)
+        if address.split(":")[0] in ["localhost", "127.0.0.1", socket.gethostname()]
+    ]
+    if task_index not in local_task_indices:
+        return 0, 1
+    return local_task_indices.index(task_index), len(local_task_indices)
+
+
+def launch_local_workers(num_workers: int, worker_args: list[str]):
+    worker_addresses = [f"localhost:{port}" for port in get_free_ports(num_workers)]
+
+    processes = []
+    for task_index in range(num_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = build_tf_config(worker_addresses, task_index)
+        env["CUDA_VISIBLE_DEVICES"] = ""
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "-m", __spec__.name, *worker_args], env=env
+            )
+        )
+
+    return_codes = [process.wait() for process in processes]
+    if any(return_codes):
+        raise Exception(f"Workers failed with return codes {return_codes}!")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fine-tune a QA model with multi-worker data parallelism"
+    )
+    parser.add_argument("--model-checkpoint", required=True)
+    parser.add_argument("--model-name", required=True)
+    parser.add_argument("--dataset-dir", type=Path, required=True)
+    parser.add_argument("--train-filename", default="original_train.json")
+    parser.add_argument("--test-filename", default="original_test.json")
+    parser.add_argument("--squad2", action="store_true")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--planned-epochs", type=int, default=None)
+    parser.add_argument("--per-worker-batch-size", type=int, default=4)
+    parser.add_argument("--learning-rate", type=float, default=2e-5)
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--stride", type=int, default=None)
+    parser.add_argument("--max-train-samples", type=int, default=None)
+    parser.add_argument("--max-test-samples", type=int, default=None)
+    parser.add_argument(
+        "--launch-local",
+        type=int,
+        default=None,
+        metavar="NUM_WORKERS",
+        help="start NUM_WORKERS worker processes on this machine",
+    )
+    runtime_config.add_runtime_config_args(parser)
+    args = parser.parse_args()
+
+    # Launched workers get the same arguments, TF_CONFIG tells them apart
+    if args.launch_local is not None and "TF_CONFIG" not in os.environ:
+        launch_local_workers(num_workers=args.launch_local, worker_args=sys.argv[1:])
+        return
+
+    # The model being trained is not saved yet, its base checkpoint is calibrated
+    runtime_config.configure_runtime_from_args(
+        args,
+        *get_local_worker_slot(),
+        model_checkpoint=args.model_checkpoint,
+        sequence_length=args.max_length,
+        verbose=True,
+    )
+    strategy = create_multi_worker_strategy()
+    train_multi_worker(
+        strategy=strategy,
+        model_checkpoint=args.model_checkpoint,
+        model_name=args.model_name,
+        dataset_dir=args.dataset_dir,
+        train_filename=args.train_filename,
+        squad2=args.squad2,
+        epochs=args.epochs,
+        per_worker_batch_size=args.per_worker_batch_size,
+        initial_learning_rate=args.learning_rate,
+        max_length=args.max_length,
+        stride=args.stride,
+        planned_epochs=args.planned_epochs,
+        max_train_samples=args.max_train_samples,
+        test_filename=args.test_filename,
+        max_test_samples=args.max_test_samples,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from datasets import Dataset
 
+from . import instrumentation, squad2_preprocessing, squad_preprocessing
 
+
+@instrumentation.instrument(items_arg="dataset")
 def filter_samples_below_number_of_tokens(tokenizer, dataset: Dataset, max_tokens: int):
     def tokenize_sample(sample):
         question = sample["question"].strip()
@@ -13,3 +16,38 @@ def filter_samples_below_number_of_tokens(tokenizer, dataset: Dataset, max_token
         return len(tokenized_sample["input_ids"]) > max_tokens
 
     return dataset.filter(lambda sample: not is_sample_exceeds_max_tokens(sample))
+
+
+def preprocess_examples(
+    examples: Dataset,
+    tokenizer,
+    max_length: int,
+    squad2: bool,
+    stride: int | None = None,
+):
+    # SQuAD2 features are built without overflowing windows
+    if stride is not None and squad2:
+        raise Exception("Stride is not supported for SQuAD2 preprocessing!")
+    if stride is not None:
+        return examples, squad_preprocessing.preprocess_squad_test_dataset(
+            dataset=examples,
+            tokenizer=tokenizer,
+            max_length=max_length,
+            stride=stride,
+            remove_columns=examples.column_names,
+        )
+
+    filtered_examples = filter_samples_below_number_of_tokens(
+        tokenizer=tokenizer, dataset=examples, max_tokens=max_length
+    )
+    preprocess_test_dataset = (
+        squad2_preprocessing.preprocess_squad2_test_dataset_no_stride
+        if squad2
+        else squad_preprocessing.preprocess_squad_test_dataset_no_stride
+    )
+    return filtered_examples, preprocess_test_dataset(
+        dataset=filtered_examples,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        remove_columns=filtered_examples.column_names,
+    )
@@ -1,6 +1,7 @@
 import json
 from collections import Counter
 from pathlib import Path
+from timeit import default_timer as timer
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,7 +10,11 @@ import tensorflow as tf
 from datasets import Dataset, concatenate_datasets
 from matplotlib.ticker import MaxNLocator
 
+from . import instrumentation
+from .results_store import ResultsStore
 
+
+@instrumentation.instrument()
 def load_datasets_from_json(dataset_path: Path, filenames: list[str]):
     datasets = [
         Dataset.from_json(str(dataset_path / filename)) for filename in filenames
@@ -63,12 +68,13 @@ def plot_sentence_lengths_histogram(
             bar.get_x() + bar.get_width() / 2, height, height, ha="center", va="bottom"
         )
 
-    _create_dirs_if_not_exists(figure_path.parent)
+    create_dirs_if_not_exists(figure_path.parent)
 
     plt.savefig(figure_path, dpi=300)
     plt.show()
 
 
+@instrumentation.instrument(items_arg="hf_dataset")
 def convert_to_tf_dataset(
     hf_dataset: Dataset,
     columns: list[str],
@@ -86,6 +92,88 @@ def convert_to_tf_dataset(
     )
 
 
+@instrumentation.instrument(items_arg="hf_dataset")
+def build_tf_dataset(
+    hf_dataset: Dataset,
+    columns: list[str],
+    label_cols: list[str] | None,
+    batch_size: int,
+    shuffle: bool = False,
+    seed: int | None = None,
+    shuffle_buffer_size: int | None = None,
+    cache_path: Path | None = None,
+    snapshot_path: Path | None = None,
+    deterministic: bool = True,
+    drop_remainder: bool = False,
+):
+    # Columns are read once as numpy arrays, so batches need no Python collation
+    numpy_dataset = hf_dataset.with_format("numpy")
+    features = {column: numpy_dataset[column] for column in columns}
+    if label_cols:
+        labels = {column: numpy_dataset[column] for column in label_cols}
+        if len(label_cols) == 1:
+            labels = labels[label_cols[0]]
+        tf_dataset = tf.data.Dataset.from_tensor_slices((features, labels))
+    else:
+        tf_dataset = tf.data.Dataset.from_tensor_slices(features)
+
+    if snapshot_path is not None:
+        create_dirs_if_not_exists(snapshot_path)
+        tf_dataset = tf_dataset.snapshot(str(snapshot_path))
+    elif cache_path is not None:
+        create_dirs_if_not_exists(cache_path.parent)
+        tf_dataset = tf_dataset.cache(str(cache_path))
+
+    if shuffle:
+        tf_dataset = tf_dataset.shuffle(
+            buffer_size=shuffle_buffer_size or len(hf_dataset),
+            seed=seed,
+            reshuffle_each_iteration=True,
+        )
+
+    tf_dataset = tf_dataset.batch(
+        batch_size,
+        drop_remainder=drop_remainder,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=deterministic,
+    )
+
+    options = tf.data.Options()
+    options.deterministic = deterministic
+    options.autotune.enabled = True
+    return tf_dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def benchmark_tf_dataset(
+    tf_dataset: tf.data.Dataset,
+    num_epochs: int = 2,
+    max_batches: int | None = None,
+):
+    # Iterates the pipeline without a model to measure pure input throughput
+    epochs = []
+    for epoch in range(num_epochs):
+        num_batches = 0
+        num_examples = 0
+        start_time = timer()
+        for batch in tf_dataset.take(max_batches or -1):
+            inputs = batch[0] if isinstance(batch, tuple) else batch
+            num_examples += int(tf.shape(next(iter(inputs.values())))[0])
+            num_batches += 1
+        total_time = timer() - start_time
+
+        epochs.append(
+            {
+                "epoch": epoch + 1,
+                "batches": num_batches,
+                "examples": num_examples,
+                "time": total_time,
+                "batches_per_second": num_batches / total_time,
+                "examples_per_second": num_examples / total_time,
+            }
+        )
+    return epochs
+
+
 def get_best_epoch(
     history: dict,
     metric: str = "val_loss",
@@ -124,19 +212,27 @@ def plot_and_save_fig_from_history(
     plt.gca().xaxis.set_major_locator(MaxNLocator(integer=True))
     plt.legend(legend_descriptors, loc="upper left")
 
-    _create_dirs_if_not_exists(figure_dir_path)
+    create_dirs_if_not_exists(figure_dir_path)
 
     plt.savefig(figure_dir_path / figure_filename)
     plt.show()
 
 
-def save_dict_as_json(dictionary: dict, dir_path: Path, filename: str):
+def save_dict_as_json(
+    dictionary: dict,
+    dir_path: Path,
+    filename: str,
+    results_store: ResultsStore | None = None,
+):
     if not dir_path.exists() or not dir_path.is_dir():
         dir_path.mkdir(parents=True)
 
     with open(dir_path / filename, "w") as fp:
         json.dump(dictionary, fp, sort_keys=True, indent=4)
 
+    if results_store is not None:
+        results_store.ingest_file(dir_path / filename)
+
 
 def read_json_as_dict(path: Path) -> dict:
     with open(path, "r") as fp:
@@ -151,6 +247,6 @@ def get_gpu_name():
         return details.get("device_name", "Unknown GPU")
 
 
-def _create_dirs_if_not_exists(directory: Path):
+def create_dirs_if_not_exists(directory: Path):
     if not directory.is_dir():
         directory.mkdir(parents=True)
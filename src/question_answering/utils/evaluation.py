@@ -0,0 +1,247 @@
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.constants import constants
+from question_answering.paths import extractive_qa_paths
+
+from . import (
+    instrumentation,
+    prediction_log,
+    predictions,
+    squad2_metrics,
+    squad_metrics,
+)
+from .logit_cache import LogitCache
+
+default_n_bests = ["01", "02", "03", "05"]
+
+
+def get_model_input_names(available_names):
+    # Not every tokenizer returns token_type_ids
+    return [name for name in constants.model_input_names if name in available_names]
+
+
+def get_predicted_texts_function(squad2: bool):
+    return (
+        predictions.get_predicted_texts_squad2
+        if squad2
+        else predictions.get_predicted_texts
+    )
+
+
+def get_metrics_module(squad2: bool):
+    return squad2_metrics if squad2 else squad_metrics
+
+
+@instrumentation.instrument(items_arg="features")
+def predict_logits(
+    model: tf.keras.Model,
+    tf_dataset: tf.data.Dataset,
+    features: Dataset,
+    logit_cache: LogitCache | None = None,
+    use_logit_cache: bool = False,
+):
+    def compute_logits():
+        # Measured apart from predict_logits, which also covers cache hits
+        with instrumentation.measure("model_predict", items=len(features)):
+            output = model.predict(tf_dataset)
+        start_logits = predictions.get_preds(
+            output, output_key="start_logits", return_type="logits"
+        )
+        end_logits = predictions.get_preds(
+            output, output_key="end_logits", return_type="logits"
+        )
+        return np.asarray(start_logits), np.asarray(end_logits)
+
+    # Caching is opt-in, either with a cache instance or the default on-disk one
+    if logit_cache is None and not use_logit_cache:
+        return compute_logits()
+
+    if logit_cache is None:
+        logit_cache = LogitCache()
+
+    return logit_cache.get_or_compute(
+        model=model, features=features, compute_logits_fn=compute_logits
+    )
+
+
+@instrumentation.instrument(items_arg="examples")
+def get_predicted_texts_for_n_bests(
+    start_logits: np.ndarray,
+    end_logits: np.ndarray,
+    features: Dataset,
+    examples: Dataset,
+    squad2: bool,
+    n_bests: list[str] = default_n_bests,
+    max_answer_length: int = 30,
+    return_scores: bool = False,
+):
+    get_predicted_texts = get_predicted_texts_function(squad2)
+
+    return [
+        get_predicted_texts(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=features,
+            examples=examples,
+            n_best=int(n_best),
+            max_answer_length=max_answer_length,
+            return_scores=return_scores,
+        )
+        for n_best in n_bests
+    ]
+
+
+@instrumentation.instrument(items_arg="answers")
+def calculate_qa_metrics_for_variants(
+    answers: list[list[str]],
+    predicted_texts_variants: list[list[str]],
+    squad2: bool,
+):
+    metrics_module = get_metrics_module(squad2)
+
+    metrics = []
+    for predicted_texts_variant in predicted_texts_variants:
+        for normalize in [False, True]:
+            metrics.append(
+                metrics_module.calculate_squad_qa_metrics(
+                    answers=answers,
+                    predicted_texts=predicted_texts_variant,
+                    normalize=normalize,
+                )
+            )
+
+    return metrics
+
+
+def get_all_variants_of_qa_metric(
+    all_metrics: list[dict], metric_name: str, n_bests: list[str] = default_n_bests
+):
+    return {
+        f"{n_bests[i // 2]}_best_{'normalized' if i % 2 else 'standard'}": all_metrics[
+            i
+        ][metric_name]
+        for i in range(len(n_bests) * 2)
+    }
+
+
+@instrumentation.instrument(items_arg="examples")
+def evaluate_predictions(
+    start_logits: np.ndarray,
+    end_logits: np.ndarray,
+    features: Dataset,
+    examples: Dataset,
+    squad2: bool,
+    n_bests: list[str] = default_n_bests,
+    max_answer_length: int = 30,
+    model_name: str | None = None,
+    prediction_log_dir: Path | None = None,
+    prediction_log_filename: str = prediction_log.prediction_log_filename,
+):
+    metrics_module = get_metrics_module(squad2)
+    start_positions = np.argmax(start_logits, axis=1)
+    end_positions = np.argmax(end_logits, axis=1)
+
+    metric_stats = metrics_module.calculate_squad_metrics_stats(
+        start_actual=features["start_positions"],
+        end_actual=features["end_positions"],
+        start_preds=start_positions,
+        end_preds=end_positions,
+    )
+    accuracies_metrics = metrics_module.calculate_squad_accuracies(
+        start_actual=features["start_positions"],
+        end_actual=features["end_positions"],
+        start_preds=start_positions,
+        end_preds=end_positions,
+    )
+
+    predicted_texts_variants, scores_variants = zip(
+        *get_predicted_texts_for_n_bests(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=features,
+            examples=examples,
+            squad2=squad2,
+            n_bests=n_bests,
+            max_answer_length=max_answer_length,
+            return_scores=True,
+        )
+    )
+    # Per-sample results of every variant are kept for error analysis
+    if prediction_log_dir is None and model_name is not None:
+        prediction_log_dir = extractive_qa_paths.model_evaluation_dir / model_name
+    if prediction_log_dir is not None:
+        prediction_log.save_prediction_log(
+            prediction_log.build_prediction_log(
+                examples=examples,
+                variants=[f"{n_best}_best" for n_best in n_bests],
+                predicted_texts_variants=predicted_texts_variants,
+                scores_variants=scores_variants,
+                is_correct_variants=[
+                    metrics_module.get_is_correctly_predicted(
+                        answers=examples["answer_text"],
+                        predicted_texts=predicted_texts_variant,
+                        normalize=True,
+                    )
+                    for predicted_texts_variant in predicted_texts_variants
+                ],
+                features=features,
+            ),
+            dir_path=prediction_log_dir,
+            filename=prediction_log_filename,
+        )
+    qa_metrics = calculate_qa_metrics_for_variants(
+        answers=examples["answer_text"],
+        predicted_texts_variants=predicted_texts_variants,
+        squad2=squad2,
+    )
+
+    return {
+        "accuracy": accuracies_metrics,
+        "metric_stats": metric_stats,
+        "precision": get_all_variants_of_qa_metric(qa_metrics, "precision", n_bests),
+        "recall": get_all_variants_of_qa_metric(qa_metrics, "recall", n_bests),
+        "f1": get_all_variants_of_qa_metric(qa_metrics, "f1", n_bests),
+        "exact_match": get_all_variants_of_qa_metric(
+            qa_metrics, "exact_match", n_bests
+        ),
+    }
+
+
+@instrumentation.instrument(items_arg="examples")
+def evaluate_model(
+    model: tf.keras.Model,
+    tf_dataset: tf.data.Dataset,
+    features: Dataset,
+    examples: Dataset,
+    squad2: bool,
+    n_bests: list[str] = default_n_bests,
+    max_answer_length: int = 30,
+    logit_cache: LogitCache | None = None,
+    use_logit_cache: bool = False,
+    model_name: str | None = None,
+    prediction_log_dir: Path | None = None,
+    prediction_log_filename: str = prediction_log.prediction_log_filename,
+):
+    start_logits, end_logits = predict_logits(
+        model=model,
+        tf_dataset=tf_dataset,
+        features=features,
+        logit_cache=logit_cache,
+        use_logit_cache=use_logit_cache,
+    )
+    return evaluate_predictions(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        examples=examples,
+        squad2=squad2,
+        n_bests=n_bests,
+        max_answer_length=max_answer_length,
+        model_name=model_name,
+        prediction_log_dir=prediction_log_dir,
+        prediction_log_filename=prediction_log_filename,
+    )
@@ -16,11 +16,34 @@ def plot_correct_predictions_by_sentence_length(
     max_threshold: int,
     x_label: str = "Words count per sentence",
     y_label: str = "Correct predictions",
+):
+    plot_correct_predictions_by_word_count(
+        word_counts=[len(sentence.split()) for sentence in sentences],
+        correctly_predicted=correctly_predicted,
+        figure_path=figure_path,
+        figure_title=figure_title,
+        divider=divider,
+        min_threshold=min_threshold,
+        max_threshold=max_threshold,
+        x_label=x_label,
+        y_label=y_label,
+    )
+
+
+def plot_correct_predictions_by_word_count(
+    word_counts: list[int],
+    correctly_predicted: list[bool],
+    figure_path: Path,
+    figure_title: str,
+    divider: int,
+    min_threshold: int,
+    max_threshold: int,
+    x_label: str = "Words count per sentence",
+    y_label: str = "Correct predictions",
 ):
     # Create word count groups for x labels
     word_count_groups = []
-    for sentence in sentences:
-        word_count = len(sentence.split())
+    for word_count in word_counts:
         num_word_count_group = int(word_count / divider) + 1
         lower_group_boundary = divider * num_word_count_group - divider
         upper_group_boundary = divider * num_word_count_group - 1
@@ -48,8 +71,7 @@ def plot_correct_predictions_by_sentence_length(
     }
 
     # Manipulate dictionaries
-    for index, sentence in enumerate(sentences):
-        word_count = len(sentence.split())
+    for index, word_count in enumerate(word_counts):
         num_word_count_group = int(word_count / divider) + 1
         lower_group_boundary = divider * num_word_count_group - divider
         upper_group_boundary = divider * num_word_count_group - 1
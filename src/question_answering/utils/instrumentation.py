@@ -0,0 +1,249 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from .__helpers import create_dirs_if_not_exists
+
+instrumentation_env_var = "QA_INSTRUMENTATION"
+instrumentation_output_env_var = "QA_INSTRUMENTATION_OUTPUT"
+report_filename = "instrumentation_report.json"
+chrome_trace_filename = "instrumentation_trace.json"
+max_trace_events = 100_000
+
+
+def get_peak_rss_in_bytes():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class InstrumentationRecorder:
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+        self.stats = {}
+        self.events = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self, stage: str):
+        stack = self.__get_stack()
+        frame = {"stage": stage, "start_traced": 0, "peak_traced": 0}
+        if self.track_memory:
+            # The peak counter is shared, so the parent keeps its peak so far
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak_traced"] = max(stack[-1]["peak_traced"], peak)
+            tracemalloc.reset_peak()
+            frame["start_traced"] = current
+            frame["peak_traced"] = current
+        stack.append(frame)
+        frame["wall_start"] = time.perf_counter()
+        frame["cpu_start"] = time.process_time()
+        return frame
+
+    def stop(self, frame: dict, items: int | None = None):
+        wall_time = time.perf_counter() - frame["wall_start"]
+        cpu_time = time.process_time() - frame["cpu_start"]
+        stack = self.__get_stack()
+        stack.pop()
+        if self.track_memory:
+            frame["peak_traced"] = max(
+                frame["peak_traced"], tracemalloc.get_traced_memory()[1]
+            )
+            if stack:
+                stack[-1]["peak_traced"] = max(
+                    stack[-1]["peak_traced"], frame["peak_traced"]
+                )
+        peak_rss = get_peak_rss_in_bytes()
+
+        with self.lock:
+            stage_stats = self.stats.setdefault(
+                frame["stage"],
+                {
+                    "calls": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "items": 0,
+                    "peak_rss_bytes": 0,
+                    "peak_traced_bytes": 0,
+                },
+            )
+            stage_stats["calls"] += 1
+            stage_stats["wall_time"] += wall_time
+            stage_stats["cpu_time"] += cpu_time
+            stage_stats["items"] += items or 0
+            stage_stats["peak_rss_bytes"] = max(stage_stats["peak_rss_bytes"], peak_rss)
+            stage_stats["peak_traced_bytes"] = max(
+                stage_stats["peak_traced_bytes"],
+                frame["peak_traced"] - frame["start_traced"],
+            )
+            if len(self.events) < max_trace_events:
+                self.events.append(
+                    {
+                        "name": frame["stage"],
+                        "cat": "question_answering",
+                        "ph": "X",
+                        "ts": (frame["wall_start"] - self.origin) * 1e6,
+                        "dur": wall_time * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": {"items": items, "cpu_time": cpu_time},
+                    }
+                )
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.events = []
+            self.origin = time.perf_counter()
+
+    def __get_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+class Measurement:
+    def __init__(self, stage: str, items: int | None = None):
+        self.stage = stage
+        self.items = items
+        self.frame = None
+
+    def add_items(self, items: int):
+        self.items = (self.items or 0) + items
+
+    def __enter__(self):
+        self.frame = recorder.start(self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        recorder.stop(self.frame, self.items)
+
+
+class NullMeasurement:
+    def add_items(self, items: int):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+recorder = InstrumentationRecorder()
+null_measurement = NullMeasurement()
+
+
+def measure(stage: str, items: int | None = None):
+    # Disabled instrumentation costs one attribute check and no allocation
+    if not recorder.enabled:
+        return null_measurement
+    return Measurement(stage, items)
+
+
+def instrument(stage: str | None = None, items_arg: str | None = None):
+    def decorator(function):
+        stage_name = stage or (
+            f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+        )
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            items = None
+            if items_arg is not None:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                if arguments.get(items_arg) is not None:
+                    items = len(arguments[items_arg])
+            with Measurement(stage_name, items):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(track_memory: bool = False):
+    recorder.track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
+    if recorder.track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    recorder.track_memory = False
+
+
+def is_enabled():
+    return recorder.enabled
+
+
+def reset():
+    recorder.reset()
+
+
+def get_report():
+    with recorder.lock:
+        stats = {stage: dict(values) for stage, values in recorder.stats.items()}
+    for stage_stats in stats.values():
+        stage_stats["items_per_second"] = (
+            stage_stats["items"] / stage_stats["wall_time"]
+            if stage_stats["items"] > 0 and stage_stats["wall_time"] > 0
+            else None
+        )
+        if not recorder.track_memory:
+            del stage_stats["peak_traced_bytes"]
+    return {
+        "track_memory": recorder.track_memory,
+        "peak_rss_bytes": get_peak_rss_in_bytes(),
+        "stages": dict(
+            sorted(stats.items(), key=lambda item: item[1]["wall_time"], reverse=True)
+        ),
+    }
+
+
+def save_report(dir_path: Path, filename: str = report_filename):
+    create_dirs_if_not_exists(dir_path)
+    with open(dir_path / filename, "w") as fp:
+        json.dump(get_report(), fp, sort_keys=False, indent=4)
+
+
+def save_chrome_trace(dir_path: Path, filename: str = chrome_trace_filename):
+    # Loadable in chrome://tracing or Perfetto, nested stages stack per thread
+    create_dirs_if_not_exists(dir_path)
+    with recorder.lock:
+        events = list(recorder.events)
+    with open(dir_path / filename, "w") as fp:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+def configure_from_env():
+    # QA_INSTRUMENTATION=1 enables timing, QA_INSTRUMENTATION=memory adds tracemalloc
+    value = os.environ.get(instrumentation_env_var, "").strip().lower()
+    if value in ["", "0", "false", "off"]:
+        return
+    enable(track_memory=value == "memory")
+
+    output_dir = os.environ.get(instrumentation_output_env_var)
+    if output_dir:
+        atexit.register(save_report, Path(output_dir))
+        atexit.register(save_chrome_trace, Path(output_dir))
+
+
+configure_from_env()
@@ -0,0 +1,245 @@
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.keras_callbacks.throughput_profiler_callback import (
+    ThroughputProfilerCallback,
+)
+
+
+def get_feature_lengths(hf_dataset: Dataset, mask_column: str = "attention_mask"):
+    return np.asarray(
+        hf_dataset.with_format("numpy")[mask_column].sum(axis=1), dtype=np.int64
+    )
+
+
+def get_length_grouped_batches(
+    lengths: np.ndarray,
+    batch_size: int,
+    mega_batch_multiplier: int = 50,
+    seed: int | None = None,
+):
+    rng = np.random.default_rng(seed)
+    indices = rng.permutation(len(lengths))
+
+    # Random mega-batches are sorted by length, so each batch holds similar lengths
+    mega_batch_size = batch_size * mega_batch_multiplier
+    batches = []
+    for mega_batch_start in range(0, len(indices), mega_batch_size):
+        mega_batch = indices[mega_batch_start : mega_batch_start + mega_batch_size]
+        mega_batch = mega_batch[np.argsort(-lengths[mega_batch], kind="stable")]
+        batches.extend(
+            mega_batch[batch_start : batch_start + batch_size]
+            for batch_start in range(0, len(mega_batch), batch_size)
+        )
+
+    # Batch order is shuffled again to keep epoch-level randomness
+    return [batches[i] for i in rng.permutation(len(batches))]
+
+
+def get_random_batches(lengths: np.ndarray, batch_size: int, seed: int | None = None):
+    indices = np.random.default_rng(seed).permutation(len(lengths))
+    return [
+        indices[batch_start : batch_start + batch_size]
+        for batch_start in range(0, len(indices), batch_size)
+    ]
+
+
+def get_batch_sequence_length(
+    batch_lengths: np.ndarray, pad_to_multiple_of: int | None = None
+):
+    sequence_length = int(np.max(batch_lengths))
+    if pad_to_multiple_of:
+        sequence_length = -(-sequence_length // pad_to_multiple_of) * pad_to_multiple_of
+    return sequence_length
+
+
+def calculate_padding_statistics(
+    lengths: np.ndarray,
+    batches: list[np.ndarray],
+    sequence_length: int | None = None,
+    pad_to_multiple_of: int | None = None,
+):
+    # Without a fixed sequence_length every batch is trimmed to its longest feature
+    padded_tokens = sum(
+        len(batch)
+        * (
+            sequence_length
+            or get_batch_sequence_length(lengths[batch], pad_to_multiple_of)
+        )
+        for batch in batches
+    )
+    real_tokens = int(lengths.sum())
+    return {
+        "real_tokens": real_tokens,
+        "padded_tokens": int(padded_tokens),
+        "padding_ratio": 1 - real_tokens / padded_tokens,
+    }
+
+
+def build_length_grouped_tf_dataset(
+    hf_dataset: Dataset,
+    columns: list[str],
+    label_cols: list[str] | None,
+    batch_size: int,
+    seed: int = 42,
+    mega_batch_multiplier: int = 50,
+    pad_to_multiple_of: int | None = 8,
+    mask_column: str = "attention_mask",
+    group_by_length: bool = True,
+):
+    numpy_dataset = hf_dataset.with_format("numpy")
+    features = {column: numpy_dataset[column] for column in columns}
+    labels = {column: numpy_dataset[column] for column in label_cols or []}
+    lengths = get_feature_lengths(hf_dataset, mask_column=mask_column)
+    epoch_counter = [0]
+
+    def generate_batches():
+        # Every pass over the dataset is a new epoch with its own grouping
+        epoch_seed = seed + epoch_counter[0]
+        epoch_counter[0] += 1
+        # Random batches with the same trimming give the dynamic padding baseline
+        batches = (
+            get_length_grouped_batches(
+                lengths=lengths,
+                batch_size=batch_size,
+                mega_batch_multiplier=mega_batch_multiplier,
+                seed=epoch_seed,
+            )
+            if group_by_length
+            else get_random_batches(lengths, batch_size, seed=epoch_seed)
+        )
+        for batch in batches:
+            # Features are right-padded, so trimming keeps every real token
+            sequence_length = get_batch_sequence_length(
+                lengths[batch], pad_to_multiple_of
+            )
+            batch_features = {
+                column: values[batch, :sequence_length]
+                for column, values in features.items()
+            }
+            if not labels:
+                yield batch_features
+                continue
+            batch_labels = {column: values[batch] for column, values in labels.items()}
+            if len(batch_labels) == 1:
+                batch_labels = next(iter(batch_labels.values()))
+            yield batch_features, batch_labels
+
+    features_signature = {
+        column: tf.TensorSpec(shape=(None, None), dtype=values.dtype)
+        for column, values in features.items()
+    }
+    labels_signature = {
+        column: tf.TensorSpec(shape=(None,), dtype=values.dtype)
+        for column, values in labels.items()
+    }
+    if len(labels_signature) == 1:
+        labels_signature = next(iter(labels_signature.values()))
+
+    tf_dataset = tf.data.Dataset.from_generator(
+        generate_batches,
+        output_signature=(
+            (features_signature, labels_signature) if labels else features_signature
+        ),
+    )
+    num_batches = -(-len(hf_dataset) // batch_size)
+    tf_dataset = tf_dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+    return tf_dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def compare_padding(
+    hf_dataset: Dataset,
+    batch_size: int,
+    seed: int = 42,
+    mega_batch_multiplier: int = 50,
+    pad_to_multiple_of: int | None = 8,
+    mask_column: str = "attention_mask",
+):
+    lengths = get_feature_lengths(hf_dataset, mask_column=mask_column)
+    sequence_length = len(hf_dataset[0][mask_column])
+    random_batches = get_random_batches(lengths, batch_size, seed=seed)
+    grouped_batches = get_length_grouped_batches(
+        lengths, batch_size, mega_batch_multiplier=mega_batch_multiplier, seed=seed
+    )
+
+    return {
+        "max_length_padding": calculate_padding_statistics(
+            lengths, random_batches, sequence_length=sequence_length
+        ),
+        "dynamic_padding": calculate_padding_statistics(
+            lengths, random_batches, pad_to_multiple_of=pad_to_multiple_of
+        ),
+        "length_grouped_padding": calculate_padding_statistics(
+            lengths, grouped_batches, pad_to_multiple_of=pad_to_multiple_of
+        ),
+    }
+
+
+def compare_training_throughput(
+    model: tf.keras.Model,
+    hf_dataset: Dataset,
+    columns: list[str],
+    label_cols: list[str],
+    batch_size: int,
+    epochs: int = 2,
+    seed: int = 42,
+    mega_batch_multiplier: int = 50,
+    pad_to_multiple_of: int | None = 8,
+):
+    # The same compiled model is trained on both pipelines, weights are not restored
+    num_real_tokens = int(get_feature_lengths(hf_dataset).sum())
+    # Both pipelines trim batches the same way, only the grouping differs
+    tf_datasets = {
+        "dynamic_padding": build_length_grouped_tf_dataset(
+            hf_dataset=hf_dataset,
+            columns=columns,
+            label_cols=label_cols,
+            batch_size=batch_size,
+            seed=seed,
+            pad_to_multiple_of=pad_to_multiple_of,
+            group_by_length=False,
+        ),
+        "length_grouped": build_length_grouped_tf_dataset(
+            hf_dataset=hf_dataset,
+            columns=columns,
+            label_cols=label_cols,
+            batch_size=batch_size,
+            seed=seed,
+            mega_batch_multiplier=mega_batch_multiplier,
+            pad_to_multiple_of=pad_to_multiple_of,
+        ),
+    }
+
+    padding = compare_padding(
+        hf_dataset=hf_dataset,
+        batch_size=batch_size,
+        seed=seed,
+        mega_batch_multiplier=mega_batch_multiplier,
+        pad_to_multiple_of=pad_to_multiple_of,
+    )
+    padding_ratios = {
+        "dynamic_padding": padding["dynamic_padding"]["padding_ratio"],
+        "length_grouped": padding["length_grouped_padding"]["padding_ratio"],
+    }
+
+    report = {}
+    for name, tf_dataset in tf_datasets.items():
+        profiler_cb = ThroughputProfilerCallback(
+            num_examples=len(hf_dataset), num_real_tokens=num_real_tokens
+        )
+        model.fit(tf_dataset, epochs=epochs, callbacks=[profiler_cb], verbose=0)
+        # The last epoch is reported, the first one includes graph tracing
+        last_epoch = profiler_cb.get_summary()["epochs"][-1]
+        report[name] = {
+            "padding_ratio": padding_ratios[name],
+            "real_tokens_per_second": last_epoch["real_tokens_per_second"],
+            "examples_per_second": last_epoch["examples_per_second"],
+            "step_time_p50": last_epoch["step_time_p50"],
+        }
+
+    report["speedup"] = (
+        report["length_grouped"]["real_tokens_per_second"]
+        / report["dynamic_padding"]["real_tokens_per_second"]
+    )
+    return report
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.constants import constants
+from question_answering.paths import extractive_qa_paths
+
+from .__helpers import create_dirs_if_not_exists
+
+
+class LogitCache:
+    def __init__(self, cache_dir: Path = extractive_qa_paths.logit_cache_dir):
+        self.cache_dir = cache_dir
+
+    def get(self, weights_fingerprint: str, features_fingerprint: str):
+        entry_dir = self.__get_entry_dir(weights_fingerprint, features_fingerprint)
+        if not (entry_dir / "metadata.json").is_file():
+            return None
+
+        metadata = self.__read_metadata(entry_dir)
+        metadata["last_accessed"] = time.time()
+        self.__write_metadata(entry_dir, metadata)
+
+        start_logits = np.load(entry_dir / "start_logits.npy", mmap_mode="r")
+        end_logits = np.load(entry_dir / "end_logits.npy", mmap_mode="r")
+        return start_logits, end_logits
+
+    def put(
+        self,
+        weights_fingerprint: str,
+        features_fingerprint: str,
+        start_logits: np.ndarray,
+        end_logits: np.ndarray,
+    ):
+        entry_dir = self.__get_entry_dir(weights_fingerprint, features_fingerprint)
+        temporary_dir = entry_dir.with_name(entry_dir.name + ".tmp")
+        if temporary_dir.exists():
+            rmtree(temporary_dir)
+        create_dirs_if_not_exists(temporary_dir)
+
+        for filename, logits in [
+            ("start_logits.npy", start_logits),
+            ("end_logits.npy", end_logits),
+        ]:
+            cached_logits = np.lib.format.open_memmap(
+                temporary_dir / filename,
+                mode="w+",
+                dtype=np.float16,
+                shape=logits.shape,
+            )
+            cached_logits[:] = logits
+            cached_logits.flush()
+            del cached_logits
+
+        now = time.time()
+        self.__write_metadata(
+            temporary_dir,
+            {
+                "weights_fingerprint": weights_fingerprint,
+                "features_fingerprint": features_fingerprint,
+                "shape": list(start_logits.shape),
+                "created": now,
+                "last_accessed": now,
+            },
+        )
+
+        # Entries become visible only once fully written
+        if entry_dir.exists():
+            rmtree(entry_dir)
+        temporary_dir.rename(entry_dir)
+
+    def get_or_compute(
+        self, model: tf.keras.Model, features: Dataset, compute_logits_fn
+    ):
+        features_fingerprint = compute_features_fingerprint(features)
+
+        # An unbuilt model has no weights to fingerprint until it is first called
+        if not model.weights:
+            start_logits, end_logits = compute_logits_fn()
+            weights_fingerprint = compute_weights_fingerprint(model)
+        else:
+            weights_fingerprint = compute_weights_fingerprint(model)
+            cached_logits = self.get(weights_fingerprint, features_fingerprint)
+            if cached_logits is not None:
+                return cached_logits
+            start_logits, end_logits = compute_logits_fn()
+
+        self.put(weights_fingerprint, features_fingerprint, start_logits, end_logits)
+        # Read back as stored, so a fresh and a cached evaluation decode the same values
+        return self.get(weights_fingerprint, features_fingerprint)
+
+    def entries(self):
+        if not self.cache_dir.is_dir():
+            return []
+
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            if not (entry_dir / "metadata.json").is_file():
+                continue
+            metadata = self.__read_metadata(entry_dir)
+            metadata["path"] = entry_dir
+            metadata["size_in_bytes"] = sum(
+                file.stat().st_size for file in entry_dir.iterdir()
+            )
+            entries.append(metadata)
+        return entries
+
+    def collect_garbage(
+        self, max_size_in_bytes: int | None = None, max_age_seconds: float | None = None
+    ):
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry["last_accessed"])
+        removed_entries = []
+
+        if max_age_seconds is not None:
+            for entry in entries:
+                if now - entry["last_accessed"] > max_age_seconds:
+                    removed_entries.append(entry)
+            entries = [entry for entry in entries if entry not in removed_entries]
+
+        if max_size_in_bytes is not None:
+            total_size = sum(entry["size_in_bytes"] for entry in entries)
+            # Least recently accessed entries are removed first
+            for entry in entries:
+                if total_size <= max_size_in_bytes:
+                    break
+                removed_entries.append(entry)
+                total_size -= entry["size_in_bytes"]
+
+        for entry in removed_entries:
+            rmtree(entry["path"])
+
+        return removed_entries
+
+    def __get_entry_dir(self, weights_fingerprint: str, features_fingerprint: str):
+        return (
+            self.cache_dir / f"{weights_fingerprint[:16]}_{features_fingerprint[:16]}"
+        )
+
+    @staticmethod
+    def __read_metadata(entry_dir: Path):
+        with open(entry_dir / "metadata.json", "r") as fp:
+            return json.load(fp)
+
+    @staticmethod
+    def __write_metadata(entry_dir: Path, metadata: dict):
+        with open(entry_dir / "metadata.json", "w") as fp:
+            json.dump(metadata, fp, sort_keys=True, indent=4)
+
+
+def compute_weights_fingerprint(model: tf.keras.Model):
+    weights_hash = hashlib.sha256()
+    for weight in model.weights:
+        weights_hash.update(weight.name.encode())
+        weights_hash.update(np.ascontiguousarray(weight.numpy()).tobytes())
+    return weights_hash.hexdigest()
+
+
+def compute_features_fingerprint(features: Dataset, batch_size: int = 10_000):
+    features_hash = hashlib.sha256()
+    columns = [
+        column
+        for column in constants.model_input_names
+        if column in features.column_names
+    ]
+    numpy_features = features.select_columns(columns).with_format("numpy")
+
+    for batch_start in range(0, len(numpy_features), batch_size):
+        batch = numpy_features[batch_start : batch_start + batch_size]
+        for column in columns:
+            features_hash.update(column.encode())
+            features_hash.update(np.ascontiguousarray(batch[column]).tobytes())
+    return features_hash.hexdigest()
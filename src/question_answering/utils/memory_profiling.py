@@ -0,0 +1,241 @@
+import json
+import linecache
+import tracemalloc
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import pyarrow as pa
+import tensorflow as tf
+from datasets import Dataset
+
+from . import core_preprocessing, core_qa_utils, evaluation
+from .__helpers import create_dirs_if_not_exists
+from .instrumentation import get_peak_rss_in_bytes
+
+evaluation_stages = ["load", "preprocess", "predict", "decode", "metrics"]
+memory_profile_filename = "memory_profile.json"
+proc_status_path = Path("/proc/self/status")
+proc_clear_refs_path = Path("/proc/self/clear_refs")
+
+
+def get_rss_in_bytes():
+    current_rss = __read_proc_status_in_bytes("VmRSS")
+    return current_rss if current_rss is not None else get_peak_rss_in_bytes()
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM on Linux, elsewhere the peak is process-wide
+    try:
+        proc_clear_refs_path.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_stage_peak_rss_in_bytes():
+    peak_rss = __read_proc_status_in_bytes("VmHWM")
+    return peak_rss if peak_rss is not None else get_peak_rss_in_bytes()
+
+
+def get_top_allocators(
+    snapshot: tracemalloc.Snapshot,
+    start_snapshot: tracemalloc.Snapshot,
+    top_n: int = 10,
+):
+    # Both sides are filtered, or the profiler's own snapshots show up as freed
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+    statistics = snapshot.filter_traces(filters).compare_to(
+        start_snapshot.filter_traces(filters), "lineno"
+    )
+    top_allocators = []
+    for statistic in statistics[:top_n]:
+        frame = statistic.traceback[0]
+        top_allocators.append(
+            {
+                "location": f"{frame.filename}:{frame.lineno}",
+                "line": linecache.getline(frame.filename, frame.lineno).strip(),
+                "size_bytes": statistic.size,
+                "size_diff_bytes": statistic.size_diff,
+                "count": statistic.count,
+            }
+        )
+    return top_allocators
+
+
+def get_nbytes(value):
+    if isinstance(value, Dataset):
+        return value.data.nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(item) for item in value)
+    return None
+
+
+class MemoryProfiler:
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self.stages = {}
+
+    def stage(self, name: str):
+        return MemoryProfilerStage(self, name)
+
+    def record(self, name: str, stage_data: dict):
+        self.stages[name] = stage_data
+
+    def get_report(self):
+        return {
+            "peak_rss_bytes": max(
+                [stage["peak_rss_bytes"] for stage in self.stages.values()],
+                default=get_peak_rss_in_bytes(),
+            ),
+            "stages": self.stages,
+        }
+
+    def save_report(self, dir_path: Path, filename: str = memory_profile_filename):
+        create_dirs_if_not_exists(dir_path)
+        with open(dir_path / filename, "w") as fp:
+            json.dump(self.get_report(), fp, sort_keys=False, indent=4)
+
+
+class MemoryProfilerStage:
+    def __init__(self, profiler: MemoryProfiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.outputs = {}
+
+    def add_output(self, name: str, value):
+        # Sizes of the stage results, like features or logit arrays
+        self.outputs[name] = get_nbytes(value)
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.start_snapshot = tracemalloc.take_snapshot()
+        self.start_traced = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self.is_peak_rss_reset = reset_peak_rss()
+        self.start_rss = get_rss_in_bytes()
+        # Arrow buffers of datasets are not seen by tracemalloc
+        self.start_arrow = pa.total_allocated_bytes()
+        self.start_time = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        time = timer() - self.start_time
+        end_rss = get_rss_in_bytes()
+        peak_rss = get_stage_peak_rss_in_bytes()
+        end_traced, peak_traced = tracemalloc.get_traced_memory()
+        top_allocators = get_top_allocators(
+            tracemalloc.take_snapshot(), self.start_snapshot, self.profiler.top_n
+        )
+        self.profiler.record(
+            self.name,
+            {
+                "time": time,
+                "start_rss_bytes": self.start_rss,
+                "end_rss_bytes": end_rss,
+                "peak_rss_bytes": peak_rss,
+                "peak_rss_growth_bytes": peak_rss - self.start_rss,
+                "is_peak_rss_per_stage": self.is_peak_rss_reset,
+                "peak_traced_bytes": peak_traced - self.start_traced,
+                "retained_traced_bytes": end_traced - self.start_traced,
+                "retained_arrow_bytes": pa.total_allocated_bytes() - self.start_arrow,
+                "outputs_bytes": self.outputs,
+                "top_allocators": top_allocators,
+            },
+        )
+
+
+def profile_evaluation(
+    model: tf.keras.Model,
+    tokenizer,
+    squad2: bool,
+    dataset_dir: Path | None = None,
+    filename: str = "original_test.json",
+    examples: Dataset | None = None,
+    max_length: int | None = None,
+    stride: int | None = None,
+    batch_size: int = 32,
+    top_n: int = 10,
+):
+    profiler = MemoryProfiler(top_n=top_n)
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    try:
+        with profiler.stage("load") as stage:
+            if examples is None:
+                examples = core_qa_utils.load_datasets_from_json(
+                    dataset_path=dataset_dir, filenames=[filename]
+                )[0]
+            stage.add_output("examples", examples)
+
+        with profiler.stage("preprocess") as stage:
+            examples, features = core_preprocessing.preprocess_examples(
+                examples=examples,
+                tokenizer=tokenizer,
+                max_length=max_length or tokenizer.model_max_length,
+                squad2=squad2,
+                stride=stride,
+            )
+            stage.add_output("features", features)
+
+        with profiler.stage("predict") as stage:
+            tf_dataset = core_qa_utils.build_tf_dataset(
+                hf_dataset=features,
+                columns=evaluation.get_model_input_names(features.features),
+                label_cols=None,
+                batch_size=batch_size,
+            )
+            start_logits, end_logits = evaluation.predict_logits(
+                model=model,
+                tf_dataset=tf_dataset,
+                features=features,
+                use_logit_cache=False,
+            )
+            del tf_dataset
+            stage.add_output("logits", [start_logits, end_logits])
+
+        with profiler.stage("decode"):
+            predicted_texts = evaluation.get_predicted_texts_function(squad2)(
+                start_logits=start_logits,
+                end_logits=end_logits,
+                features=features,
+                examples=examples,
+            )
+
+        with profiler.stage("metrics"):
+            metrics_module = evaluation.get_metrics_module(squad2)
+            metrics_module.calculate_squad_metrics_stats(
+                start_actual=features["start_positions"],
+                end_actual=features["end_positions"],
+                start_preds=np.argmax(start_logits, axis=1),
+                end_preds=np.argmax(end_logits, axis=1),
+            )
+            metrics_module.calculate_squad_qa_metrics(
+                answers=examples["answer_text"],
+                predicted_texts=predicted_texts,
+                normalize=True,
+            )
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    return profiler.get_report()
+
+
+def __read_proc_status_in_bytes(field: str):
+    if not proc_status_path.is_file():
+        return None
+    for line in proc_status_path.read_text().splitlines():
+        if line.startswith(f"{field}:"):
+            # Values are reported in kB
+            return int(line.split()[1]) * 1024
+    return None
@@ -0,0 +1,241 @@
+from pathlib import Path
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from question_answering.constants import constants
+from question_answering.paths import extractive_qa_paths
+
+from . import evaluation, model_registry, predictions
+from .__helpers import create_dirs_if_not_exists
+
+tflite_quantization_variants = ["fp16", "int8"]
+
+
+def export_saved_model(
+    model: tf.keras.Model, model_name: str, sequence_lengths: list[int]
+) -> Path:
+    export_dir = extractive_qa_paths.exported_models_dir / model_name / "saved_model"
+    input_names = __get_model_input_names(model)
+
+    @tf.function
+    def serve(inputs):
+        output = model(inputs, training=False)
+        return {
+            "start_logits": output["start_logits"],
+            "end_logits": output["end_logits"],
+        }
+
+    # One signature per bucketed sequence length, batch size stays dynamic
+    signatures = {}
+    for sequence_length in sorted(sequence_lengths):
+        signatures[
+            constants.serving_signature_template.format(sequence_length=sequence_length)
+        ] = serve.get_concrete_function(
+            {
+                name: tf.TensorSpec(
+                    shape=(None, sequence_length), dtype=tf.int32, name=name
+                )
+                for name in input_names
+            }
+        )
+    signatures["serving_default"] = signatures[
+        constants.serving_signature_template.format(
+            sequence_length=max(sequence_lengths)
+        )
+    ]
+
+    create_dirs_if_not_exists(export_dir)
+    tf.saved_model.save(model, str(export_dir), signatures=signatures)
+    return export_dir
+
+
+def convert_to_tflite(
+    saved_model_dir: Path,
+    model_name: str,
+    sequence_length: int,
+    quantization: str,
+) -> Path:
+    if quantization not in tflite_quantization_variants:
+        raise Exception("Wrong quantization variant passed!")
+
+    signature_key = constants.serving_signature_template.format(
+        sequence_length=sequence_length
+    )
+    converter = tf.lite.TFLiteConverter.from_saved_model(
+        str(saved_model_dir), signature_keys=[signature_key]
+    )
+    # Without a representative dataset, DEFAULT optimization is dynamic-range int8
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+
+    tflite_dir = extractive_qa_paths.exported_models_dir / model_name / "tflite"
+    tflite_path = tflite_dir / f"{signature_key}_{quantization}.tflite"
+    create_dirs_if_not_exists(tflite_dir)
+    tflite_path.write_bytes(converter.convert())
+    return tflite_path
+
+
+def export_model_variants(
+    model: tf.keras.Model, model_name: str, sequence_lengths: list[int]
+):
+    saved_model_dir = export_saved_model(
+        model=model, model_name=model_name, sequence_lengths=sequence_lengths
+    )
+    tflite_paths = {
+        (sequence_length, quantization): convert_to_tflite(
+            saved_model_dir=saved_model_dir,
+            model_name=model_name,
+            sequence_length=sequence_length,
+            quantization=quantization,
+        )
+        for sequence_length in sequence_lengths
+        for quantization in tflite_quantization_variants
+    }
+    return saved_model_dir, tflite_paths
+
+
+def compare_exported_models(
+    model: tf.keras.Model,
+    model_name: str,
+    features: Dataset,
+    examples: Dataset,
+    sequence_length: int,
+    squad2: bool,
+    num_examples: int = 200,
+    batch_size: int = 8,
+):
+    examples = examples.select(range(min(num_examples, len(examples))))
+    example_ids = set(examples["id"])
+    features = features.filter(lambda feature: feature["example_id"] in example_ids)
+    input_names = __get_model_input_names(model)
+    inputs = {name: np.asarray(features[name], dtype=np.int32) for name in input_names}
+
+    saved_model_dir = (
+        extractive_qa_paths.exported_models_dir / model_name / "saved_model"
+    )
+    signature_key = constants.serving_signature_template.format(
+        sequence_length=sequence_length
+    )
+    saved_model_fn = tf.saved_model.load(str(saved_model_dir)).signatures[signature_key]
+
+    variants = {
+        "fp32": (lambda batch: model(batch, training=False), None),
+        "saved_model": (lambda batch: saved_model_fn(**batch), saved_model_dir),
+    }
+    for quantization in tflite_quantization_variants:
+        tflite_path = (
+            extractive_qa_paths.exported_models_dir
+            / model_name
+            / "tflite"
+            / f"{signature_key}_{quantization}.tflite"
+        )
+        signature_runner = tf.lite.Interpreter(
+            model_path=str(tflite_path)
+        ).get_signature_runner(signature_key)
+        variants[f"tflite_{quantization}"] = (
+            lambda batch, runner=signature_runner: runner(**batch),
+            tflite_path,
+        )
+
+    results = {}
+    for variant_name, (predict_fn, variant_path) in variants.items():
+        start_logits, end_logits, latencies = __predict_in_batches(
+            predict_fn=predict_fn, inputs=inputs, batch_size=batch_size
+        )
+        qa_metrics = __calculate_qa_metrics(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            features=features,
+            examples=examples,
+            squad2=squad2,
+        )
+        results[variant_name] = {
+            "exact_match": qa_metrics["exact_match"],
+            "f1": qa_metrics["f1"],
+            "mean_batch_latency": float(np.mean(latencies)),
+            "p95_batch_latency": float(np.percentile(latencies, 95)),
+            "size_in_bytes": (
+                __get_path_size_in_bytes(variant_path)
+                if variant_path is not None
+                else model_registry.get_model_size_in_bytes(model)
+            ),
+        }
+
+    reference = results["fp32"]
+    for variant_results in results.values():
+        variant_results["exact_match_delta"] = (
+            variant_results["exact_match"] - reference["exact_match"]
+        )
+        variant_results["f1_delta"] = variant_results["f1"] - reference["f1"]
+        variant_results["speedup"] = (
+            reference["mean_batch_latency"] / variant_results["mean_batch_latency"]
+        )
+
+    return results
+
+
+def __predict_in_batches(predict_fn, inputs: dict, batch_size: int):
+    num_features = len(next(iter(inputs.values())))
+    start_logits = []
+    end_logits = []
+    latencies = []
+
+    for batch_start in range(0, num_features, batch_size):
+        batch = {
+            name: values[batch_start : batch_start + batch_size]
+            for name, values in inputs.items()
+        }
+        start_time = timer()
+        output = predict_fn(batch)
+        latencies.append(timer() - start_time)
+
+        start_logits.append(
+            np.asarray(
+                predictions.get_preds(
+                    output, output_key="start_logits", return_type="logits"
+                )
+            )
+        )
+        end_logits.append(
+            np.asarray(
+                predictions.get_preds(
+                    output, output_key="end_logits", return_type="logits"
+                )
+            )
+        )
+
+    return np.concatenate(start_logits), np.concatenate(end_logits), latencies
+
+
+def __calculate_qa_metrics(
+    start_logits: np.ndarray,
+    end_logits: np.ndarray,
+    features: Dataset,
+    examples: Dataset,
+    squad2: bool,
+):
+    predicted_texts = evaluation.get_predicted_texts_function(squad2)(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        examples=examples,
+    )
+    return evaluation.get_metrics_module(squad2).calculate_squad_qa_metrics(
+        answers=examples["answer_text"],
+        predicted_texts=predicted_texts,
+        normalize=True,
+    )
+
+
+def __get_model_input_names(model: tf.keras.Model):
+    return evaluation.get_model_input_names(model.input_signature)
+
+
+def __get_path_size_in_bytes(path: Path):
+    if path.is_file():
+        return path.stat().st_size
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from . import evaluation
+from .model_management import load_model
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget_bytes: int, loader=load_model):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.loader = loader
+
+        self._models = OrderedDict()
+        self._model_sizes = {}
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_model(
+        self,
+        model_checkpoint: str,
+        model_name: str,
+        warmup_sequence_lengths: list[int] | None = None,
+        warmup_batch_size: int = 1,
+    ) -> tf.keras.Model:
+        key = (model_checkpoint, model_name)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key]
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model, the others wait for it
+        with loading_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key]
+                self.misses += 1
+
+            model = self.loader(
+                model_checkpoint=model_checkpoint, model_name=model_name
+            )
+            if warmup_sequence_lengths:
+                warmup_model(
+                    model=model,
+                    sequence_lengths=warmup_sequence_lengths,
+                    batch_size=warmup_batch_size,
+                )
+
+            with self._lock:
+                self._models[key] = model
+                self._model_sizes[key] = get_model_size_in_bytes(model)
+                self._loading_locks.pop(key, None)
+                self.__evict_over_budget()
+
+        return model
+
+    def evict(self, model_checkpoint: str, model_name: str):
+        with self._lock:
+            key = (model_checkpoint, model_name)
+            self._models.pop(key, None)
+            self._model_sizes.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._model_sizes.clear()
+
+    def total_size_in_bytes(self):
+        with self._lock:
+            return sum(self._model_sizes.values())
+
+    def cached_models(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def __evict_over_budget(self):
+        # The most recently loaded model is always kept, even if it exceeds the budget
+        while (
+            len(self._models) > 1
+            and sum(self._model_sizes.values()) > self.memory_budget_bytes
+        ):
+            evicted_key, _ = self._models.popitem(last=False)
+            self._model_sizes.pop(evicted_key)
+
+
+def get_model_size_in_bytes(model: tf.keras.Model):
+    return int(
+        sum(np.prod(weight.shape) * weight.dtype.size for weight in model.weights)
+    )
+
+
+def warmup_model(model: tf.keras.Model, sequence_lengths: list[int], batch_size: int):
+    input_names = evaluation.get_model_input_names(model.input_signature)
+    for sequence_length in sequence_lengths:
+        dummy_batch = {
+            name: tf.ones((batch_size, sequence_length), dtype=tf.int32)
+            for name in input_names
+        }
+        model(dummy_batch, training=False)
+        model.predict_on_batch(dummy_batch)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_default_registry(memory_budget_bytes: int = 4 * 1024**3) -> ModelRegistry:
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry(memory_budget_bytes=memory_budget_bytes)
+        return _default_registry
+
+
+def get_model(
+    model_checkpoint: str,
+    model_name: str,
+    warmup_sequence_lengths: list[int] | None = None,
+) -> tf.keras.Model:
+    return get_default_registry().get_model(
+        model_checkpoint=model_checkpoint,
+        model_name=model_name,
+        warmup_sequence_lengths=warmup_sequence_lengths,
+    )
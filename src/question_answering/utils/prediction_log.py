@@ -0,0 +1,152 @@
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset
+
+from . import instrumentation
+from .__helpers import create_dirs_if_not_exists
+
+prediction_log_filename = "predictions.arrow"
+
+
+def get_context_token_counts(features: Dataset, examples: Dataset):
+    # Strided windows overlap, so distinct context offsets are counted per example
+    example_to_offsets = defaultdict(set)
+    example_to_num_features = defaultdict(int)
+    for example_id, offsets in zip(features["example_id"], features["offset_mapping"]):
+        example_to_offsets[example_id].update(
+            tuple(offset) for offset in offsets if offset is not None
+        )
+        example_to_num_features[example_id] += 1
+
+    return (
+        [len(example_to_offsets[example_id]) for example_id in examples["id"]],
+        [example_to_num_features[example_id] for example_id in examples["id"]],
+    )
+
+
+@instrumentation.instrument(items_arg="examples")
+def build_prediction_log(
+    examples: Dataset,
+    variants: list[str],
+    predicted_texts_variants: list[list[str]],
+    scores_variants: list[list[float]],
+    is_correct_variants: list[list[bool]],
+    features: Dataset | None = None,
+):
+    answers = examples["answer_text"]
+    example_columns = {
+        "id": pa.array(examples["id"]).dictionary_encode(),
+        "question_word_count": pa.array(
+            [len(question.split()) for question in examples["question"]],
+            type=pa.int32(),
+        ),
+        "context_word_count": pa.array(
+            [len(context.split()) for context in examples["context"]],
+            type=pa.int32(),
+        ),
+        "answer_word_count": pa.array(
+            [
+                len(valid_answers[0].split()) if valid_answers else 0
+                for valid_answers in answers
+            ],
+            type=pa.int32(),
+        ),
+        "gold_answers": pa.array(answers, type=pa.list_(pa.string())),
+        "is_answerable": pa.array(
+            [len(valid_answers) > 0 for valid_answers in answers], type=pa.bool_()
+        ),
+    }
+    if features is not None:
+        context_token_counts, num_features = get_context_token_counts(
+            features, examples
+        )
+        example_columns["context_token_count"] = pa.array(
+            context_token_counts, type=pa.int32()
+        )
+        example_columns["num_features"] = pa.array(num_features, type=pa.int16())
+
+    # Example columns are shared by all variants, one chunk per variant
+    table = pa.concat_tables([pa.table(example_columns)] * len(variants))
+    predicted_texts = [text for texts in predicted_texts_variants for text in texts]
+    variant_columns = {
+        "variant": pa.array(
+            np.repeat(variants, len(examples)).tolist()
+        ).dictionary_encode(),
+        "predicted_text": pa.array(predicted_texts, type=pa.string()),
+        "score": pa.array(np.concatenate(scores_variants).astype(np.float16)),
+        "is_correct": pa.array(np.concatenate(is_correct_variants), type=pa.bool_()),
+        "is_predicted_empty": pa.array(
+            [predicted_text == "" for predicted_text in predicted_texts],
+            type=pa.bool_(),
+        ),
+    }
+    for name, column in variant_columns.items():
+        table = table.append_column(name, column)
+    return table
+
+
+@instrumentation.instrument()
+def save_prediction_log(
+    table: pa.Table, dir_path: Path, filename: str = prediction_log_filename
+):
+    create_dirs_if_not_exists(dir_path)
+    # Arrow IPC files can be memory-mapped back without copying or parsing
+    with pa.OSFile(str(dir_path / filename), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def load_prediction_log(path: Path):
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def slice_prediction_log(
+    table: pa.Table,
+    word_count_column: str = "context_word_count",
+    min_word_count: int | None = None,
+    max_word_count: int | None = None,
+    is_correct: bool | None = None,
+    is_answerable: bool | None = None,
+    variant: str | None = None,
+):
+    mask = pa.array(np.ones(table.num_rows, dtype=bool))
+    if variant is not None:
+        mask = pc.and_(mask, pc.equal(table["variant"].cast(pa.string()), variant))
+    if min_word_count is not None:
+        mask = pc.and_(mask, pc.greater_equal(table[word_count_column], min_word_count))
+    if max_word_count is not None:
+        mask = pc.and_(mask, pc.less_equal(table[word_count_column], max_word_count))
+    if is_correct is not None:
+        mask = pc.and_(mask, pc.equal(table["is_correct"], is_correct))
+    if is_answerable is not None:
+        mask = pc.and_(mask, pc.equal(table["is_answerable"], is_answerable))
+    return table.filter(mask)
+
+
+def get_accuracy_by_word_count(
+    table: pa.Table,
+    word_count_column: str,
+    divider: int,
+    min_threshold: int,
+    max_threshold: int,
+    variant: str | None = None,
+):
+    if variant is not None:
+        table = slice_prediction_log(table, variant=variant)
+    word_counts = table[word_count_column].to_numpy()
+    is_correct = table["is_correct"].to_numpy(zero_copy_only=False)
+    # Same groups as the bars of graphs.plot_correct_predictions_by_word_count
+    lower_boundaries = (word_counts // divider) * divider
+    accuracies = {}
+    for lower_boundary in np.unique(lower_boundaries):
+        upper_boundary = lower_boundary + divider - 1
+        if min_threshold <= lower_boundary and upper_boundary <= max_threshold:
+            in_group = lower_boundaries == lower_boundary
+            accuracies[f"{lower_boundary}-{upper_boundary}"] = float(
+                is_correct[in_group].mean()
+            )
+    return accuracies
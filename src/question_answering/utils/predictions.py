@@ -4,6 +4,8 @@ import numpy as np
 import tensorflow as tf
 from datasets import Dataset
 
+from . import instrumentation
+
 
 def get_preds(
     outputs,
@@ -26,6 +28,7 @@ def get_preds(
                 return classes
 
 
+@instrumentation.instrument(items_arg="examples")
 def get_predicted_texts(
     start_logits: np.ndarray,
     end_logits: np.ndarray,
@@ -33,14 +36,18 @@ def get_predicted_texts(
     examples: Dataset,
     n_best: int = 20,
     max_answer_length: int = 30,
+    return_scores: bool = False,
 ):
     example_to_features = defaultdict(list)
+    # Pruned contexts label each token with its kept segment
+    has_segments = "context_segment" in features.column_names
 
     for idx, feature in enumerate(features):
         example_id = feature["example_id"]
         example_to_features[example_id].append(idx)
 
     predicted_answers = []
+    predicted_scores = []
     for example in examples:
         example_id = example["id"]
         context = example["context"]
@@ -51,6 +58,9 @@ def get_predicted_texts(
             start_logit = start_logits[feature_index]
             end_logit = end_logits[feature_index]
             offsets = features[feature_index]["offset_mapping"]
+            segments = (
+                features[feature_index]["context_segment"] if has_segments else None
+            )
 
             best_start_indices = np.argsort(start_logit)[-1 : -n_best - 1 : -1].tolist()
             best_end_indices = np.argsort(end_logit)[-1 : -n_best - 1 : -1].tolist()
@@ -59,6 +69,12 @@ def get_predicted_texts(
                     # Skip answers that are not fully in the context
                     if offsets[start_index] is None or offsets[end_index] is None:
                         continue
+                    # Skip answers spanning text that was pruned away
+                    if (
+                        segments is not None
+                        and segments[start_index] != segments[end_index]
+                    ):
+                        continue
                     # Skip answers with a length that is either < 0 or > max_answer_length
                     if (
                         end_index < start_index
@@ -78,12 +94,17 @@ def get_predicted_texts(
         if len(answers) > 0:
             best_answer = max(answers, key=lambda x: x["logit_score"])
             predicted_answers.append(best_answer["text"])
+            predicted_scores.append(float(best_answer["logit_score"]))
         else:
             predicted_answers.append("")
+            predicted_scores.append(float("nan"))
 
+    if return_scores:
+        return predicted_answers, predicted_scores
     return predicted_answers
 
 
+@instrumentation.instrument(items_arg="examples")
 def get_predicted_texts_squad2(
     start_logits: np.ndarray,
     end_logits: np.ndarray,
@@ -91,14 +112,18 @@ def get_predicted_texts_squad2(
     examples: Dataset,
     n_best: int = 20,
     max_answer_length: int = 30,
+    return_scores: bool = False,
 ):
     example_to_features = defaultdict(list)
+    # Pruned contexts label each token with its kept segment
+    has_segments = "context_segment" in features.column_names
 
     for idx, feature in enumerate(features):
         example_id = feature["example_id"]
         example_to_features[example_id].append(idx)
 
     predicted_answers = []
+    predicted_scores = []
     for example in examples:
         example_id = example["id"]
         context = example["context"]
@@ -109,6 +134,9 @@ def get_predicted_texts_squad2(
             start_logit = start_logits[feature_index]
             end_logit = end_logits[feature_index]
             offsets = features[feature_index]["offset_mapping"]
+            segments = (
+                features[feature_index]["context_segment"] if has_segments else None
+            )
 
             best_start_indices = np.argsort(start_logit)[-1 : -n_best - 1 : -1].tolist()
             best_end_indices = np.argsort(end_logit)[-1 : -n_best - 1 : -1].tolist()
@@ -123,6 +151,12 @@ def get_predicted_texts_squad2(
                     # Skip answers that are not fully in the context
                     elif offsets[start_index] is None or offsets[end_index] is None:
                         continue
+                    # Skip answers spanning text that was pruned away
+                    elif (
+                        segments is not None
+                        and segments[start_index] != segments[end_index]
+                    ):
+                        continue
                     # Skip answers with a length that is either < 0 or > max_answer_length
                     elif (
                         end_index < start_index
@@ -143,7 +177,11 @@ def get_predicted_texts_squad2(
         if len(answers) > 0:
             best_answer = max(answers, key=lambda x: x["logit_score"])
             predicted_answers.append(best_answer["text"])
+            predicted_scores.append(float(best_answer["logit_score"]))
         else:
             predicted_answers.append("")
+            predicted_scores.append(float("nan"))
 
+    if return_scores:
+        return predicted_answers, predicted_scores
     return predicted_answers
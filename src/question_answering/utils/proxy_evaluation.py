@@ -0,0 +1,200 @@
+from collections import Counter
+from timeit import default_timer as timer
+
+import numpy as np
+import tensorflow as tf
+from datasets import Dataset
+
+from . import core_preprocessing, core_qa_utils, evaluation
+from .__helpers import exact_match_score, f1_score
+
+
+def get_length_buckets(contexts: list[str], num_buckets: int = 4):
+    word_counts = np.array([len(context.split()) for context in contexts])
+    # Quantile edges give buckets of roughly equal size
+    edges = np.quantile(word_counts, np.linspace(0, 1, num_buckets + 1)[1:-1])
+    return np.searchsorted(edges, word_counts, side="right")
+
+
+def get_strata(examples: Dataset, squad2: bool, num_length_buckets: int = 4):
+    length_buckets = get_length_buckets(examples["context"], num_length_buckets)
+    if not squad2:
+        return [(int(bucket),) for bucket in length_buckets]
+    return [
+        (int(bucket), len(answers) > 0)
+        for bucket, answers in zip(length_buckets, examples["answer_text"])
+    ]
+
+
+def select_stratified_subset(
+    examples: Dataset,
+    subset_size: int,
+    squad2: bool,
+    num_length_buckets: int = 4,
+    seed: int = 42,
+):
+    strata = get_strata(examples, squad2, num_length_buckets)
+    if subset_size >= len(examples):
+        return examples, __count_strata(strata)
+
+    stratum_indices = {}
+    for index, stratum in enumerate(strata):
+        stratum_indices.setdefault(stratum, []).append(index)
+
+    # Proportional allocation, every stratum keeps at least one sample
+    rng = np.random.default_rng(seed)
+    selected_indices = []
+    for stratum in sorted(stratum_indices):
+        indices = stratum_indices[stratum]
+        stratum_size = max(1, round(subset_size * len(indices) / len(examples)))
+        selected_indices.extend(
+            rng.choice(indices, size=min(stratum_size, len(indices)), replace=False)
+        )
+
+    selected_indices = sorted(int(index) for index in selected_indices)
+    return examples.select(selected_indices), __count_strata(
+        [strata[index] for index in selected_indices]
+    )
+
+
+def calculate_per_sample_scores(
+    answers: list[list[str]], predicted_texts: list[str], squad2: bool, normalize: bool
+):
+    exact_match_scores = np.zeros(len(answers))
+    # Like calculate_squad_qa_metrics for SQuAD2, F1 skips samples without an answer
+    f1_scores = np.full(len(answers), np.nan)
+
+    for i, (valid_answers, predicted_text) in enumerate(zip(answers, predicted_texts)):
+        if len(valid_answers) > 0 and (not squad2 or predicted_text != ""):
+            f1_scores[i] = max(
+                f1_score(
+                    prediction=predicted_text,
+                    valid_answer=valid_answer,
+                    normalize=normalize,
+                )
+                for valid_answer in valid_answers
+            )
+        ground_truths = list(valid_answers)
+        if squad2 and (len(valid_answers) == 0 or predicted_text == ""):
+            ground_truths.append("")
+        exact_match_scores[i] = max(
+            exact_match_score(
+                prediction=predicted_text,
+                valid_answer=ground_truth,
+                normalize=normalize,
+            )
+            for ground_truth in ground_truths or [""]
+        )
+
+    return exact_match_scores, f1_scores
+
+
+def bootstrap_confidence_interval(
+    scores: np.ndarray,
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 42,
+    chunk_size: int = 250,
+):
+    scores = np.asarray(scores, dtype=np.float64)
+    is_valid = ~np.isnan(scores)
+    values = np.where(is_valid, scores, 0.0)
+    rng = np.random.default_rng(seed)
+
+    # Resamples are drawn as index matrices, chunked to bound the memory use
+    resampled_means = []
+    for chunk_start in range(0, num_resamples, chunk_size):
+        num_chunk_resamples = min(chunk_size, num_resamples - chunk_start)
+        indices = rng.integers(0, len(scores), size=(num_chunk_resamples, len(scores)))
+        counts = is_valid[indices].sum(axis=1)
+        resampled_means.append(values[indices].sum(axis=1) / np.maximum(counts, 1))
+    resampled_means = np.concatenate(resampled_means)
+
+    alpha = (1 - confidence) / 2
+    return {
+        "mean": float(values.sum() / max(is_valid.sum(), 1)),
+        "lower": float(np.quantile(resampled_means, alpha)),
+        "upper": float(np.quantile(resampled_means, 1 - alpha)),
+        "std": float(np.std(resampled_means)),
+    }
+
+
+def proxy_evaluate(
+    model: tf.keras.Model,
+    tokenizer,
+    examples: Dataset,
+    squad2: bool,
+    subset_size: int,
+    max_length: int,
+    stride: int | None = None,
+    batch_size: int = 32,
+    num_length_buckets: int = 4,
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 42,
+    n_best: int = 20,
+    max_answer_length: int = 30,
+):
+    start_time = timer()
+    subset, strata_counts = select_stratified_subset(
+        examples=examples,
+        subset_size=subset_size,
+        squad2=squad2,
+        num_length_buckets=num_length_buckets,
+        seed=seed,
+    )
+    subset, features = core_preprocessing.preprocess_examples(
+        examples=subset,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        squad2=squad2,
+        stride=stride,
+    )
+    tf_dataset = core_qa_utils.build_tf_dataset(
+        hf_dataset=features,
+        columns=evaluation.get_model_input_names(features.features),
+        label_cols=None,
+        batch_size=batch_size,
+    )
+    start_logits, end_logits = evaluation.predict_logits(
+        model=model, tf_dataset=tf_dataset, features=features, use_logit_cache=False
+    )
+
+    predicted_texts = evaluation.get_predicted_texts_function(squad2)(
+        start_logits=start_logits,
+        end_logits=end_logits,
+        features=features,
+        examples=subset,
+        n_best=n_best,
+        max_answer_length=max_answer_length,
+    )
+    exact_match_scores, f1_scores = calculate_per_sample_scores(
+        answers=subset["answer_text"],
+        predicted_texts=predicted_texts,
+        squad2=squad2,
+        normalize=True,
+    )
+
+    return {
+        "exact_match": bootstrap_confidence_interval(
+            exact_match_scores, num_resamples, confidence, seed
+        ),
+        "f1": bootstrap_confidence_interval(f1_scores, num_resamples, confidence, seed),
+        "confidence": confidence,
+        "subset_size": len(subset),
+        "full_size": len(examples),
+        "strata": strata_counts,
+        "evaluation_time": timer() - start_time,
+    }
+
+
+def is_clearly_worse(proxy_result: dict, reference_f1: float, margin: float = 0.0):
+    # A run is stopped only when even the optimistic end of the interval falls short
+    return proxy_result["f1"]["upper"] + margin < reference_f1
+
+
+def __count_strata(strata: list[tuple]):
+    return {
+        "-".join(str(value) for value in stratum): count
+        for stratum, count in sorted(Counter(strata).items())
+    }
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from question_answering.paths import extractive_qa_paths
+
+default_seed_pattern = r"\d+$"
+
+
+def flatten_dict(dictionary: dict, prefix: str = ""):
+    flattened = {}
+    for key, value in dictionary.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flattened.update(flatten_dict(value, prefix=name))
+        elif isinstance(value, list):
+            # Per-epoch lists get one entry per epoch, numbered from 1 like epochs
+            flattened.update(
+                flatten_dict(
+                    {f"{i + 1:02d}": item for i, item in enumerate(value)}, prefix=name
+                )
+            )
+        else:
+            flattened[name] = value
+    return flattened
+
+
+class ResultsStore:
+    def __init__(self, db_path: Path = extractive_qa_paths.results_store_path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._connection = sqlite3.connect(str(db_path))
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, run_name TEXT, source TEXT, size INTEGER, "
+            "mtime REAL, content_hash TEXT, ingested REAL);"
+            "CREATE TABLE IF NOT EXISTS metrics "
+            "(run_name TEXT, source TEXT, metric TEXT, value REAL, text TEXT, "
+            "PRIMARY KEY (run_name, source, metric));"
+            "CREATE INDEX IF NOT EXISTS metrics_by_metric ON metrics (metric);"
+        )
+        self._connection.commit()
+
+    def put(self, run_name: str, source: str, dictionary: dict):
+        rows = []
+        for metric, value in flatten_dict(dictionary).items():
+            if isinstance(value, (bool, int, float)) or value is None:
+                rows.append((run_name, source, metric, value, None))
+            else:
+                rows.append((run_name, source, metric, None, str(value)))
+
+        # A source is replaced as a whole, so removed metrics do not linger
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM metrics WHERE run_name = ? AND source = ?",
+                (run_name, source),
+            )
+            self._connection.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def ingest_file(self, path: Path, run_name: str | None = None):
+        run_name = run_name or path.parent.name
+        stat = path.stat()
+        row = self._connection.execute(
+            "SELECT size, mtime, content_hash FROM files WHERE path = ?",
+            (str(path),),
+        ).fetchone()
+        # Unchanged size and mtime skip reading the file at all
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return False
+
+        content = path.read_bytes()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if row is None or row[2] != content_hash:
+            self.put(run_name, path.stem, json.loads(content))
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    run_name,
+                    path.stem,
+                    stat.st_size,
+                    stat.st_mtime,
+                    content_hash,
+                    time.time(),
+                ),
+            )
+        return row is None or row[2] != content_hash
+
+    def ingest_directory(
+        self, directory: Path = extractive_qa_paths.model_evaluation_dir
+    ):
+        ingested = 0
+        skipped = 0
+        for path in sorted(directory.glob("*/*.json")):
+            if self.ingest_file(path):
+                ingested += 1
+            else:
+                skipped += 1
+        return {"ingested": ingested, "skipped": skipped}
+
+    def query(self, sql: str, params: tuple = ()):
+        return pd.read_sql_query(sql, self._connection, params=params)
+
+    def get_runs_table(
+        self, metrics: list[str] | None = None, run_name_pattern: str | None = None
+    ):
+        # Stored long, returned wide with one column per "source.metric"
+        conditions = []
+        params = []
+        if metrics is not None:
+            conditions.append(
+                "source || '.' || metric IN (" + ", ".join("?" * len(metrics)) + ")"
+            )
+            params.extend(metrics)
+        if run_name_pattern is not None:
+            conditions.append("run_name LIKE ?")
+            params.append(run_name_pattern)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        long_table = self.query(
+            "SELECT run_name, source || '.' || metric AS metric, "
+            f"COALESCE(value, text) AS value FROM metrics {where}",
+            tuple(params),
+        )
+        if long_table.empty:
+            return pd.DataFrame()
+        return long_table.pivot(index="run_name", columns="metric", values="value")
+
+    def leaderboard(
+        self,
+        metric: str = "evaluation_data.f1.01_best_normalized",
+        extra_metrics: list[str] | None = None,
+        run_name_pattern: str | None = None,
+        ascending: bool = False,
+        top_k: int | None = None,
+    ):
+        runs_table = self.get_runs_table(
+            metrics=[metric] + (extra_metrics or []),
+            run_name_pattern=run_name_pattern,
+        )
+        if runs_table.empty:
+            return runs_table
+        runs_table = runs_table.dropna(subset=[metric]).sort_values(
+            metric, ascending=ascending
+        )
+        return runs_table.head(top_k) if top_k is not None else runs_table
+
+    def aggregate_seeds(
+        self,
+        metrics: list[str],
+        run_name_pattern: str | None = None,
+        seed_pattern: str = default_seed_pattern,
+    ):
+        # final1..final5 are seeds of one configuration and collapse into "final"
+        runs_table = self.get_runs_table(
+            metrics=metrics, run_name_pattern=run_name_pattern
+        )
+        if runs_table.empty:
+            return runs_table
+        groups = [re.sub(seed_pattern, "", run_name) for run_name in runs_table.index]
+        return (
+            runs_table.astype(float)
+            .groupby(groups)
+            .agg(["mean", "std", "min", "max", "count"])
+        )
+
+    def close(self):
+        self._connection.close()
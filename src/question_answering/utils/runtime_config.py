@@ -0,0 +1,315 @@
+import argparse
+import os
+import platform
+from pathlib import Path
+
+import tensorflow as tf
+
+from question_answering.paths import extractive_qa_paths
+
+from . import core_qa_utils
+
+runtime_config_env_var = "QA_RUNTIME_CONFIG"
+sys_cpu_dir = Path("/sys/devices/system/cpu")
+sys_node_dir = Path("/sys/devices/system/node")
+default_calibration_sequence_length = 384
+
+
+def parse_cpu_list(cpu_list: str):
+    # Kernel format, e.g. "0-3,8-11"
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def get_available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_numa_nodes(cpus: list[int] | None = None):
+    cpus = cpus if cpus is not None else get_available_cpus()
+    numa_nodes = {}
+    for node_dir in sorted(sys_node_dir.glob("node[0-9]*")):
+        node_cpus = sorted(set(parse_cpu_list((node_dir / "cpulist").read_text())))
+        node_cpus = [cpu for cpu in node_cpus if cpu in cpus]
+        if node_cpus:
+            numa_nodes[int(node_dir.name[len("node") :])] = node_cpus
+    return numa_nodes or {0: cpus}
+
+
+def get_physical_cores(cpus: list[int]):
+    # Hyperthread siblings share a core, which is what matmul-heavy ops scale with
+    cores = {}
+    for cpu in cpus:
+        topology_dir = sys_cpu_dir / f"cpu{cpu}" / "topology"
+        try:
+            core_key = (
+                int((topology_dir / "physical_package_id").read_text()),
+                int((topology_dir / "core_id").read_text()),
+            )
+        except (OSError, ValueError):
+            core_key = (0, cpu)
+        cores.setdefault(core_key, []).append(cpu)
+    return [cores[core_key] for core_key in sorted(cores)]
+
+
+def get_cpu_topology():
+    cpus = get_available_cpus()
+    return {
+        "available_cpus": cpus,
+        "num_logical_cpus": len(cpus),
+        "num_physical_cores": len(get_physical_cores(cpus)),
+        "numa_nodes": get_numa_nodes(cpus),
+    }
+
+
+def get_process_cpus(
+    process_index: int = 0, num_processes: int = 1, numa_node: int | None = None
+):
+    numa_nodes = get_numa_nodes()
+    if numa_node is not None:
+        if numa_node not in numa_nodes:
+            raise Exception(f"NUMA node {numa_node} has no available CPUs!")
+        numa_nodes = {numa_node: numa_nodes[numa_node]}
+
+    # Cores ordered node by node, so contiguous slices stay within a node if they fit
+    cores = [
+        core
+        for node_cpus in numa_nodes.values()
+        for core in get_physical_cores(node_cpus)
+    ]
+    if num_processes > len(cores):
+        return sorted(cores[process_index % len(cores)])
+    cores_per_process = len(cores) // num_processes
+    process_cores = cores[
+        process_index * cores_per_process : (process_index + 1) * cores_per_process
+    ]
+    return sorted(cpu for core in process_cores for cpu in core)
+
+
+def get_runtime_config(
+    process_index: int = 0,
+    num_processes: int = 1,
+    numa_node: int | None = None,
+    intra_op_threads: int | None = None,
+    inter_op_threads: int | None = None,
+    pin_cpus: bool = False,
+):
+    cpus = get_process_cpus(process_index, num_processes, numa_node)
+    num_cores = len(get_physical_cores(cpus))
+    intra_op_threads = intra_op_threads or num_cores
+    # Transformer graphs have few independent ops, wide machines get a second one
+    inter_op_threads = inter_op_threads or (2 if num_cores >= 8 else 1)
+    return {
+        "cpus": cpus if pin_cpus else None,
+        "num_physical_cores": num_cores,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        # Several processes per node already use every core, tokenizers stay serial
+        "tokenizers_parallelism": num_processes == 1,
+    }
+
+
+def get_runtime_environ(config: dict):
+    return {
+        "OMP_NUM_THREADS": str(config["intra_op_threads"]),
+        "TOKENIZERS_PARALLELISM": str(config["tokenizers_parallelism"]).lower(),
+        # Size of the Rust tokenizer's own thread pool
+        "RAYON_RS_NUM_CPUS": str(config["intra_op_threads"]),
+    }
+
+
+def apply_runtime_config(config: dict):
+    # Native libraries read these when they start, child processes inherit them
+    os.environ.update(get_runtime_environ(config))
+    if config["cpus"] is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, config["cpus"])
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(config["intra_op_threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(config["inter_op_threads"])
+    except RuntimeError:
+        raise Exception("Threads must be configured before TensorFlow runs any op!")
+    return config
+
+
+def get_calibration_candidates(num_physical_cores: int, num_logical_cpus: int):
+    intra_op_candidates = sorted(
+        {max(1, num_physical_cores // 2), num_physical_cores, num_logical_cpus}
+    )
+    return [
+        f"{intra_op_threads}:{inter_op_threads}"
+        for intra_op_threads in intra_op_candidates
+        for inter_op_threads in [1, 2]
+    ]
+
+
+def get_calibration_key(
+    model_checkpoint: str | None = None,
+    model_name: str | None = None,
+    sequence_length: int = default_calibration_sequence_length,
+):
+    # Without a checkpoint the latency benchmark measures its tiny synthetic reader
+    return "|".join(
+        [
+            platform.node(),
+            model_checkpoint or "tiny-synthetic",
+            model_name or "",
+            str(sequence_length),
+        ]
+    )
+
+
+def calibrate_threads(
+    candidates: list[str] | None = None,
+    model_checkpoint: str | None = None,
+    model_name: str | None = None,
+    batch_size: int = 8,
+    sequence_length: int = default_calibration_sequence_length,
+    num_requests: int = 20,
+    objective: str = "examples_per_second",
+):
+    # Imported here, the latency benchmark applies runtime configs itself
+    from question_answering.benchmarks import inference_latency_benchmark
+
+    topology = get_cpu_topology()
+    candidates = candidates or get_calibration_candidates(
+        topology["num_physical_cores"], topology["num_logical_cpus"]
+    )
+    benchmark_args = ["--batch-sizes", str(batch_size)]
+    benchmark_args += ["--sequence-lengths", str(sequence_length)]
+    benchmark_args += ["--num-requests", str(num_requests)]
+    if model_checkpoint is not None:
+        benchmark_args += ["--model-checkpoint", model_checkpoint]
+    if model_name is not None:
+        benchmark_args += ["--model-name", model_name]
+    args = inference_latency_benchmark.get_argument_parser().parse_args(benchmark_args)
+
+    # Each candidate runs in a fresh process, thread pools are fixed at start-up
+    results = []
+    for candidate in candidates:
+        results.extend(inference_latency_benchmark.run_thread_config(args, candidate))
+    if objective == "examples_per_second":
+        best_result = max(results, key=lambda result: result[objective])
+    else:
+        best_result = min(results, key=lambda result: result[objective])
+
+    return {
+        "key": get_calibration_key(model_checkpoint, model_name, sequence_length),
+        "host": platform.node(),
+        "num_logical_cpus": topology["num_logical_cpus"],
+        "model_checkpoint": model_checkpoint,
+        "model_name": model_name,
+        "sequence_length": sequence_length,
+        "intra_op_threads": best_result["intra_op_threads"],
+        "inter_op_threads": best_result["inter_op_threads"],
+        "objective": objective,
+        "results": results,
+    }
+
+
+def save_calibrated_threads(
+    calibration: dict, path: Path = extractive_qa_paths.runtime_config_path
+):
+    calibrations = (
+        core_qa_utils.read_json_as_dict(path).get("calibrations", {})
+        if path.is_file()
+        else {}
+    )
+    calibrations[calibration["key"]] = calibration
+    core_qa_utils.save_dict_as_json(
+        {"calibrations": calibrations}, dir_path=path.parent, filename=path.name
+    )
+
+
+def load_calibrated_threads(
+    model_checkpoint: str | None = None,
+    model_name: str | None = None,
+    sequence_length: int = default_calibration_sequence_length,
+    path: Path = extractive_qa_paths.runtime_config_path,
+):
+    if not path.is_file():
+        return None
+    calibration = (
+        core_qa_utils.read_json_as_dict(path)
+        .get("calibrations", {})
+        .get(get_calibration_key(model_checkpoint, model_name, sequence_length))
+    )
+    # A calibration only holds for the model, machine and CPU set it was measured on
+    if calibration is None or calibration["num_logical_cpus"] != len(
+        get_available_cpus()
+    ):
+        return None
+    return calibration
+
+
+def add_runtime_config_args(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("runtime configuration")
+    group.add_argument("--intra-op-threads", type=int, default=None)
+    group.add_argument("--inter-op-threads", type=int, default=None)
+    group.add_argument("--numa-node", type=int, default=None)
+    group.add_argument("--pin-cpus", action="store_true")
+    group.add_argument(
+        "--calibrate-threads",
+        action="store_true",
+        help="measure thread candidates first and keep the fastest for this machine",
+    )
+    return parser
+
+
+def configure_runtime_from_args(
+    args: argparse.Namespace,
+    process_index: int = 0,
+    num_processes: int = 1,
+    model_checkpoint: str | None = None,
+    model_name: str | None = None,
+    sequence_length: int | None = None,
+    verbose: bool = False,
+):
+    # QA_RUNTIME_CONFIG=off keeps TensorFlow's default threading
+    if os.environ.get(runtime_config_env_var, "").strip().lower() == "off":
+        return None
+
+    intra_op_threads = args.intra_op_threads
+    inter_op_threads = args.inter_op_threads
+    if intra_op_threads is None and inter_op_threads is None and num_processes == 1:
+        # Threads are calibrated on the run's own model, at its sequence length
+        calibration_model = {
+            "model_checkpoint": model_checkpoint,
+            "model_name": model_name,
+            "sequence_length": sequence_length or default_calibration_sequence_length,
+        }
+        calibration = None
+        if args.calibrate_threads:
+            calibration = calibrate_threads(**calibration_model)
+            save_calibrated_threads(calibration)
+        calibration = calibration or load_calibrated_threads(**calibration_model)
+        if calibration is not None:
+            intra_op_threads = calibration["intra_op_threads"]
+            inter_op_threads = calibration["inter_op_threads"]
+
+    config = apply_runtime_config(
+        get_runtime_config(
+            process_index=process_index,
+            num_processes=num_processes,
+            numa_node=args.numa_node,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+            pin_cpus=args.pin_cpus,
+        )
+    )
+    if verbose:
+        print(
+            f"Runtime config: {config['intra_op_threads']} intra-op and "
+            f"{config['inter_op_threads']} inter-op threads"
+            + (f", pinned to CPUs {config['cpus']}" if config["cpus"] else "")
+        )
+    return config
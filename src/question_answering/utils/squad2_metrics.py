@@ -1,5 +1,6 @@
 import evaluate
 
+from . import instrumentation
 from .__helpers import (
     ensure_same_sizes,
     exact_match_score,
@@ -9,6 +10,7 @@ from .__helpers import (
 )
 
 
+@instrumentation.instrument(items_arg="start_actual")
 def calculate_squad_metrics_stats(
     start_actual: list[list[int]],
     end_actual: list[list[int]],
@@ -55,6 +57,7 @@ def calculate_squad_metrics_stats(
     }
 
 
+@instrumentation.instrument(items_arg="start_actual")
 def calculate_squad_accuracies(
     start_actual: list[list[int]],
     end_actual: list[list[int]],
@@ -102,6 +105,7 @@ def calculate_squad_accuracies(
     }
 
 
+@instrumentation.instrument(items_arg="answers")
 def calculate_squad_qa_metrics(
     answers: list[list[str]], predicted_texts: list[str], normalize: bool
 ):
@@ -138,7 +142,8 @@ def calculate_squad_qa_metrics(
                 normalize=normalize,
             )
         else:
-            valid_answers.append("")
+            # Extended as a new list, the caller's answers stay untouched
+            valid_answers = [*valid_answers, ""]
 
         exact_match_metric += __metric_max_over_ground_truths(
             metric_fn=exact_match_score,
@@ -155,6 +160,7 @@ def calculate_squad_qa_metrics(
     }
 
 
+@instrumentation.instrument(items_arg="answers")
 def get_is_correctly_predicted(
     answers: list[list[str]], predicted_texts: list[str], normalize: bool
 ):
@@ -167,7 +173,7 @@ def get_is_correctly_predicted(
 
         # Ensure correct calculation for samples with no answer
         if len(valid_answers) == 0:
-            valid_answers.append("")
+            valid_answers = [""]
 
         is_correctly_predicted.append(
             __metric_max_over_ground_truths(
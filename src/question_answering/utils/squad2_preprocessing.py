@@ -1,6 +1,9 @@
 from datasets import Dataset
 
+from .instrumentation import instrument, measure
 
+
+@instrument(items_arg="dataset")
 def preprocess_squad2_training_dataset_no_stride(
     dataset: Dataset,
     tokenizer,
@@ -12,13 +15,14 @@ def preprocess_squad2_training_dataset_no_stride(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         answer_starts = samples["answer_start"]
@@ -71,6 +75,7 @@ def preprocess_squad2_training_dataset_no_stride(
     )
 
 
+@instrument(items_arg="dataset")
 def preprocess_squad2_test_dataset_no_stride(
     dataset: Dataset,
     tokenizer,
@@ -82,13 +87,14 @@ def preprocess_squad2_test_dataset_no_stride(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         answer_starts_batch = samples["answer_start"]
@@ -1,6 +1,9 @@
 from datasets import Dataset
 
+from .instrumentation import instrument, measure
 
+
+@instrument(items_arg="dataset")
 def preprocess_squad_training_dataset(
     dataset: Dataset,
     tokenizer,
@@ -13,16 +16,17 @@ def preprocess_squad_training_dataset(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            truncation="only_second",
-            stride=stride,
-            return_overflowing_tokens=True,
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                truncation="only_second",
+                stride=stride,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         sample_map = inputs.pop("overflow_to_sample_mapping")
@@ -76,6 +80,7 @@ def preprocess_squad_training_dataset(
     )
 
 
+@instrument(items_arg="dataset")
 def preprocess_squad_test_dataset(
     dataset: Dataset,
     tokenizer,
@@ -88,16 +93,17 @@ def preprocess_squad_test_dataset(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            truncation="only_second",
-            stride=stride,
-            return_overflowing_tokens=True,
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                truncation="only_second",
+                stride=stride,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         sample_map = inputs.pop("overflow_to_sample_mapping")
@@ -169,6 +175,7 @@ def preprocess_squad_test_dataset(
     )
 
 
+@instrument(items_arg="dataset")
 def preprocess_squad_training_dataset_no_stride(
     dataset: Dataset,
     tokenizer,
@@ -180,13 +187,14 @@ def preprocess_squad_training_dataset_no_stride(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         answer_starts = samples["answer_start"]
@@ -229,6 +237,7 @@ def preprocess_squad_training_dataset_no_stride(
     )
 
 
+@instrument(items_arg="dataset")
 def preprocess_squad_test_dataset_no_stride(
     dataset: Dataset,
     tokenizer,
@@ -240,13 +249,14 @@ def preprocess_squad_test_dataset_no_stride(
         questions = [q.strip() for q in samples["question"]]
         contexts = [c.strip() for c in samples["context"]]
 
-        inputs = tokenizer(
-            questions,
-            contexts,
-            max_length=max_length,
-            padding="max_length",
-            return_offsets_mapping=True,
-        )
+        with measure("tokenization", items=len(questions)):
+            inputs = tokenizer(
+                questions,
+                contexts,
+                max_length=max_length,
+                padding="max_length",
+                return_offsets_mapping=True,
+            )
 
         offset_mapping = inputs.pop("offset_mapping")
         answer_starts_batch = samples["answer_start"]